@@ -0,0 +1,273 @@
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from benchmark import measure
+from reference import ReferenceSample
+from synthetic import SyntheticTrail
+import centroids
+import kernels
+import metrics
+
+
+# Synthetic trails the checks run on, (name, SyntheticTrail arguments)
+CASES = (("gaussian", dict(psf="gaussian")),
+         ("moffat", dict(psf="moffat", beta=2.5)),
+         ("calm", dict(wobble=0, scintillation=0)),
+         ("wobbly", dict(wobble=1.5, wobble_correlation=.95)),
+         ("sloped", dict(slope=.02)),
+         ("faint", dict(flux=3e3)),
+         ("long", dict(length=600, diameter=25, fwhm=5)))
+
+
+class Check:
+    def __init__(self, name, reference, candidate, rtol=1e-9, atol=1e-9, truth=None):
+        """Check(name, reference, candidate, rtol=1e-9, atol=1e-9, truth=None)
+        Param:
+        reference = callable(ReferenceSample): frozen implementation
+        candidate = callable(DataSample): implementation under test, has to match reference within rtol/atol
+        truth = callable(SyntheticTrail): ground truth value, only reported, to see how far both are off"""
+        self.name = name
+        self.reference = reference
+        self.candidate = candidate
+        self.rtol = rtol
+        self.atol = atol
+        self.truth = truth
+
+
+CHECKS = []
+
+
+def register_check(name, reference, candidate, rtol=1e-9, atol=1e-9, truth=None):
+    """register_check(name, reference, candidate, rtol=1e-9, atol=1e-9, truth=None)
+    adds a check to the harness, used for every faster rewrite that has to reproduce the published numbers"""
+    check = Check(name, reference, candidate, rtol=rtol, atol=atol, truth=truth)
+    CHECKS.append(check)
+    return check
+
+
+def _first(value):  # the width of the FWHM tuples, arrays as they are
+    return value[0] if isinstance(value, tuple) else value
+
+
+def _batch(func):  # runs a batch metric on a single sample
+    return lambda s: func([s], s.data[None])[0]
+
+
+register_check("get_maximum_shift", lambda r: r.get_maximum_shift(), lambda s: s.get_maximum_shift(),
+               truth=lambda t: len(t.data) // 2 - t.true_centroid)
+register_check("get_realigned_to_maximum", lambda r: r.get_realigned_to_maximum(), lambda s: s.get_realigned_to_maximum())
+register_check("get_fwhm", lambda r: r.get_fwhm()[0], lambda s: s.get_fwhm()[0], truth=lambda t: t.true_fwhm)
+register_check("get_realigned_fwhm", lambda r: r.get_realigned_fwhm()[0], lambda s: s.get_realigned_fwhm()[0], truth=lambda t: t.true_fwhm)
+register_check("get_slope_adjusted_fwhm", lambda r: r.get_slope_adjusted_fwhm()[0], lambda s: s.get_slope_adjusted_fwhm()[0], truth=lambda t: t.true_fwhm)
+register_check("get_snr", lambda r: r.get_snr(), lambda s: s.get_snr())
+register_check("signal", lambda r: r.signal, lambda s: s.signal, truth=lambda t: np.sum(t.true_flux))
+register_check("get_flattened_moving_average", lambda r: r.get_flattened_moving_average(), lambda s: s.get_flattened_moving_average())
+register_check("get_moving_stddev_from_numbers", lambda r: r.get_moving_stddev_from_numbers(), lambda s: s.get_moving_stddev_from_numbers())
+register_check("get_moving_stddev_from_SNR", lambda r: r.get_moving_stddev_from_SNR(), lambda s: s.get_moving_stddev_from_SNR())
+register_check("get_maximum_shift_moving_average", lambda r: r.get_maximum_shift_moving_average(), lambda s: s.get_maximum_shift_moving_average())
+register_check("get_slope_adjusted_t_y", lambda r: r.get_slope_adjusted_t_y(), lambda s: s.get_slope_adjusted_t_y())
+
+register_check("centroids.boxcar", lambda r: r.get_maximum_shift(), lambda s: len(s.data) // 2 - centroids.boxcar(s.data))
+for _method in ("com", "parabolic", "gaussian"):  # subpixel centroids stay within a pixel of the boxcar scan and get closer to the truth
+    register_check(f"centroids.{_method}", lambda r: r.get_maximum_shift(), lambda s, m=_method: s.get_maximum_shift(centroid=m), rtol=0, atol=1,
+                   truth=lambda t: len(t.data) // 2 - t.true_centroid)
+# same FWHM definition (kernels.fwhm), but shift-and-add is a different realignment, only held within 10 % of the whole
+# pixel one; see the truth errors
+register_check("get_subpixel_fwhm", lambda r: r.get_realigned_fwhm()[0], lambda s: s.get_subpixel_fwhm()[0], rtol=.1,
+               truth=lambda t: t.true_fwhm)
+
+register_check("kernels.fwhm_batch", lambda r: r.get_realigned_fwhm()[0], lambda s: kernels.fwhm_batch(s.get_realigned_crosssection()[:, None])[0])
+
+register_check("metrics.batch_maximum_shift", lambda r: r.get_maximum_shift(), lambda s: metrics.batch_maximum_shift(s.data[None])[0])
+register_check("metrics.SNR", lambda r: r.get_snr(), _batch(metrics._batch_snr))
+register_check("metrics.Y-Variations over 5s", lambda r: np.std(r.get_slope_adjusted_t_y(interval=round(5 / r.time_per_pix))),
+               _batch(metrics._batch_y_variation), rtol=1e-7)
+
+
+
+def _scintillation_index(line):  # textbook definitions the FFT scintillation statistics are checked against
+    return np.var(line) / np.mean(line) ** 2
+
+
+def _structure_function(line, lag):
+    line = line / np.mean(line)
+    return np.mean((line[lag:] - line[:len(line) - lag]) ** 2)
+
+
+register_check("metrics.Scintillation Index", lambda r: _scintillation_index(r.get_flattened_line()), _batch(metrics._batch_scintillation_index),
+               truth=lambda t: _scintillation_index(t.true_flux))
+register_check("metrics.Structure Function 1s", lambda r: _structure_function(r.get_flattened_line(), round(1 / r.time_per_pix)),
+               _batch(metrics._batch_structure_function), rtol=1e-7)
+
+
+def _with_backend(backend, method):
+    def candidate(s):
+        with kernels.using(backend):
+            return method(s)
+    return candidate
+
+
+# every compiled kernel backend has to reproduce the frozen reference just like the numpy one
+for _backend in kernels.available_backends()[1:]:
+    for _name in ("get_maximum_shift", "get_realigned_to_maximum", "get_slope_adjusted_data", "get_fwhm", "get_realigned_fwhm",
+                  "get_slope_adjusted_fwhm"):
+        register_check(f"kernels.{_backend}.{_name}", lambda r, n=_name: _first(getattr(r, n)()),
+                       _with_backend(_backend, lambda s, n=_name: _first(getattr(s, n)())))
+
+
+def _kernel_edge_cases():  # (case, kernel name, args) inputs at the edges of every kernel, the layouts of kernels.py
+    rng = np.random.default_rng(0)
+    stack = rng.random((2, 40, 12)) * 100
+    stack[:, :, 5] = 0                                  # all zero column
+    stack[0, :3, 7] += 1000                             # peak at the upper border
+    stack[1, -3:, 9] += 1000                            # peak at the lower border
+
+    profile = np.exp(-(np.arange(21) - 10.) ** 2 / 8) * 1000
+    profiles = {"peak": profile, "peak at lower border": profile[10:], "peak at upper border": profile[:11],
+                "no half maximum": np.full(21, 500.), "zero": np.zeros(21), "float32 peak": profile.astype(np.float32)}
+
+    cases = []
+    for name, data in (("edges", stack), ("all zero", np.zeros((1, 40, 12))), ("short", stack[:, :6])):
+        cases.append((name, "boxcar", (data, 5)))
+        for columns in np.swapaxes(data, 1, 2):
+            cases.append((name, "track_maximum", (columns, 5)))
+        cases.append((name, "shift_rows", (np.swapaxes(data, 1, 2)[0], [-50, -3, 0, 3, 50, 1, -1, 0, 2, 40, -40, 7])))
+    for name, p in profiles.items():
+        for lower_shift in (0, 1):
+            cases.append((name, "fwhm", (p, lower_shift)))
+    return cases
+
+
+def _kernel_outcome(kernel, args):  # result as float array, or the name of the exception it raised
+    try:
+        with np.errstate(all="ignore"):
+            return np.asarray(kernel(*args), dtype=float)
+    except Exception as e:
+        return type(e).__name__
+
+
+def run_kernel_checks(select=None):
+    """run_kernel_checks(select=None)
+    calls every kernel of every compiled backend directly on the edge cases and compares bit for bit with the numpy
+    reference, raised exceptions included"""
+    results = []
+    for backend in kernels.available_backends()[1:]:
+        for case, kernel, args in _kernel_edge_cases():
+            name = f"kernels.{backend}.{kernel}"
+            kernel = getattr(kernels, kernel)
+            if select and select not in name:
+                continue
+
+            with kernels.using("numpy"):
+                reference = _kernel_outcome(kernel, args)
+            with kernels.using(backend):
+                candidate = _kernel_outcome(kernel, args)
+
+            if isinstance(reference, str) or isinstance(candidate, str):
+                passed = reference == candidate
+            else:
+                passed = reference.shape == candidate.shape and np.array_equal(reference, candidate, equal_nan=True)
+            abs_error, rel_error = (None, None) if isinstance(reference, str) or isinstance(candidate, str) else _error(reference, candidate)
+            results.append({"check": name, "passed": bool(passed), "abs_error": abs_error, "rel_error": rel_error, "case": case, "seed": None,
+                            **({} if passed else {"error": f"reference {reference!r}, {backend} {candidate!r}"})})
+    return results
+
+
+def _error(reference, candidate):  # largest absolute and relative deviation, None if the shapes differ
+    reference = np.atleast_1d(np.asarray(reference, dtype=float))
+    candidate = np.atleast_1d(np.asarray(candidate, dtype=float))
+    if reference.shape != candidate.shape:
+        return None, None
+    if not reference.size:
+        return 0., 0.
+    with np.errstate(invalid="ignore"):     # inf - inf
+        diff = np.abs(reference - candidate)
+    diff[(reference == candidate) | (np.isnan(reference) & np.isnan(candidate))] = 0
+    return float(np.max(diff)), float(np.max(diff / np.maximum(np.abs(reference), 1e-300)))
+
+
+def run_check(check, trail, timed=True):
+    sample = trail.sample()
+    reference_sample = ReferenceSample.from_sample(sample)
+
+    result = {"check": check.name}
+    try:
+        reference = check.reference(reference_sample)
+        candidate = check.candidate(sample)
+    except Exception as e:
+        result.update(passed=False, error=f"{type(e).__name__}: {e}")
+        return result
+
+    abs_error, rel_error = _error(reference, candidate)
+    passed = abs_error is not None and np.allclose(np.asarray(candidate, dtype=float), np.asarray(reference, dtype=float),
+                                                   rtol=check.rtol, atol=check.atol, equal_nan=True)
+    result.update(passed=bool(passed), abs_error=abs_error, rel_error=rel_error)
+
+    if check.truth is not None:
+        truth = np.asarray(check.truth(trail), dtype=float)
+        if truth.shape == np.shape(reference) or not truth.shape:
+            result["reference_truth_error"] = float(np.sqrt(np.mean((np.asarray(reference, dtype=float) - truth) ** 2)))
+            result["candidate_truth_error"] = float(np.sqrt(np.mean((np.asarray(candidate, dtype=float) - truth) ** 2)))
+
+    if timed:
+        reference_time = measure(lambda: check.reference(reference_sample), repeats=3, min_time=.05)["median_s"]
+        candidate_time = measure(lambda: check.candidate(sample), repeats=3, min_time=.05)["median_s"]
+        result.update(reference_s=reference_time, candidate_s=candidate_time, speedup=reference_time / max(candidate_time, 1e-12))
+
+    return result
+
+
+def run(select=None, seeds=(0, 1, 2), timed=True):
+    """run(select=None, seeds=(0, 1, 2), timed=True)
+    runs every check whose name contains select on every case and seed. returns the list of results"""
+    results = []
+
+    for case, args in CASES:
+        for seed in seeds:
+            trail = SyntheticTrail(seed=seed, **args)
+            for check in CHECKS:
+                if select and select not in check.name:
+                    continue
+                result = run_check(check, trail, timed=timed)
+                result.update(case=case, seed=seed)
+                results.append(result)
+
+    return results
+
+
+def print_summary(results):
+    by_check = {}
+    for r in results:
+        by_check.setdefault(r["check"], []).append(r)
+
+    for name, rs in by_check.items():
+        failed = [r for r in rs if not r["passed"]]
+        errors = [r["abs_error"] for r in rs if r.get("abs_error") is not None]
+        speedups = [r["speedup"] for r in rs if "speedup" in r]
+        line = f"{'FAIL' if failed else 'ok':>4} {name:<40} max abs error {max(errors) if errors else float('nan'):10.3g}"
+        if speedups:
+            line += f"  speedup {np.median(speedups):7.2f}x"
+        print(line)
+        for r in failed:
+            print(f"       {r['case']} seed {r['seed']}: {r.get('error', r.get('abs_error'))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks the DataSample implementations against the frozen reference")
+    parser.add_argument("--select", default=None, help="only run checks whose name contains this")
+    parser.add_argument("--seeds", type=int, default=3)
+    parser.add_argument("--no-timing", action="store_true")
+    parser.add_argument("--out", default=None, help="write all results as json")
+    args = parser.parse_args()
+
+    results = run(select=args.select, seeds=range(args.seeds), timed=not args.no_timing) + run_kernel_checks(select=args.select)
+    print_summary(results)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(0 if all(r["passed"] for r in results) else 1)
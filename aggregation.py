@@ -0,0 +1,195 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from datasample import DataSample
+
+
+class QuantileSketch:
+    def __init__(self, max_size=200):
+        """QuantileSketch(max_size=200)
+        mergeable summary of a stream of values: exact count, min, max and mean, approximate quantiles from at most
+        max_size weighted centroids (exact as long as fewer values were added)"""
+        self.max_size = max_size
+        self.count = 0
+        self.total = 0.
+        self.min = np.inf
+        self.max = -np.inf
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        if not len(values):
+            return self
+
+        self.count += len(values)
+        self.total += float(np.sum(values))
+        self.min = min(self.min, float(np.min(values)))
+        self.max = max(self.max, float(np.max(values)))
+
+        self._compress(np.concatenate((self.means, values)), np.concatenate((self.weights, np.ones(len(values)))))
+        return self
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        self._compress(np.concatenate((self.means, other.means)), np.concatenate((self.weights, other.weights)))
+        return self
+
+    def _compress(self, means, weights):
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+
+        if len(means) > self.max_size:  # merge neighbours into max_size centroids of about equal weight
+            edges = np.cumsum(weights) - weights / 2
+            bins = np.minimum((edges / np.sum(weights) * self.max_size).astype(int), self.max_size - 1)
+            new_weights = np.bincount(bins, weights=weights, minlength=self.max_size)
+            new_means = np.bincount(bins, weights=means * weights, minlength=self.max_size)
+            used = new_weights > 0
+            means, weights = new_means[used] / new_weights[used], new_weights[used]
+
+        self.means, self.weights = means, weights
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else np.nan
+
+    def quantile(self, q):
+        if not self.count:
+            return np.nan
+        if len(self.means) == 1:
+            return float(self.means[0])
+
+        positions = np.cumsum(self.weights) - self.weights / 2
+        target = q * np.sum(self.weights)
+        return float(np.interp(target, np.concatenate(([0], positions, [np.sum(self.weights)])),
+                               np.concatenate(([self.min], self.means, [self.max]))))
+
+    @property
+    def median(self):
+        if self.count == len(self.means):   # nothing merged yet, same definition as np.median
+            return float(np.median(self.means)) if self.count else np.nan
+        return self.quantile(.5)
+
+    def summary(self):
+        return {"count": self.count, "min": self.min, "max": self.max, "mean": self.mean, "median": self.median}
+
+
+class AggregationResult:
+    def __init__(self):
+        """AggregationResult()
+        per-file and total sketches of a multi-session aggregation, plus the files that could not be read and the
+        samples that could not be measured"""
+        self.files = {}     # path -> QuantileSketch
+        self.total = QuantileSketch()
+        self.skipped = {}   # path -> number of samples without a finite result
+        self.failures = {}  # path -> {sample name: error message} of the samples whose measurement raised
+        self.errors = {}    # path -> error message
+
+    def add(self, path, sketch, skipped=0, failures=None):
+        self.files[path] = sketch
+        self.skipped[path] = skipped
+        self.failures[path] = failures or {}
+        self.total.merge(sketch)
+
+    def summary(self):
+        return {"files": {path: s.summary() for path, s in self.files.items()},
+                "total": self.total.summary(),
+                "skipped": self.skipped,
+                "failures": self.failures,
+                "errors": self.errors}
+
+
+def fwhm_reduction(sample):  # relative FWHM reduction from slope adjusted to realigned crosssection
+    fwhm = sample.get_slope_adjusted_fwhm()[0]
+    reduced_fwhm = sample.get_realigned_fwhm()[0]
+    return (fwhm - reduced_fwhm) / fwhm
+
+
+def _read_session(path):  # worker: (names, samples) of one session file
+    with open(path, "r") as f:
+        json_data = json.load(f)
+    return list(json_data), [DataSample.build_from_json(json_data[m]) for m in json_data]
+
+
+def _sample_reductions(names, samples):  # worker: FWHM reduction per sample, NaN and the error message where one fails
+    reductions = np.full(len(samples), np.nan)
+    failures = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for i, (name, sample) in enumerate(zip(names, samples)):
+            try:
+                reductions[i] = fwhm_reduction(sample)
+            except Exception as e:     # e.g. no half maximum inside the aperture, one odd sample must not drop the run
+                failures[name] = f"{type(e).__name__}: {e}"
+    return reductions, failures
+
+
+def aggregate_fwhm_reduction(json_files, workers=None, callback=None, samples_per_task=32):
+    """aggregate_fwhm_reduction(json_files, workers=None, callback=None, samples_per_task=32)
+    computes the FWHM reduction of every sample of many session files. The files are read by the worker processes,
+    then their samples are measured in tasks of samples_per_task samples, so the pool stays busy with few large files
+    as well as with many small ones. callback(path, sketch) is called as soon as all samples of a file are done, so
+    partial statistics can be reported while the remaining files are still running. returns an AggregationResult"""
+    result = AggregationResult()
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1:
+        for path in json_files:
+            try:
+                names, samples = _read_session(path)
+            except Exception as e:
+                result.errors[path] = f"{type(e).__name__}: {e}"
+                continue
+            _finish(result, path, [_sample_reductions(names, samples)], callback)
+        return result
+
+    parts = {}  # path -> results of its sample tasks in sample order, None while running
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_read_session, path): (path, None) for path in json_files}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, part = pending.pop(future)
+                if path in result.errors:   # another task of the file failed already
+                    continue
+                try:
+                    value = future.result()
+                except Exception as e:     # a broken file should not stop the season
+                    result.errors[path] = f"{type(e).__name__}: {e}"
+                    parts.pop(path, None)
+                    continue
+
+                if part is None:    # file read, measure its samples
+                    names, samples = value
+                    starts = range(0, len(samples), samples_per_task)
+                    parts[path] = [None] * len(starts)
+                    for k, start in enumerate(starts):
+                        stop = start + samples_per_task
+                        pending[pool.submit(_sample_reductions, names[start:stop], samples[start:stop])] = (path, k)
+                else:
+                    parts[path][part] = value
+
+                if all(p is not None for p in parts[path]):
+                    _finish(result, path, parts.pop(path), callback)
+
+    return result
+
+
+def _finish(result, path, parts, callback):
+    reductions = np.concatenate([r for r, _ in parts]) if parts else np.empty(0)
+    failures = {}
+    for _, f in parts:
+        failures.update(f)
+
+    finite = np.isfinite(reductions)
+    result.add(path, QuantileSketch().add(reductions[finite]), int(np.sum(~finite)) - len(failures), failures)
+    if callback:
+        callback(path, result.files[path])
@@ -0,0 +1,166 @@
+import argparse
+import inspect
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+from collection import SampleCollection
+from datasample import DataSample
+from metrics import METRICS
+from synthetic import SyntheticTrail, make_frame
+import kernels
+import util
+
+
+# (trail length, aperture diameter, frame size, stars per frame) per size scale
+SCALES = {"small": (100, 15, 512, 20),
+          "medium": (500, 25, 1024, 40),
+          "large": (2000, 41, 2048, 80)}
+
+
+def public_methods():  # every public DataSample method that works with its default arguments
+    methods = []
+    for name, member in inspect.getmembers(DataSample, inspect.isfunction):
+        if name.startswith("_") or name == "get_json":
+            continue
+        params = list(inspect.signature(member).parameters.values())[1:]
+        if all(p.default is not inspect.Parameter.empty for p in params):
+            methods.append(name)
+    return methods
+
+
+def _with_backend(backend, func):
+    with kernels.using(backend):
+        return func()
+
+
+def measure(func, repeats=5, min_time=.2):
+    """measure(func, repeats=5, min_time=.2)
+    calls func once untimed (JIT compilation, first use caches), then runs it until at least repeats calls and min_time
+    seconds are done, then once more under tracemalloc.
+    returns dict with median, min and max seconds per call and the peak of newly allocated bytes"""
+    func()
+
+    times = []
+    start = time.perf_counter()
+    while len(times) < repeats or (time.perf_counter() - start < min_time and len(times) < 1000):
+        t = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"calls": len(times), "median_s": float(np.median(times)), "min_s": float(np.min(times)), "max_s": float(np.max(times)),
+            "peak_bytes": int(peak)}
+
+
+def benchmarks(scale, seed=0):
+    """benchmarks(scale, seed=0)
+    yields (name, callable) for every benchmark of one size scale"""
+    length, diameter, frame_size, stars = SCALES[scale]
+
+    trail = SyntheticTrail(length=length, diameter=diameter, seed=seed)
+    sample = trail.sample()
+
+    yield "DataSample.__init__", lambda: trail.sample()
+
+    for name in public_methods():
+        yield f"DataSample.{name}", getattr(sample, name)
+
+    for backend in kernels.available_backends():
+        for name in ("get_realigned_to_maximum", "get_fwhm"):
+            yield f"kernels.{backend}.{name}", lambda n=name, b=backend: _with_backend(b, getattr(sample, n))
+
+    sample_json = sample.get_json()
+    text = json.dumps(sample_json)
+
+    yield "json.get_json", sample.get_json
+    yield "json.dumps", lambda: json.dumps(sample.get_json())
+    yield "json.loads", lambda: json.loads(text)
+    yield "json.build_from_json", lambda: DataSample.build_from_json(json.loads(text))
+
+    batch = [SyntheticTrail(length=length, diameter=diameter, seed=seed + i).sample() for i in range(stars)]
+    collection = SampleCollection()
+    collection.add_many(range(len(batch)), batch)
+
+    yield "SampleCollection.add_many", lambda: SampleCollection().add_many(range(len(batch)), batch)
+    yield "SampleCollection.compute", lambda: collection.compute(METRICS)
+
+    frame, _ = make_frame(shape=(frame_size, frame_size), stars=stars, length=min(length, frame_size // 2), seed=seed)
+    yield "util.detect_stars", lambda: util.detect_stars(frame)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scales=("small", "medium"), select=None, repeats=5, seed=0):
+    """run(scales=("small", "medium"), select=None, repeats=5, seed=0)
+    runs all benchmarks whose name contains select (all if None), returns the machine readable report"""
+    results = []
+
+    for scale in scales:
+        for name, func in benchmarks(scale, seed=seed):
+            if select and select not in name:
+                continue
+            try:
+                result = measure(func, repeats=repeats)
+            except Exception as e:     # a broken method should not end the whole run
+                results.append({"name": name, "scale": scale, "error": f"{type(e).__name__}: {e}"})
+                print(f"{scale:>6} {name:<45} failed: {type(e).__name__}: {e}")
+                continue
+            result.update(name=name, scale=scale)
+            results.append(result)
+            print(f"{scale:>6} {name:<45} {result['median_s'] * 1e3:10.3f} ms {result['peak_bytes'] / 2**20:8.2f} MiB")
+
+    return {"commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "results": results}
+
+
+def compare(old, new):
+    """compare(old, new)
+    prints the speed ratio old / new of every benchmark present in both reports, > 1 means new is faster"""
+    old_results = {(r["scale"], r["name"]): r for r in old["results"] if "error" not in r}
+
+    print(f"Comparing {old.get('commit')} -> {new.get('commit')}")
+    for r in new["results"]:
+        key = (r["scale"], r["name"])
+        if key not in old_results or "error" in r:
+            continue
+        speedup = old_results[key]["median_s"] / r["median_s"]
+        memory = r["peak_bytes"] / max(old_results[key]["peak_bytes"], 1)
+        print(f"{r['scale']:>6} {r['name']:<45} speedup {speedup:7.2f}x  memory {memory:6.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the DataSample hot paths on synthetic drift trails")
+    parser.add_argument("--scales", default="small,medium", help=f"comma separated, from {', '.join(SCALES)}")
+    parser.add_argument("--select", default=None, help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--out", default=None, help="write the report as json")
+    parser.add_argument("--compare", default=None, help="report json of an earlier run to compare against")
+    args = parser.parse_args()
+
+    report = run(scales=args.scales.split(","), select=args.select, repeats=args.repeats)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(json.load(f), report)
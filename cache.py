@@ -0,0 +1,213 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import precision
+
+
+ALGORITHM_VERSION = 1   # bump whenever a cached product would come out differently, old entries are then never hit again
+
+CACHE_DIR = os.environ.get("DRIFTSCANNER_CACHE") or os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                                                                  "driftscanner")
+
+# derived products stored per sample, all with the default arguments of their DataSample method
+PRODUCTS = {"realigned_crosssection": lambda s: s.get_realigned_crosssection(),
+            "maximum_shift": lambda s: s.get_maximum_shift(),
+            "fwhm": lambda s: np.array(s.get_fwhm(), dtype=float),
+            "realigned_fwhm": lambda s: np.array(s.get_realigned_fwhm(), dtype=float),
+            "slope_adjusted_fwhm": lambda s: np.array(s.get_slope_adjusted_fwhm(), dtype=float)}
+
+METRIC_PREFIX = "metric:"   # entry fields of the metric row, next to the PRODUCTS
+
+
+def sample_key(sample):
+    """sample_key(sample)
+    content address of a sample: hash of its raw arrays, everything the measurements read from its metadata, the
+    algorithm version and the compute precision. The title is not part of it, renaming does not change any result"""
+    h = hashlib.sha256()
+    for array in (sample.data_raw, sample.background1, sample.background2):
+        array = np.ascontiguousarray(array)
+        h.update(f"{array.dtype.str}{array.shape}".encode())
+        h.update(memoryview(array).cast("B"))
+
+    h.update(json.dumps({"time_per_pix": float(sample.time_per_pix),
+                         "readout_noise": float(sample.readout_dev),
+                         "meta_info": sample.meta_info,
+                         "version": ALGORITHM_VERSION,
+                         "precision": np.dtype(precision.compute_dtype()).name}, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+_headers = {}   # npy header -> record dtype, entries of one session almost all share a handful of layouts
+
+
+def _read_record(path):  # np.load of a single record .npy, without parsing the same header again for every entry
+    with open(path, "rb") as f:
+        raw = f.read()
+    if raw[:6] != b"\x93NUMPY":
+        raise ValueError(f"{path} is not a npy file")
+
+    length_size = 2 if raw[6] == 1 else 4
+    start = 8 + length_size + int.from_bytes(raw[8:8 + length_size], "little")
+    header = raw[:start]
+    if header not in _headers:
+        fp = io.BytesIO(header)
+        version = np.lib.format.read_magic(fp)
+        read_header = {(1, 0): np.lib.format.read_array_header_1_0, (2, 0): np.lib.format.read_array_header_2_0}.get(version)
+        if read_header is None:
+            raise ValueError(f"{path} has an unknown npy version {version}")
+        shape, _, dtype = read_header(fp)
+        if shape != () or dtype.hasobject:
+            raise ValueError(f"{path} is not a cache entry")
+        _headers[header] = dtype
+    return np.frombuffer(raw, dtype=_headers[header], count=1, offset=start)[0]
+
+
+class ProductCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=512 * 2**20):
+        """ProductCache(directory=CACHE_DIR, max_bytes=512 * 2**20)
+        Param:
+        directory = str: where the entries live, one .npy file per sample
+        max_bytes = int: size limit of the directory, the least recently used entries are deleted beyond it
+
+        on disk cache of the derived products and metric rows of samples, addressed by sample_key. Entries are
+        written atomically, so a crash or a second process never leaves a half written one"""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None       # bytes on disk, scanned on the first store
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".npy")
+
+    def load(self, key):
+        """load(key)
+        dict name -> array of an entry and marks it as recently used, None if there is none"""
+        path = self._path(key)
+        try:
+            record = _read_record(path)
+            entry = {name: record[name] for name in record.dtype.names}
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError, IndexError, EOFError):    # damaged entry, computed again
+            self._remove(path)
+            return None
+        return entry
+
+    def store(self, key, entry):
+        """store(key, entry)
+        writes dict name -> array as one structured record, so loading it is a single read with a single header"""
+        entries = {name: np.asarray(value) for name, value in entry.items()}
+        record = np.zeros((), dtype=[(name, value.dtype, value.shape) for name, value in entries.items()])
+        for name, value in entries.items():
+            record[name] = value
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, temp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, record, allow_pickle=False)
+            os.replace(temp, path)
+        except BaseException:
+            self._remove(temp)
+            raise
+
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += os.path.getsize(path)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):  # (last use, bytes, path) of every entry
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".npy"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:   # evicted by another process meanwhile
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def evict(self, target=None):
+        """evict(target=None)
+        deletes the least recently used entries until the cache is below target bytes (default 90 % of max_bytes,
+        so not every store has to evict)"""
+        if target is None:
+            target = .9 * self.max_bytes
+
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+        self._size = total
+
+    def clear(self):
+        self.evict(0)
+
+    def attach(self, samples, metric_list):
+        """attach(samples, metric_list)
+        restores the PRODUCTS of every sample from the cache (see DataSample.products) and returns its metric row,
+        dict metric name -> array in the order of samples. Samples that are not in the cache, or miss one of the
+        metrics, are computed in one batch and stored"""
+        import metrics
+
+        names = [m.name for m in metric_list]
+        values = {m.name: np.empty(len(samples), dtype=m.dtype) for m in metric_list}
+        keys = [sample_key(s) for s in samples]
+
+        missing = []
+        for i, (sample, key) in enumerate(zip(samples, keys)):
+            entry = self.load(key)
+            if entry is None or not all(METRIC_PREFIX + name in entry for name in names):
+                missing.append(i)
+                continue
+            for name in names:
+                values[name][i] = entry[METRIC_PREFIX + name]
+            sample.products = _products({name: entry[name] for name in PRODUCTS if name in entry})
+
+        if missing:
+            computed = metrics.MetricsTable(metric_list).compute([samples[i] for i in missing])
+            for k, i in enumerate(missing):
+                sample = samples[i]
+                sample.products = None
+
+                entry = {METRIC_PREFIX + name: computed[name][k] for name in names}
+                for name, func in PRODUCTS.items():
+                    try:
+                        entry[name] = np.asarray(func(sample))
+                    except (ValueError, IndexError, ZeroDivisionError):   # e.g. no half maximum inside the aperture, left out
+                        continue
+                for name in names:
+                    values[name][i] = computed[name][k]
+
+                try:
+                    self.store(keys[i], entry)
+                except OSError:     # read only or full disk, the session still opens
+                    pass
+                sample.products = _products({name: entry[name] for name in PRODUCTS if name in entry})
+
+        return values
+
+
+def _products(products):  # DataSample.products, tagged with the precision they were computed in
+    products["precision"] = np.dtype(precision.compute_dtype()).name
+    return products
@@ -0,0 +1,105 @@
+import numpy as np
+
+import kernels
+
+
+# Row positions of the star in every column of drift data. All functions take (..., rows, columns) arrays, so one
+# sample or a whole stack of samples, and return (..., columns) positions in rows.
+
+def boxcar(data, vertical_interval=5):
+    """boxcar(data, vertical_interval=5)
+    middle of the first window of vertical_interval rows with the highest sum above 0, 0 if there is none.
+    Whole pixels, same scan as DataSample.get_maximum_shift"""
+    return kernels.boxcar(data, vertical_interval)
+
+
+def _window(data, center, radius):  # rows center - radius ... center + radius of every column, clipped to the data
+    rows = data.shape[-2]
+    offsets = np.arange(-radius, radius + 1)
+    index = np.clip(center[..., None, :] + offsets[:, None], 0, rows - 1)
+    inside = (center[..., None, :] + offsets[:, None] >= 0) & (center[..., None, :] + offsets[:, None] < rows)
+    return np.take_along_axis(data, index, axis=-2), index, inside
+
+
+def center_of_mass(data, vertical_interval=5, radius=None):
+    """center_of_mass(data, vertical_interval=5, radius=None)
+    intensity weighted mean row within radius (default vertical_interval) rows around the boxcar maximum, negative
+    pixels count as 0. Falls back to the boxcar position where the window holds no signal"""
+    data = np.asarray(data)
+    if radius is None:
+        radius = vertical_interval
+
+    center = boxcar(data, vertical_interval)
+    values, index, inside = _window(data, center, radius)
+    weights = np.where(inside, np.clip(values, 0, None), 0)
+
+    total = np.sum(weights, axis=-2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        position = np.sum(weights * index, axis=-2) / total
+    return np.where(total > 0, position, center)
+
+
+def parabolic(data, vertical_interval=5):
+    """parabolic(data, vertical_interval=5)
+    vertex of the parabola through the brightest pixel inside the boxcar window and its two neighbours"""
+    data = np.asarray(data, dtype=float)
+    rows = data.shape[-2]
+
+    center = boxcar(data, vertical_interval)
+    values, index, inside = _window(data, center, vertical_interval // 2)
+    peak = np.take_along_axis(index, np.argmax(np.where(inside, values, -np.inf), axis=-2)[..., None, :], axis=-2)[..., 0, :]
+    peak = np.clip(peak, 1, rows - 2)
+
+    y0, y1, y2 = (np.take_along_axis(data, (peak + d)[..., None, :], axis=-2)[..., 0, :] for d in (-1, 0, 1))
+    curvature = y0 - 2 * y1 + y2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        offset = .5 * (y0 - y2) / curvature
+    ok = (curvature < 0) & (np.abs(offset) <= 1)
+    return np.where(ok, peak + np.where(ok, offset, 0), center)
+
+
+def gaussian(data, vertical_interval=5, radius=None):
+    """gaussian(data, vertical_interval=5, radius=None)
+    center of a 1-D Gaussian fitted to radius (default vertical_interval) rows around the boxcar maximum of every
+    column. The fit is the weighted least squares parabola through log(intensity) (weights intensity², which makes it
+    insensitive to the noisy wings), solved for all columns at once. Falls back to center_of_mass where the fit fails"""
+    data = np.asarray(data, dtype=float)
+    if radius is None:
+        radius = vertical_interval
+
+    center = boxcar(data, vertical_interval)
+    values, index, inside = _window(data, center, radius)
+
+    positive = inside & (values > 0)
+    weights = np.where(positive, values, 0) ** 2
+    log_values = np.log(np.where(positive, values, 1))
+    x = (index - center[..., None, :]).astype(float)    # relative to the window for a well conditioned system
+
+    powers = [np.sum(weights * x ** k, axis=-2) for k in range(5)]
+    normal = np.stack([np.stack(powers[i:i + 3], axis=-1) for i in range(3)], axis=-2)      # (..., columns, 3, 3)
+    rhs = np.stack([np.sum(weights * x ** k * log_values, axis=-2) for k in range(3)], axis=-1)
+
+    solvable = np.abs(np.linalg.det(normal)) > 1e-12 * np.maximum(np.abs(powers[0]) ** 3, 1e-300)
+    eye = np.broadcast_to(np.eye(3), normal.shape)
+    solution = np.linalg.solve(np.where(solvable[..., None, None], normal, eye), np.where(solvable[..., None], rhs, 0)[..., None])[..., 0]
+    b, c = solution[..., 1], solution[..., 2]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        offset = -b / (2 * c)
+    ok = solvable & (c < 0) & (np.abs(offset) <= radius)
+    return np.where(ok, center + np.where(ok, offset, 0), center_of_mass(data, vertical_interval, radius))
+
+
+# name -> func(data, vertical_interval), selectable wherever DataSample takes a centroid argument
+CENTROIDS = {"boxcar": boxcar,
+             "com": center_of_mass,
+             "parabolic": parabolic,
+             "gaussian": gaussian}
+
+
+def centroid(data, method="boxcar", vertical_interval=5):
+    """centroid(data, method="boxcar", vertical_interval=5)
+    star row of every column with one of the CENTROIDS"""
+    if method not in CENTROIDS:
+        raise ValueError(f"Invalid centroid method: {method}")
+    return CENTROIDS[method](data, vertical_interval=vertical_interval)
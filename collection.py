@@ -0,0 +1,208 @@
+import weakref
+
+import numpy as np
+
+from datasample import DataSample
+from frames import Aperture
+import precision
+
+
+class _Group:
+    def __init__(self, shapes, dtype, capacity=16):
+        """contiguous storage of all samples whose data and background apertures have the same shapes"""
+        data_shape, bg1_shape, bg2_shape = shapes
+
+        self.raw = np.zeros((capacity,) + data_shape, dtype=dtype)
+        self.background1 = np.zeros((capacity,) + bg1_shape, dtype=dtype)
+        self.background2 = np.zeros((capacity,) + bg2_shape, dtype=dtype)
+        self.time_per_pix = np.zeros(capacity)
+        self.readout_noise = np.zeros(capacity)
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.titles = []
+        self.meta_info = []
+        self.apertures = []
+        self.products = []
+        self.size = 0
+
+    def _reserve(self, size):
+        if size <= len(self.ids):
+            return
+        capacity = max(size, 2 * len(self.ids))
+        for name in ("raw", "background1", "background2", "time_per_pix", "readout_noise", "ids"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def append(self, sample_id, sample):
+        self._reserve(self.size + 1)
+        i = self.size
+
+        self.raw[i] = sample.data_raw
+        self.background1[i] = sample.background1
+        self.background2[i] = sample.background2
+        self.time_per_pix[i] = sample.time_per_pix
+        self.readout_noise[i] = sample.readout_dev
+        self.ids[i] = sample_id
+        self.titles.append(sample.title)
+        self.meta_info.append(sample.meta_info)
+        self.apertures.append(sample.aperture.as_tuple() if sample.aperture is not None else None)
+        self.products.append(sample.products)
+
+        self.size += 1
+        return i
+
+    def remove(self, rows):
+        keep = np.ones(self.size, dtype=bool)
+        keep[list(rows)] = False
+        n = int(np.sum(keep))
+
+        for name in ("raw", "background1", "background2", "time_per_pix", "readout_noise", "ids"):
+            arr = getattr(self, name)
+            arr[:n] = arr[:self.size][keep]
+        self.ids[n:self.size] = -1
+
+        self.titles = [t for t, k in zip(self.titles, keep) if k]
+        self.meta_info = [m for m, k in zip(self.meta_info, keep) if k]
+        self.apertures = [a for a, k in zip(self.apertures, keep) if k]
+        self.products = [p for p, k in zip(self.products, keep) if k]
+        self.size = n
+
+    def view(self, i):
+        sample = DataSample(self.raw[i], self.time_per_pix[i], self.background1[i], self.background2[i], meta_info=self.meta_info[i],
+                            title=self.titles[i], readout_noise=self.readout_noise[i])
+        if self.apertures[i] is not None:
+            sample.aperture = Aperture.from_tuple(self.apertures[i])
+        sample.products = self.products[i]
+        return sample
+
+    def data(self, rows):
+        """background subtracted data of the given rows in one go, same as DataSample._data with the median background"""
+        raw = self.raw[rows]
+        background = self.background1[rows].reshape(len(raw), -1)    # DataSample._background_avg only uses background1
+
+        compute = precision.compute_dtype()
+        return raw.astype(compute) - np.median(background, axis=1).astype(compute)[:, None, None]
+
+
+class SampleCollection:
+    def __init__(self):
+        """SampleCollection()
+        struct-of-arrays storage for many samples: all equally shaped apertures live in one contiguous 3d array per
+        shape, with their scalar metadata in parallel arrays. Indexing by sample id returns a DataSample that is a thin
+        view into that storage. Behaves like a dict sample id -> DataSample"""
+        self._groups = {}       # (shapes, dtype) -> _Group
+        self._where = {}        # sample id -> (group, row)
+        self._views = weakref.WeakValueDictionary()     # sample id -> DataSample view handed out and still alive
+
+    def _group(self, sample):
+        shapes = (np.shape(sample.data_raw), np.shape(sample.background1), np.shape(sample.background2))
+        dtype = np.result_type(sample.data_raw, sample.background1, sample.background2)
+        key = (shapes, dtype.str)
+        if key not in self._groups:
+            self._groups[key] = _Group(shapes, dtype)
+        return self._groups[key]
+
+    def __setitem__(self, sample_id, sample):
+        if sample_id in self._where:
+            del self[sample_id]
+        group = self._group(sample)
+        capacity = len(group.ids)
+        self._where[sample_id] = (group, group.append(sample_id, sample))
+        if len(group.ids) != capacity:
+            self._rebind(group)
+
+    def add_many(self, sample_ids, samples):
+        for sample_id, sample in zip(sample_ids, samples):
+            self[sample_id] = sample
+
+    def __getitem__(self, sample_id):
+        view = self._views.get(sample_id)
+        if view is None:
+            group, row = self._where[sample_id]
+            view = group.view(row)
+            self._views[sample_id] = view
+        return view
+
+    def __delitem__(self, sample_id):
+        self.remove([sample_id])
+
+    def pop(self, sample_id):
+        sample = self[sample_id]
+        del self[sample_id]
+        return sample
+
+    def remove(self, sample_ids):
+        rows = {}
+        for sample_id in sample_ids:
+            group, row = self._where.pop(sample_id)
+            rows.setdefault(id(group), (group, []))[1].append(row)
+
+            view = self._views.pop(sample_id, None)
+            if view is not None:    # still used elsewhere, e.g. by a graph window: give it its own copy
+                view.data_raw, view.background1, view.background2 = view.data_raw.copy(), view.background1.copy(), view.background2.copy()
+
+        for group, group_rows in rows.values():
+            group.remove(group_rows)
+            for row, sample_id in enumerate(group.ids[:group.size]):
+                self._where[int(sample_id)] = (group, row)
+            self._rebind(group)
+
+    def _rebind(self, group):
+        """points the views handed out for a group back at their rows after the storage moved"""
+        for row, sample_id in enumerate(group.ids[:group.size]):
+            view = self._views.get(int(sample_id))
+            if view is not None:
+                view.data_raw, view.background1, view.background2 = group.raw[row], group.background1[row], group.background2[row]
+
+    def set_title(self, sample_id, title):
+        group, row = self._where[sample_id]
+        group.titles[row] = title
+        if sample_id in self._views:
+            self._views[sample_id].title = title
+
+    def __contains__(self, sample_id):
+        return sample_id in self._where
+
+    def __len__(self):
+        return len(self._where)
+
+    def __iter__(self):
+        return iter(self._where)
+
+    def keys(self):
+        return self._where.keys()
+
+    def values(self):
+        return (self[i] for i in self._where)
+
+    def items(self):
+        return ((i, self[i]) for i in self._where)
+
+    def compute(self, metrics, sample_ids=None):
+        """compute(metrics, sample_ids=None)
+        computes metrics for the given samples (all if None) with one stacked array per aperture shape, straight from the
+        contiguous storage. returns dict metric name -> array in the order of sample_ids"""
+        if sample_ids is None:
+            sample_ids = list(self._where)
+
+        results = {m.name: np.empty(len(sample_ids), dtype=m.dtype) for m in metrics}
+
+        by_group = {}
+        for i, sample_id in enumerate(sample_ids):
+            group, row = self._where[sample_id]
+            by_group.setdefault(id(group), (group, [], []))
+            by_group[id(group)][1].append(row)
+            by_group[id(group)][2].append(i)
+
+        for group, rows, positions in by_group.values():
+            data = group.data(rows)
+            samples = [self[int(group.ids[row])] for row in rows]
+            for m in metrics:
+                results[m.name][positions] = m.compute(samples, data)
+
+        return results
+
+    @property
+    def nbytes(self):
+        return sum(g.raw.nbytes + g.background1.nbytes + g.background2.nbytes for g in self._groups.values())
@@ -1,16 +1,20 @@
 import tkinter as tk
-from tkinter import ttk, simpledialog, filedialog
+from tkinter import ttk, simpledialog, filedialog, messagebox
 import numpy as np
 
 import json
 
-import matplotlib
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.figure import Figure
-from scipy.stats import norm
-from scipy import optimize
 from datasample import DataSample
-matplotlib.use("TkAgg")
+from metrics import MetricsTable
+from collection import SampleCollection
+from datasheet import VirtualTable
+import cache
+import centroids
+import dimm
+import kernels
+import lucky
+import profiling
+import scintillation
 
 
 class DataAnalyzer:
@@ -22,7 +26,9 @@ class DataAnalyzer:
         self.window.title("Measurements")
         self.window.geometry("1200x600")
 
-        self.data = dict()
+        self.data = SampleCollection()  # sample id -> DataSample, contiguous storage per aperture shape
+        self.metrics = MetricsTable()
+        self.service = None  # ResultsService the rows are published to, if running
         self.sample_count = 0
 
         # Open data windows
@@ -30,6 +36,8 @@ class DataAnalyzer:
         self.open_windows = []
 
         self.psf = None
+        self.cache = None   # ProductCache of the derived products of opened sessions, created on the first open
+        self.telescope_diameter = None     # m, asked for once per session by the differential image motion analysis
 
         # File Menubar
         """
@@ -58,12 +66,13 @@ class DataAnalyzer:
                                (self.f_save_headers, "Save only Headers"))
 
         self.display_functions = (((self.f_show_raw_crosssection, "Raw Crosssection"), (self.f_slope_adjusted_crosssection, "Slope adjusted Crossection"),
-                                   (self.f_aligned_crosssection, "Aligned Crosssection")),
+                                   (self.f_aligned_crosssection, "Aligned Crosssection"), (self.f_lucky_imaging, "Lucky Imaging")),
 
                                   ((self.f_show_maximum_wobble, "t-Y-Graph"), (self.f_slope_adjusted_t_y, "Slope adjusted t-Y-Graph")),
-                                  ((self.f_show_flattened_line, "t-S-Graph"), (self.f_show_line_fit, "Get average line")),
+                                  ((self.f_show_flattened_line, "t-S-Graph"), (self.f_show_line_fit, "Get average line"), (self.f_scintillation, "Scintillation")),
                                   ((self.f_t_s_fourier, "t-S-Fourier"), (self.f_t_y_fourier, "t-Y-Fourier")),
-                                  ((self.f_vertical_align, "Vertical align"), (self.f_set_psf, "Get PSF from Single Stars"), (self.f_binary_star_separation, "Binary Star Separation")))
+                                  ((self.f_vertical_align, "Vertical align"), (self.f_set_psf, "Get PSF from Single Stars"), (self.f_binary_star_separation, "Binary Star Separation"),
+                                   (self.f_differential_motion, "Differential Image Motion")))
 
         self.top_frame = tk.Frame(master=self.window)
         self.top_frame.pack(expand=False, fill=tk.X)
@@ -71,25 +80,21 @@ class DataAnalyzer:
             b = tk.Button(master=self.top_frame, command=func[0], text=func[1])
             b.pack(side=tk.LEFT)
 
-        self.columns = ("Title", "Altitude", "Brightness", "SNR", "Normalized StdDev", "Y-Variations over 5s")
+        # Filter entry, e.g. "SNR > 50 and Altitude < 30" or "Title ~ Vega"
+        self.filter_text = tk.StringVar()
+        self.filter_status = tk.StringVar()
 
-        self.datasheet = ttk.Treeview(self.window, columns=self.columns, show="headings")
+        tk.Label(master=self.top_frame, textvariable=self.filter_status).pack(side=tk.RIGHT)
+        self.filter_entry = tk.Entry(master=self.top_frame, textvariable=self.filter_text, width=40)
+        self.filter_entry.pack(side=tk.RIGHT)
+        self.filter_entry.bind("<Return>", lambda e: self.f_filter())
+        tk.Label(master=self.top_frame, text="Filter:").pack(side=tk.RIGHT)
 
-        for col in self.columns:
-            self.datasheet.heading(col, text=col, command=lambda _col=col: self.sort_by_column(_col, False))
-
-        for h in self.columns:
-            self.datasheet.heading(h, text=h)
+        self.columns = self.metrics.columns
 
+        self.datasheet = VirtualTable(self.window, self.metrics)
         self.datasheet.pack(fill="both", expand=True, side=tk.TOP)
 
-        self.scrollbar = ttk.Scrollbar(self.datasheet)
-        self.scrollbar.config(command=self.datasheet.yview)
-
-        self.datasheet.config(yscrollcommand=self.scrollbar.set)
-
-        self.scrollbar.pack(side="right", fill="y")
-
         self.bottom_frame = tk.Frame(master=self.window)
         self.bottom_frame.pack(expand=False, fill=tk.X)
 
@@ -107,78 +112,127 @@ class DataAnalyzer:
         self.window.withdraw()
 
     def add_sample(self, sample, title=""):
-        if not title:
-            self.sample_count += 1
-            title = f"Measurement {self.sample_count}"
-        sample.title = title
-        key = self.datasheet.insert("", "end", values=(title, *self.get_sample_values(sample)))
-        self.data[key] = sample
+        self.add_samples([sample], [title])
+
+    @profiling.timed("DataAnalyzer.add_samples")
+    def add_samples(self, samples, titles=None, values=None):
+        """add_samples(samples, titles=None, values=None)
+        computes the metrics of all samples in one batch and appends them to the datasheet. values are metrics
+        computed elsewhere (dict column name -> array), e.g. by the worker processes of transport.measure_parallel"""
+        if titles is None:
+            titles = [""] * len(samples)
+
+        titles = list(titles)
+        for i, (sample, title) in enumerate(zip(samples, titles)):
+            if not title:
+                self.sample_count += 1
+                titles[i] = f"Measurement {self.sample_count}"
+            sample.title = titles[i]
+
+        if values is None:
+            sample_ids = self.metrics.add_samples(samples, titles)
+        else:
+            sample_ids = self.metrics.add_rows(titles, values)
+        self.data.add_many(sample_ids, samples)
+
+        self._refresh()
+        self.publish(sample_ids)
+
+    PUBLISHED_EXTRAS = ("FWHM", "Wobble")  # published next to the metric columns, in pixels
+
+    def publish(self, sample_ids=None):
+        """publish(sample_ids=None)
+        sends the rows of the given samples (all if None) to the results service"""
+        if self.service is None:
+            return
+        if sample_ids is None:
+            sample_ids = [int(i) for i in self.metrics.ids]
+
+        rows = {}
+        for sample_id in sample_ids:
+            sample = self.data[sample_id]
+            row = dict(zip(self.metrics.columns, self.metrics.values(sample_id)))
+            try:
+                row["FWHM"] = float(sample.get_fwhm()[0])
+            except (ValueError, IndexError):     # half maximum not inside the aperture, e.g. the star peaks on an edge row
+                row["FWHM"] = float("nan")
+            row["Wobble"] = float(np.std(sample.get_maximum_shift()))
+            rows[sample_id] = row
+
+        self.service.publish(self.metrics.columns + self.PUBLISHED_EXTRAS, rows)
 
     def get_sample_values(self, sample):
-        return (sample.meta_info["altitude"],
-                sample.signal,
-                sample.snr,
-                np.std(sample.get_flattened_line() / np.mean(sample.get_flattened_line())),
-                np.std(sample.get_slope_adjusted_t_y(interval=round(5/sample.time_per_pix))))
+        values = self.metrics.compute([sample])
+        return tuple(values[m.name][0] for m in self.metrics.metrics)
 
     # -------------------------------------------------------------------------------------------------------------------------
     # Button functions for analysis
 
     def f_show_raw_crosssection(self):
         samples = self._get_selected()
-        title = [self.datasheet.item(iid)["values"][0] for iid in self.datasheet.selection()]
+        title = self._get_selected_titles()
         self.open_windows.append(GraphWindow(self, samples, "Raw Crosssection", title))
 
     def f_show_maximum_wobble(self):
         samples = self._get_selected()
-        title = [self.datasheet.item(iid)["values"][0] for iid in self.datasheet.selection()]
+        title = self._get_selected_titles()
         self.open_windows.append(GraphWindow(self, samples, "t-Y-Graph", title))
 
     def f_show_flattened_line(self):
         samples = self._get_selected()
-        title = [self.datasheet.item(iid)["values"][0] for iid in self.datasheet.selection()]
+        title = self._get_selected_titles()
         self.open_windows.append(GraphWindow(self, samples, "t-S-Graph", title))
 
     def f_show_line_fit(self):
         samples = self._get_selected()
-        title = [self.datasheet.item(iid)["values"][0] for iid in self.datasheet.selection()]
+        title = self._get_selected_titles()
         self.open_windows.append(GraphWindow(self, samples, "Average Line", title))
 
+    def f_scintillation(self):
+        samples = self._get_selected()
+        title = self._get_selected_titles()
+        self.open_windows.append(GraphWindow(self, samples, "Scintillation", title))
+
     def f_vertical_align(self):
         s = self.datasheet.focus()
-        if s:
+        if s is not None:
             sample = [self.data[s]]
-            title = [self.datasheet.item(s)["values"][0]]
+            title = [self.metrics.row(s)["Title"]]
             self.open_windows.append(GraphWindow(self, sample, "Vertical align", title=title))
 
     def f_aligned_crosssection(self):
         samples = self._get_selected()
-        title = [self.datasheet.item(iid)["values"][0] for iid in self.datasheet.selection()]
+        title = self._get_selected_titles()
         self.open_windows.append(GraphWindow(self, samples, "Aligned Crosssection", title))
 
+    def f_lucky_imaging(self):
+        samples = self._get_selected()
+        title = self._get_selected_titles()
+        self.open_windows.append(GraphWindow(self, samples, "Lucky Imaging", title))
+
     def f_t_s_fourier(self):
         samples = self._get_selected()
-        title = [self.datasheet.item(iid)["values"][0] for iid in self.datasheet.selection()]
+        title = self._get_selected_titles()
         self.open_windows.append(GraphWindow(self, samples, "t-S-Fourier", title))
 
     def f_t_y_fourier(self):
         samples = self._get_selected()
-        title = [self.datasheet.item(iid)["values"][0] for iid in self.datasheet.selection()]
+        title = self._get_selected_titles()
         self.open_windows.append(GraphWindow(self, samples, "t-Y-Fourier", title))
 
     def f_slope_adjusted_t_y(self):
         samples = self._get_selected()
-        title = [self.datasheet.item(iid)["values"][0] for iid in self.datasheet.selection()]
+        title = self._get_selected_titles()
         self.open_windows.append(GraphWindow(self, samples, "Slope adjusted t-Y-Graph", title))
 
     def f_slope_adjusted_crosssection(self):
         samples = self._get_selected()
-        title = [self.datasheet.item(iid)["values"][0] for iid in self.datasheet.selection()]
+        title = self._get_selected_titles()
         self.open_windows.append(GraphWindow(self, samples, "Slope adjusted Crosssection", title))
 
     def f_set_psf(self):
         samples = self._get_selected()
-        title = [self.datasheet.item(iid)["values"][0] for iid in self.datasheet.selection()]
+        title = self._get_selected_titles()
 
         crosssections = np.array([(cross := sample.get_realigned_crosssection()) / np.max(cross) for sample in samples])
         median_cross = np.mean(crosssections, axis=0)
@@ -197,31 +251,50 @@ class DataAnalyzer:
 
     def f_binary_star_separation(self):
         s = self.datasheet.focus()
-        if s:
+        if s is not None:
             sample = [self.data[s]]
-            title = [self.datasheet.item(s)["values"][0]]
+            title = [self.metrics.row(s)["Title"]]
             self.open_windows.append(GraphWindow(self, sample, "Binary Star Separation", title=title))
 
+    def f_differential_motion(self):
+        samples = self._get_selected()
+        title = self._get_selected_titles()
+        if len(samples) < 2:
+            tk.messagebox.showinfo("Differential Image Motion", "Select at least two stars of the same frame", parent=self.window)
+            return
+        try:
+            dimm.pixel_scales(samples)
+        except ValueError as e:
+            tk.messagebox.showerror("Differential Image Motion", str(e), parent=self.window)
+            return
+
+        diameter = simpledialog.askfloat("Differential Image Motion", "Telescope aperture [m]", initialvalue=self.telescope_diameter,
+                                         minvalue=.01, parent=self.window)
+        if diameter is None:
+            return
+        self.telescope_diameter = diameter
+
+        self.open_windows.append(GraphWindow(self, samples, "Differential Image Motion", title))
+
     # -------------------------------------------------------------------------------------------------------------------------
     # Button functions for analysis
 
     def f_rename_sample(self):
         s = self.datasheet.focus()
-        if s:
+        if s is not None:
             new_name = ""
-            while not new_name or new_name in [self.datasheet.item(iid)["values"][0] for iid in self.datasheet.get_children()]:
-                new_name = tk.simpledialog.askstring(f"Rename {self.datasheet.item(s)['values'][0]}", "Enter new title (must be unique)")
-            v = self.datasheet.item(s)["values"]
-            v[0] = new_name
-            self.data[s].title = new_name
-            self.datasheet.item(s, values=v)
+            while not new_name or new_name in set(self.metrics.column("Title")):
+                new_name = tk.simpledialog.askstring(f"Rename {self.metrics.row(s)['Title']}", "Enter new title (must be unique)")
+            self.data.set_title(s, new_name)
+            self.metrics.set_title(s, new_name)
+            self._refresh()
+            self.publish([s])
 
     def f_delete_selected(self):
-        samples = [iid for iid in self.datasheet.selection()]
-        self.datasheet.delete(*samples)
+        self._delete(self.datasheet.selection())
 
     def f_delete_all(self):
-        self.datasheet.delete(*self.datasheet.get_children())
+        self._delete([int(i) for i in self.metrics.ids])
         self.parent_app.graphics_clear_all()
 
         [self.parent_app.graphics_clear_label(key) for key in self.parent_app.image_label if not key.startswith("Custom")]
@@ -235,14 +308,23 @@ class DataAnalyzer:
         with open(file, "r") as f:
             samples = json.load(f)
 
+        existing = set(self.metrics.column("Title"))
+        titles = []
+
         for s in samples:
             title = s
             if s.startswith("Measurement"):
                 title = ""
-            if s in [self.datasheet.item(child)["values"][0] for child in self.datasheet.get_children()]:
+            elif s in existing:
                 title = title + "_1"
+            titles.append(title)
 
-            self.add_sample(DataSample.build_from_json(samples[s]))
+        samples = [DataSample.build_from_json(samples[s]) for s in samples]
+        if self.cache is None:
+            self.cache = cache.ProductCache()
+        with profiling.timer("ProductCache.attach", elements=len(samples)):
+            values = self.cache.attach(samples, self.metrics.metrics)
+        self.add_samples(samples, titles, values=values)
 
     def f_save_selected(self):
         initial_dir = "/"
@@ -255,8 +337,8 @@ class DataAnalyzer:
 
         samples = {}
 
-        for child in self.datasheet.get_children():
-            samples[self.datasheet.item(child)["values"][0]] = self.data[child].get_json()
+        for sample_id in self.datasheet.get_children():     # the rows passing the filter, in display order
+            samples[self.metrics.row(sample_id)["Title"]] = self.data[sample_id].get_json()
 
         with open(file, "w") as f:
             json.dump(samples, f)
@@ -270,34 +352,42 @@ class DataAnalyzer:
         if not file.endswith(".json"):
             file += ".json"
 
-        samples = {}
-
-        for child in self.datasheet.get_children():
-            samples[self.datasheet.item(child)["values"][0]] = self.datasheet.item(child)["values"]
-
-        with open(file, "w") as f:
-            json.dump(samples, f)
+        self.metrics.save_headers(file, self.datasheet.get_children())     # the rows passing the filter, in display order
 
     # Event Handling
 
     def sort_by_column(self, col, reverse):
-        try:
-            l = [(float(self.datasheet.set(k, col)), k) for k in self.datasheet.get_children("")]
-        except ValueError:
-            l = [(self.datasheet.set(k, col), k) for k in self.datasheet.get_children("")]
+        self.datasheet.sort(col, reverse)
 
-        l.sort(reverse=reverse)
-
-        for index, (val, k) in enumerate(l):
-            self.datasheet.move(k, "", index)
-
-        self.datasheet.heading(col, text=col, command=lambda _col=col: self.sort_by_column(_col, not reverse))
+    def f_filter(self):
+        try:
+            self.datasheet.set_filter(self.filter_text.get())
+        except ValueError as e:
+            tk.messagebox.showerror("Filter", str(e), parent=self.window)
+        self._update_filter_status()
 
     def on_closing(self):
         self.window.withdraw()
 
     def _get_selected(self):
-        return [self.data[iid] for iid in self.datasheet.selection()]
+        return [self.data[sample_id] for sample_id in self.datasheet.selection()]
+
+    def _get_selected_titles(self):
+        return [self.metrics.row(sample_id)["Title"] for sample_id in self.datasheet.selection()]
+
+    def _delete(self, sample_ids):
+        self.metrics.delete(sample_ids)
+        self.data.remove(sample_ids)
+        self._refresh()
+        if self.service is not None:
+            self.service.remove(sample_ids)
+
+    def _refresh(self):
+        self.datasheet.refresh()
+        self._update_filter_status()
+
+    def _update_filter_status(self):
+        self.filter_status.set(f"{len(self.datasheet.order)} of {len(self.metrics)} shown")
 
 class GraphWindow:
     def __init__(self, parent, samples, graph_type, title):
@@ -315,12 +405,18 @@ class GraphWindow:
         self.interval = tk.IntVar()
         self.custom_fwhm = tk.DoubleVar()
         self.custom_mu2 = tk.DoubleVar()
+        self.lucky_percent = tk.DoubleVar(value=10)
+        self.centroid = tk.StringVar(value="boxcar")
+        self._lucky = {}  # sample index -> LuckyStack, the windows are scored once per window
+        self._dimm = {}   # centroid -> DifferentialMotion of all samples
 
         self.frame = tk.Frame(self.window)
         self.frame.pack(expand=False, side=tk.TOP, fill=tk.X)
 
         self.canvas = None
 
+        from matplotlib.figure import Figure     # matplotlib is only imported with the first graph window
+
         self.f = Figure()
         self.f.set_tight_layout(True)
 
@@ -331,6 +427,11 @@ class GraphWindow:
 
             self.slider.set(self.samples[0].delta_pix())
 
+        if graph_type in ("t-Y-Graph", "t-Y-Fourier", "Slope adjusted t-Y-Graph", "Differential Image Motion"):
+            tk.Label(self.frame, text="Centroid: ").pack(side=tk.LEFT)
+            self.centroid_menu = tk.OptionMenu(self.frame, self.centroid, *centroids.CENTROIDS, command=lambda x: self._redraw())
+            self.centroid_menu.pack(side=tk.LEFT)
+
         if graph_type in ("t-S-Graph", "Raw Crosssection", "Aligned Crosssection", "Slope adjusted Crosssection", "Binary Star Separation"):
             self.normalize_check = tk.Checkbutton(self.frame, variable=self.normalize, offvalue=False, onvalue=True, text="Normalize", command=self._redraw)
 
@@ -345,6 +446,11 @@ class GraphWindow:
             self.slider.bind("<ButtonRelease-1>", lambda x: self._redraw())
             self.slider.pack(fill=tk.BOTH, expand=True)
 
+        if graph_type == "Lucky Imaging":  # redrawn while dragging, a new fraction is only a lookup in the cached stacks
+            self.slider = tk.Scale(self.frame, resolution=1, from_=1, to=100, orient=tk.HORIZONTAL, variable=self.lucky_percent, label="Best windows [%]: ",
+                                   command=lambda x: self._redraw())
+            self.slider.pack(fill=tk.BOTH, expand=True)
+
         self.draw_figure(self.f, samples, graph_type, interval=self.samples[0].delta_pix())
 
         self.window.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -379,7 +485,7 @@ class GraphWindow:
             a.legend(bbox_to_anchor=(1, 1), loc="upper left")
 
         elif graph_type == "t-Y-Graph":
-            data = [sample.get_maximum_shift_moving_average(interval=interval) for sample in samples]
+            data = [sample.get_maximum_shift_moving_average(interval=interval, centroid=self.centroid.get()) for sample in samples]
             axis_x = [i for i in range(interval, interval + max(map(len, data)))]
 
             f.clear()
@@ -470,6 +576,95 @@ class GraphWindow:
 
             a.legend(bbox_to_anchor=(1, 1), loc="upper left")
 
+        elif graph_type == "Lucky Imaging":
+            fraction = self.lucky_percent.get() / 100
+
+            f.clear()
+
+            a = f.add_subplot(211, frameon=False)
+            b = f.add_subplot(212)
+
+            a.set_ylabel("ADUs")
+            a.set_xlabel("Pixel from Centre")
+            b.set_ylabel("FWHM")
+            b.set_xlabel("Best windows kept [%]")
+
+            for i, (sample, t) in enumerate(zip(samples, self.title)):
+                if i not in self._lucky:
+                    self._lucky[i] = lucky.LuckyStack(sample.data)
+                stack = self._lucky[i]
+
+                d, full = stack.crosssection(fraction), stack.crosssection(1)
+                offset = int(np.argmax(d))
+                a.plot(np.arange(len(d)) - offset, d, label=f"{t}: best {fraction:.0%}, FWHM = {kernels.fwhm(d)[0]:.2f}")
+                a.plot(np.arange(len(full)) - offset, full, ":", label=f"{t}: all, FWHM = {kernels.fwhm(full)[0]:.2f}")
+
+                fractions, fwhm = stack.fwhm_curve()
+                b.plot(fractions * 100, fwhm, label=t)
+
+            b.axvline(fraction * 100, color="C7", linestyle=":")
+            a.legend(bbox_to_anchor=(1, 1), loc="upper left")
+
+        elif graph_type == "Differential Image Motion":
+            centroid = self.centroid.get()
+            if centroid not in self._dimm:
+                self._dimm[centroid] = dimm.DifferentialMotion(samples, self.parent.telescope_diameter, centroid=centroid)
+            motion = self._dimm[centroid]
+
+            f.clear()
+
+            a = f.add_subplot(211, frameon=False)
+            b = f.add_subplot(212)
+
+            a.set_ylabel("Differential motion [arcsec]")
+            a.set_xlabel("Pixel")
+            b.set_ylabel("Seeing [arcsec]")
+            b.set_xlabel("Separation [arcsec]")
+
+            for i, j in zip(*motion.pairs()):
+                label = f"{self.title[i]} - {self.title[j]}: r0 = {motion.r0[i, j] * 100:.1f} cm, seeing = {motion.seeing[i, j]:.2f}\""
+                a.plot(motion.differential(i, j), label=label, alpha=.7)
+                b.plot(motion.separation[i, j], motion.seeing[i, j], "o")
+
+            b.axhline(motion.median_seeing(), color="C7", linestyle=":", label=f"Median seeing = {motion.median_seeing():.2f}\"")
+            a.legend(bbox_to_anchor=(1, 1), loc="upper left")
+            b.legend(bbox_to_anchor=(1, 1), loc="upper left")
+
+        elif graph_type == "Scintillation":
+            lines = {}   # length -> indices, lines of equal length go through the FFTs together
+            for i, sample in enumerate(samples):
+                lines.setdefault(len(sample.data[0]), []).append(i)
+
+            f.clear()
+
+            a = f.add_subplot(211)
+            b = f.add_subplot(212)
+
+            a.set_ylabel("Structure Function")
+            a.set_xlabel("Lag [s]")
+            a.set_xscale("log")
+            a.set_yscale("log")
+            b.set_ylabel("Autocorrelation")
+            b.set_xlabel("Lag [s]")
+
+            for indices in lines.values():
+                stack = np.stack([samples[i].get_flattened_line() for i in indices])
+                time_per_pix = np.array([samples[i].time_per_pix for i in indices], dtype=float)
+
+                structure = scintillation.structure_function(stack)
+                acf = scintillation.autocorrelation(stack)
+                index = scintillation.scintillation_index(stack)
+                tau = scintillation.autocorrelation_time(stack, time_per_pix)
+
+                for k, i in enumerate(indices):
+                    lags = np.arange(structure.shape[1]) * time_per_pix[k]
+                    a.plot(lags[1:], structure[k, 1:], label=f"{self.title[i]}: index = {index[k]:.2e}")
+                    b.plot(np.arange(acf.shape[1]) * time_per_pix[k], acf[k], label=f"{self.title[i]}: tau = {tau[k]:.2f} s")
+
+            b.axhline(1 / np.e, color="C7", linestyle=":")
+            a.legend(bbox_to_anchor=(1, 1), loc="upper left")
+            b.legend(bbox_to_anchor=(1, 1), loc="upper left")
+
         elif graph_type == "t-S-Fourier":
             data = [sample.get_t_s_fourier(interval=interval) for sample in samples]
             data = [data[i][5:len(data[i]) // 2] for i in range(len(data))]
@@ -490,7 +685,7 @@ class GraphWindow:
             a.legend(bbox_to_anchor=(1, 1), loc="upper left")
 
         elif graph_type == "t-Y-Fourier":
-            data = [sample.get_t_y_fourier(interval=interval) for sample in samples]
+            data = [sample.get_t_y_fourier(interval=interval, centroid=self.centroid.get()) for sample in samples]
             data = [data[i][5:len(data[i]) // 2] for i in range(len(data))]
             axis_x = [i for i in range(5, len(data[0]) + 5)]
 
@@ -509,7 +704,7 @@ class GraphWindow:
             a.legend(bbox_to_anchor=(1, 1), loc="upper left")
 
         elif graph_type == "Slope adjusted t-Y-Graph":
-            data = [sample.get_slope_adjusted_t_y(interval=interval) for sample in samples]
+            data = [sample.get_slope_adjusted_t_y(interval=interval, centroid=self.centroid.get()) for sample in samples]
             axis_x = [i for i in range(interval, interval + max(map(len, data)))]
 
             f.clear()
@@ -560,6 +755,8 @@ class GraphWindow:
             a.plot(np.arange(len(crosssection)) - list(crosssection).index(np.max(crosssection)), crosssection)
 
         elif graph_type == "Binary Star Separation":
+            from scipy.stats import norm     # the only view that needs scipy
+
             crosssection = samples[0].get_realigned_crosssection()
             fwhm = self.custom_fwhm.get()
 
@@ -693,6 +890,9 @@ class GraphWindow:
         if self.canvas:
             self.canvas.get_tk_widget().destroy()
             self.canvas.get_tk_widget().destroy()
+
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
         self.canvas = FigureCanvasTkAgg(self.f, self.window)
         self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
 
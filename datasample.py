@@ -1,7 +1,19 @@
 import numpy as np
 
+from frames import Aperture
+import centroids
+import kernels
+import lucky
+import precision
+import profiling
+import shiftadd
+
 
 class DataSample:
+    # many thousands of samples are kept in a session, no per instance __dict__
+    __slots__ = ("data_raw", "background1", "background2", "time_per_pix", "readout_dev", "title", "meta_info", "interval_time", "frame",
+                 "aperture", "products", "_data_cache", "_signal_raw_cache", "_signal_cache", "_snr_cache", "__weakref__")
+
     def __init__(self, data, time_per_pix, background1, background2, meta_info={},title="", readout_noise=12.7865):
         """DataSample(data, time_per_pix, background, background2, readout_noise)
         Param:
@@ -9,47 +21,101 @@ class DataSample:
         time_per_pix = float: drift speed
 
         takes drift scan data for one drift and gives access to evaluation functions"""
-        self.data_raw = data
-        self.background1 = background1
-        self.background2 = background2
+        self.data_raw = precision.compact_raw(data)   # kept in the sensor dtype, views stay views
+        self.background1 = precision.compact_raw(background1)
+        self.background2 = precision.compact_raw(background2)
         self.time_per_pix = time_per_pix
         self.readout_dev = readout_noise
 
         self.title = title
 
-        self.data = self._data()
+        self.meta_info = meta_info
 
-        self.signal_raw = self._signal_raw()
-        self.signal = self._signal_background()
+        self.interval_time = 1
 
-        self.snr = self.get_snr()
+        self.frame = None       # Frame and Aperture the raw arrays are views of, if cut from a shared frame
+        self.aperture = None
 
-        self.meta_info = meta_info
+        # derived from the raw data on first use, see release()
+        self._data_cache = None
+        self._signal_raw_cache = None
+        self._signal_cache = None
+        self._snr_cache = None
 
-        self.interval_time = 1
+        self.products = None    # derived products restored from the disk cache, see cache.ProductCache.attach
 
-        # print(self.background1, self.background2, self._background_avg())
-        # print(self.data_raw, self.data)
-        # print(self.signal_raw, self.signal, self.snr)
+    @classmethod
+    def from_frame(cls, frame, aperture, time_per_pix, meta_info={}, title="", readout_noise=12.7865):
+        """from_frame(frame, aperture, time_per_pix, meta_info={}, title="", readout_noise=12.7865)
+        sample referencing the pixels of a shared Frame through an Aperture, without copying them"""
+        data, background1, background2 = aperture.cut(frame.data)
+
+        sample = cls(data, time_per_pix, background1, background2, meta_info=meta_info, title=title, readout_noise=readout_noise)
+        sample.frame = frame
+        sample.aperture = aperture
+
+        return sample
+
+    def __getstate__(self):  # pickled samples (worker results) carry copies of their own pixels, not the whole frame
+        state = {name: getattr(self, name) for name in self.__slots__ if name != "__weakref__"}
+        state["frame"] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @property
+    def data(self):  # background subtracted data
+        if self._data_cache is None:
+            self._data_cache = self._data()
+        return self._data_cache
+
+    @property
+    def signal_raw(self):
+        if self._signal_raw_cache is None:
+            self._signal_raw_cache = self._signal_raw()
+        return self._signal_raw_cache
+
+    @property
+    def signal(self):
+        if self._signal_cache is None:
+            self._signal_cache = self._signal_background()
+        return self._signal_cache
+
+    @property
+    def snr(self):
+        if self._snr_cache is None:
+            self._snr_cache = self.get_snr()
+        return self._snr_cache
+
+    def release(self):
+        """release()
+        drops the materialized background subtracted data, it is rebuilt from the raw views when needed again"""
+        self._data_cache = None
 
     def get_json(self):
         data = dict()
         data["title"] = self.title
-        data["raw_data"] = list(map(lambda x: list(map(float, x)), list(self.data_raw)))
-        data["background1"] = list(map(lambda x: list(map(float, x)), list(self.background1)))
-        data["background2"] = list(map(lambda x: list(map(float, x)), list(self.background2)))
+        data["raw_data"] = self.data_raw.tolist()   # integers stay integers, roughly halves the file size
+        data["background1"] = self.background1.tolist()
+        data["background2"] = self.background2.tolist()
+        data["dtype"] = self.data_raw.dtype.name
         data["time_per_pix"] = self.time_per_pix
         data["readout_noise"] = self.readout_dev
         data["meta_info"] = self.meta_info
+        if self.aperture is not None:
+            data["aperture"] = self.aperture.as_tuple()
 
         return data
 
     @classmethod
     def build_from_json(cls, json):
         title = json["title"]
-        data = np.array(json["raw_data"])
-        background1 = np.array(json["background1"])
-        background2 = np.array(json["background2"])
+        dtype = json.get("dtype", None)  # older files only have floats, compact_raw turns them back into integers
+        data = np.array(json["raw_data"], dtype=dtype)
+        background1 = np.array(json["background1"], dtype=dtype)
+        background2 = np.array(json["background2"], dtype=dtype)
         time_per_pix = json["time_per_pix"]
         readout_noise = json["readout_noise"]
         meta_info = json["meta_info"]
@@ -57,7 +123,11 @@ class DataSample:
         if "time_per_pix" not in meta_info:
             meta_info["time_per_pix"] = None
 
-        return DataSample(data, time_per_pix, background1, background2, meta_info=meta_info, title=title, readout_noise=readout_noise)
+        sample = DataSample(data, time_per_pix, background1, background2, meta_info=meta_info, title=title, readout_noise=readout_noise)
+        if "aperture" in json:
+            sample.aperture = Aperture.from_tuple(json["aperture"])
+
+        return sample
 
     def _adjust_bounds(self, start, stop, interval=0):
         if start > stop:
@@ -72,11 +142,20 @@ class DataSample:
 
         return start, stop, interval
 
+    def _product(self, name, start, stop):  # cached product of a default argument call over the whole trail, None if there is none
+        if not self.products or name not in self.products or (start, stop) != (0, len(self.data_raw[0])):
+            return None
+        if self.products.get("precision") != np.dtype(precision.compute_dtype()).name:     # computed before set_precision
+            return None
+        return self.products[name].copy()
+
     def _data(self, start=0, stop=0, avg_mode="median"):
         start, stop, _ = self._adjust_bounds(start, stop)
 
         bg_avg = self._background_avg(start=start, stop=stop, avg_mode=avg_mode)
-        return self.data_raw - bg_avg
+
+        compute = precision.compute_dtype()
+        return self.data_raw.astype(compute) - compute(bg_avg)
 
     def _background_avg(self, start=0, stop=0, avg_mode="median"):
         background_avg = 0
@@ -96,13 +175,13 @@ class DataSample:
         start, stop, _ = self._adjust_bounds(start, stop)
 
         subarr = self.data_raw[:, start:stop]
-        return np.sum(subarr)
+        return np.sum(subarr, dtype=precision.accumulate_dtype())
 
     def _signal_background(self, start=0, stop=0):
         start, stop, _ = self._adjust_bounds(start, stop)
 
         subarr = self.data[:, start:stop]
-        return np.sum(subarr)
+        return np.sum(subarr, dtype=precision.accumulate_dtype())
 
     def delta_pix(self, time=None):        # Calculates the appropriate pixel interval width for a given time interval based on the declination
         if not time:
@@ -112,14 +191,16 @@ class DataSample:
         return int(abs(v_drift * time))
 
 
-    def get_background_dev():
-      if self.background1.shape == self.background2.shape:
+    def get_background_dev(self, start=0, stop=0):
+        start, stop, _ = self._adjust_bounds(start, stop)
+
+        if self.background1.shape == self.background2.shape:
             bg = np.array((self.background1[:, start:stop], self.background2[:, start:stop]))
         else:
             if sum(self.background1.shape) > sum(self.background2.shape):
-                bg = self.background1
+                bg = self.background1[:, start:stop]
             else:
-                bg = self.background2
+                bg = self.background2[:, start:stop]
 
         return np.std(bg)
 
@@ -129,7 +210,7 @@ class DataSample:
 
         signal = self._signal_background(start=start, stop=stop)
 
-        background_dev = self-get_background_dev()
+        background_dev = self.get_background_dev(start=start, stop=stop)
 
         time = self.time_per_pix * (stop - start)
 
@@ -143,7 +224,7 @@ class DataSample:
         start, stop, _ = self._adjust_bounds(start, stop)
 
         section = self.data[:, start:stop]
-        crosssection = np.sum(section, axis=1)
+        crosssection = np.sum(section, axis=1, dtype=precision.accumulate_dtype())
 
         return crosssection
 
@@ -151,7 +232,7 @@ class DataSample:
         start, stop, _ = self._adjust_bounds(start, stop)
 
         section = self.data[:, start:stop]
-        flattened_line = np.sum(section, axis=0)
+        flattened_line = np.sum(section, axis=0, dtype=precision.accumulate_dtype())
 
         return flattened_line
 
@@ -211,136 +292,92 @@ class DataSample:
         return np.array(stddev)
 
     def get_realigned_to_maximum(self, vertical_interval=5, start=0, stop=0):
-        def _shift(col, n):
-            if n >= 0:
-                return np.concatenate((np.full(n, 0), col[:-n]))
-            else:
-                return np.concatenate((col[-n:], np.full(-n, 0)))
-
         start, stop, _ = self._adjust_bounds(start, stop)
 
-        data = self.data[:, start:stop].T.copy()
+        data = self.data[:, start:stop].T
         middle = len(self.data) // 2
 
-        prev = None
-
-        for column in range(len(data)):
-            max = 0
-            maxi = 0
+        maxi = kernels.track_maximum(data, vertical_interval)
 
-            if not prev:
-                shifts = range(len(data[column]) - vertical_interval)
-            else:
-                shifts = range(prev - 1 - vertical_interval, prev + 1)
-
-            for i in shifts:
-                if np.sum(data[column, i:i+vertical_interval]) > max:
-                    max = np.sum(data[column, i:i+vertical_interval])
-                    maxi = i + vertical_interval // 2
-
-            prev = maxi
-
-            if middle-maxi != 0:
-                data[column] = _shift(data[column], middle - maxi)
-
-        return data.T
+        return kernels.shift_rows(data, middle - maxi).T
 
     def get_realigned_crosssection(self, vertical_interval=5, start=0, stop=0):
         start, stop, _ = self._adjust_bounds(start, stop)
 
-        return np.sum(self.get_realigned_to_maximum(vertical_interval=vertical_interval, start=start, stop=stop), axis=1)
+        if vertical_interval == 5 and (cached := self._product("realigned_crosssection", start, stop)) is not None:
+            return cached
 
-    def get_fwhm(self, start=0, stop=0):
-        def get_interpolated(y, lo, hi):
-            return (y - lo) / (hi - lo)
+        return np.sum(self.get_realigned_to_maximum(vertical_interval=vertical_interval, start=start, stop=stop), axis=1, dtype=precision.accumulate_dtype())
 
+    def get_fwhm(self, start=0, stop=0):
         start, stop, _ = self._adjust_bounds(start, stop)
 
-        data = self.get_crosssection(start=start, stop=stop)
-
-        maximum = np.max(data)
+        if (cached := self._product("fwhm", start, stop)) is not None:
+            return tuple(cached)
 
-        pos_max = list(data).index(maximum)
+        return kernels.fwhm(self.get_crosssection(start=start, stop=stop), lower_shift=1)
 
-        lo, hi = pos_max, pos_max
 
-        for i in range(pos_max, 1, -1):
-            if data[i-1] < maximum / 2:
-                lo = i
-                break
-
-        for i in range(pos_max, len(data)-1):
-            if data[i+1] < maximum / 2:
-                hi = i
-                break
-
-        lo += get_interpolated(maximum / 2, data[lo], data[lo+1]) - pos_max
-        hi += get_interpolated(maximum / 2, data[hi], data[hi+1]) - pos_max
-
-        return hi-lo, maximum / 2, lo, hi
+    def get_realigned_fwhm(self, start=0, stop=0):
+        start, stop, _ = self._adjust_bounds(start, stop)
 
+        if (cached := self._product("realigned_fwhm", start, stop)) is not None:
+            return tuple(cached)
 
-    def get_realigned_fwhm(self, start=0, stop=0):
-        def get_interpolated(y, lo, hi):
-            return (y - lo) / (hi - lo)
+        return kernels.fwhm(self.get_realigned_crosssection(start=start, stop=stop))
 
+    def get_subpixel_realigned(self, centroid="com", vertical_interval=5, bin_size=1, interpolation="fft", start=0, stop=0):
+        """shift-and-add: every column (or bin of bin_size columns) moved by its subpixel centroid offset, NaN where
+        nothing could be shifted in. centroid "com" or "boxcar", interpolation "linear" or "fft", see shiftadd"""
         start, stop, _ = self._adjust_bounds(start, stop)
 
-        data = self.get_realigned_crosssection(start=start, stop=stop)
-
-        maximum = np.max(data)
+        return shiftadd.shift_and_add(self.data[:, start:stop], centroid, vertical_interval, bin_size, interpolation)[0]
 
-        pos_max = list(data).index(maximum)
+    def get_subpixel_crosssection(self, centroid="com", vertical_interval=5, bin_size=1, interpolation="fft", start=0, stop=0):
+        start, stop, _ = self._adjust_bounds(start, stop)
 
-        lo, hi = pos_max, pos_max
+        return shiftadd.shift_and_add(self.data[:, start:stop], centroid, vertical_interval, bin_size, interpolation)[1]
 
-        for i in range(pos_max, 0, -1):
-            if data[i] < maximum / 2:
-                lo = i
-                break
+    def get_subpixel_fwhm(self, centroid="com", vertical_interval=5, bin_size=1, interpolation="fft", start=0, stop=0):
+        return kernels.fwhm(self.get_subpixel_crosssection(centroid, vertical_interval, bin_size, interpolation, start, stop))
 
-        for i in range(pos_max, len(data) - 1):
-            if data[i + 1] < maximum / 2:
-                hi = i
-                break
+    def get_lucky_crosssection(self, fraction=.1, window=10, score="peak", centroid="com", start=0, stop=0):
+        """crosssection of only the best fraction of time windows along the trail, see lucky.LuckyStack"""
+        start, stop, _ = self._adjust_bounds(start, stop)
 
-        lo += get_interpolated(maximum / 2, data[lo], data[lo+1]) - pos_max
-        hi += get_interpolated(maximum / 2, data[hi], data[hi+1]) - pos_max
+        return lucky.LuckyStack(self.data[:, start:stop], window=window, score=score, centroid=centroid).crosssection(fraction)
 
-        return hi - lo, maximum / 2, lo, hi
+    def get_lucky_fwhm(self, fraction=.1, window=10, score="peak", centroid="com", start=0, stop=0):
+        return kernels.fwhm(self.get_lucky_crosssection(fraction, window, score, centroid, start, stop))
 
-    def get_maximum_shift(self, vertical_interval=5, start=0, stop=0):
+    def get_maximum_shift(self, vertical_interval=5, start=0, stop=0, centroid="boxcar"):
+        """offset of the star from the middle row for every column. centroid "boxcar" gives whole pixels like the
+        original scan, "com", "parabolic" and "gaussian" subpixel positions, see centroids"""
         start, stop, _ = self._adjust_bounds(start, stop)
 
-        max_positions = []
+        if (vertical_interval, centroid) == (5, "boxcar") and (cached := self._product("maximum_shift", start, stop)) is not None:
+            return cached
 
         middle = len(self.data) // 2
 
-        for column in self.data[:, start:stop].T:
-            max = 0
-            maxi = 0
-            for i in range(len(column) - vertical_interval):
-                if np.sum(column[i:i + vertical_interval]) > max:
-                    max = np.sum(column[i:i + vertical_interval])
-                    maxi = i + vertical_interval // 2
-
-            max_positions.append(middle - maxi)
+        return middle - centroids.centroid(self.data[:, start:stop], centroid, vertical_interval)
 
-        return max_positions
-
-    def get_maximum_shift_moving_average(self, interval=None, vertical_interval=5, start=0, stop=0):
+    def get_maximum_shift_moving_average(self, interval=None, vertical_interval=5, start=0, stop=0, centroid="boxcar"):
         if not interval:
             interval = self.delta_pix(time=self.interval_time)
 
         start, stop, interval = self._adjust_bounds(start, stop, interval)
 
-        max_shift = self.get_maximum_shift(vertical_interval=vertical_interval, start=start, stop=stop)
+        max_shift = self.get_maximum_shift(vertical_interval=vertical_interval, start=start, stop=stop, centroid=centroid)
 
         avg = [np.mean(max_shift[i:i+interval]) for i in range(start, stop-interval)]
 
         return np.array(avg)
 
     def get_t_s_fourier(self, interval=None, start=0, stop=0):
+        if not interval:
+            interval = self.delta_pix(time=self.interval_time)
+
         start, stop, interval = self._adjust_bounds(start, stop, interval)
 
         data = self.get_flattened_moving_average(interval, start, stop)
@@ -349,25 +386,25 @@ class DataSample:
 
         return np.abs(fourier)
 
-    def get_t_y_fourier(self, interval=None, start=0, stop=0):
+    def get_t_y_fourier(self, interval=None, start=0, stop=0, centroid="boxcar"):
         if not interval:
             interval = self.delta_pix(time=self.interval_time)
 
         start, stop, interval = self._adjust_bounds(start, stop, interval)
 
-        data = self.get_maximum_shift_moving_average(interval=interval, vertical_interval=5, start=start, stop=stop)
+        data = self.get_maximum_shift_moving_average(interval=interval, vertical_interval=5, start=start, stop=stop, centroid=centroid)
 
         fourier = np.fft.fft(data)
 
         return np.abs(fourier)
 
-    def get_slope_adjusted_t_y(self, interval=None, start=0, stop=0):
+    def get_slope_adjusted_t_y(self, interval=None, start=0, stop=0, centroid="boxcar"):
         if not interval:
             interval = self.delta_pix(time=self.interval_time)
 
         start, stop, interval = self._adjust_bounds(start, stop, interval)
 
-        data = self.get_maximum_shift_moving_average(interval=interval, start=start, stop=stop)
+        data = self.get_maximum_shift_moving_average(interval=interval, start=start, stop=stop, centroid=centroid)
 
         data_x = np.arange(len(data)) - len(data) // 2
 
@@ -378,17 +415,9 @@ class DataSample:
         return data - fitted
 
     def get_slope_adjusted_data(self, start=0, stop=0):
-        def _shift(col, n):
-            if n > 0:
-                return np.concatenate((np.full(n, 0), col[:-n]))
-            elif n < 0:
-                return np.concatenate((col[-n:], np.full(-n, 0)))
-            else:
-                return col
-
         start, stop, _ = self._adjust_bounds(start, stop)
 
-        data = self.data[start:stop].T.copy()
+        data = self.data[start:stop].T
 
         shift_data = self.get_maximum_shift_moving_average(interval=1, start=start, stop=stop)
 
@@ -398,90 +427,66 @@ class DataSample:
 
         realignment_values = np.poly1d(regression_coef)(data_x)
 
-        for i in range(len(realignment_values)):
-            data[i] = _shift(data[i], int(realignment_values[i]))
-
-        return data.T
+        return kernels.shift_rows(data, realignment_values.astype(np.int64)).T
 
     def get_slope_adjusted_crosssection(self, start=0, stop=0):
         start, stop, _ = self._adjust_bounds(start, stop)
 
-        return np.sum(self.get_slope_adjusted_data(start=start, stop=stop), axis=1)
+        return np.sum(self.get_slope_adjusted_data(start=start, stop=stop), axis=1, dtype=precision.accumulate_dtype())
 
     def get_slope_adjusted_fwhm(self, start=0, stop=0):
-        def get_interpolated(y, lo, hi):
-            return (y - lo) / (hi - lo)
-
         start, stop, _ = self._adjust_bounds(start, stop)
 
-        data = self.get_slope_adjusted_crosssection(start=start, stop=stop)
-
-        maximum = np.max(data)
-
-        pos_max = list(data).index(maximum)
-
-        lo, hi = pos_max, pos_max
+        if (cached := self._product("slope_adjusted_fwhm", start, stop)) is not None:
+            return tuple(cached)
 
-        for i in range(pos_max, 0, -1):
-            if data[i] < maximum / 2:
-                lo = i
-                break
+        return kernels.fwhm(self.get_slope_adjusted_crosssection(start=start, stop=stop))
 
-        for i in range(pos_max, len(data) - 1):
-            if data[i + 1] < maximum / 2:
-                hi = i
-                break
 
-        lo += get_interpolated(maximum / 2, data[lo], data[lo+1]) - pos_max
-        hi += get_interpolated(maximum / 2, data[hi], data[hi+1]) - pos_max
-
-        return hi - lo, maximum / 2, lo, hi
-
-
-  def get_luminosity(start=0, stop=0):
-    start, stop, _ = self._adjust_bounds(start, stop)
-
-    luminosity = np.sum(self.data) / (len(self.data[0]) * self.time_per_pix)
+    def get_luminosity(self, start=0, stop=0):
+        start, stop, _ = self._adjust_bounds(start, stop)
 
-    return luminosity, luminosity / self.snr
+        luminosity = np.sum(self.data[:, start:stop], dtype=precision.accumulate_dtype()) / ((stop - start) * self.time_per_pix)
 
+        return luminosity, luminosity / self.get_snr(start, stop)
 
-  def get_realigned_luminosity(fwhm_amount=3, start=0, stop=0):
-    start, stop, _ = self._adjust_bounds(start, stop)
-    
-    data = get_realigned_crosssection(start, stop)
+    def get_realigned_luminosity(self, fwhm_amount=3, start=0, stop=0):
+        start, stop, _ = self._adjust_bounds(start, stop)
 
-    fwhm = self.get_realigned_fwhm(start, stop)
+        data = self.get_realigned_crosssection(start=start, stop=stop)
 
-    max_pos = list(data).index(np.max(data))
+        lo, hi = self._get_fwhm_cutout(data, fwhm_amount, start, stop)
 
-    cutout = max_pos - fwhm / 2 * fwhm_amount, max_pos + fwhm / 2 * fwhm_amount
+        luminosity = np.sum(data[lo:hi]) / ((stop - start) * self.time_per_pix)
 
-    luminosity = np.sum(data[cutout]) / (len(self.data[0]) * self.time_per_pix)
+        return luminosity, luminosity / self.get_realigned_snr(fwhm_amount, start, stop)
 
-    return luminosity, luminosity / self.get_realigned_snr(fwhm_amount, start, stop)
+    def get_realigned_snr(self, fwhm_amount=2.5, start=0, stop=0):
+        start, stop, _ = self._adjust_bounds(start, stop)
 
+        data = self.get_realigned_crosssection(start=start, stop=stop)
 
-  def get_realigned_snr(fwhm_amount=2.5, start=0, stop=0):
-    start, stop, _ = self._adjust_bounds(start, stop)
+        lo, hi = self._get_fwhm_cutout(data, fwhm_amount, start, stop)
 
-    data = self.get_realigned_crosssection(start, stop)
+        signal = np.sum(data[lo:hi])
 
-    max_pos = list(data).index(np.max(data))
+        background_dev = self.get_background_dev(start=start, stop=stop)
 
-    cutout = max_pos - fwhm / 2 * fwhm_amount, max_pos + fwhm / 2 * fwhm_amount
+        time = self.time_per_pix * (stop - start)
 
-    signal = np.sum(data[cutout])
+        pixel_count = (hi - lo) * (stop - start)
 
-    background_dev = self.get_background_dev()
+        snr = signal / np.sqrt(signal + time * pixel_count * (background_dev + self.readout_dev**2))
 
-    time = self.time_per_pix * (stop - start)
+        return snr
 
-        pixel_count = np.size(self.data, 0) * (stop - start)
+    def _get_fwhm_cutout(self, crosssection, fwhm_amount, start, stop):  # rows within fwhm_amount * FWHM around the maximum
+        fwhm = self.get_realigned_fwhm(start=start, stop=stop)[0]
 
-        snr = signal / np.sqrt(signal + time * pixel_count * (background_dev + self.readout_dev**2))
+        max_pos = int(np.argmax(crosssection))
+        half_width = int(np.ceil(fwhm / 2 * fwhm_amount))
 
-        return snr
+        return max(max_pos - half_width, 0), min(max_pos + half_width + 1, len(crosssection))
 
-    return snr
 
+profiling.instrument_class(DataSample)
@@ -0,0 +1,210 @@
+import re
+import tkinter as tk
+from tkinter import ttk
+
+import numpy as np
+
+
+OPERATORS = r"(<=|>=|==|!=|<|>|~)"
+FILTER_CLAUSE = re.compile(r"^\s*(.+?)\s*" + OPERATORS + r"\s*(.+?)\s*$")
+
+
+def split_clauses(text, columns):
+    """split_clauses(text, columns)
+    clauses of a filter string. It is only split at an "and" outside of double quotes that is followed by a column
+    name and an operator, so a title value may contain " and " """
+    clause_start = re.compile(r"(?:%s)\s*%s" % ("|".join(re.escape(c) for c in sorted(columns, key=len, reverse=True)), OPERATORS))
+
+    clauses, start, quoted = [], 0, False
+    for m in re.finditer(r'\s+and\s+|"', text):
+        if m.group() == '"':
+            quoted = not quoted
+        elif not quoted and clause_start.match(text, m.end()):
+            clauses.append(text[start:m.start()])
+            start = m.end()
+    clauses.append(text[start:])
+    return clauses
+
+
+def parse_filter(text, store):
+    """parse_filter(text, store)
+    turns a filter string like "SNR > 50 and Altitude <= 30" into a boolean mask over the rows of a MetricsTable.
+    Clauses are "column operator value" joined by "and", the operator ~ matches a substring of the title. Values can
+    be put in double quotes, e.g. Title ~ "Vega and Deneb" for a title containing " and " anyway."""
+    mask = np.ones(len(store), dtype=bool)
+
+    for clause in split_clauses(text.strip(), store.columns):
+        if not clause:
+            continue
+
+        m = FILTER_CLAUSE.match(clause)
+        if not m or m.group(1) not in store.columns:
+            raise ValueError(f"Invalid filter: {clause}")
+
+        column, op, value = m.groups()
+        if len(value) >= 2 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        values = store.column(column)
+
+        if values.dtype == object:
+            values = np.array([str(v) for v in values])
+            if op == "~":
+                mask &= np.char.find(values.astype(str), value) >= 0
+                continue
+        else:
+            value = float(value)
+
+        if op == "<":
+            mask &= values < value
+        elif op == ">":
+            mask &= values > value
+        elif op == "<=":
+            mask &= values <= value
+        elif op == ">=":
+            mask &= values >= value
+        elif op == "==":
+            mask &= values == value
+        elif op == "!=":
+            mask &= values != value
+        else:
+            raise ValueError(f"Operator {op} only works on the title")
+
+    return mask
+
+
+class VirtualTable:
+    def __init__(self, master, store, row_height=20):
+        """VirtualTable(master, store)
+        Param:
+        master = tk widget to pack into
+        store = MetricsTable: rows to display
+
+        table view that only keeps the visible rows of the store as Treeview items. Sorting and filtering work on index
+        arrays over the store, selection and focus are kept as sample ids so they survive scrolling"""
+        self.store = store
+        self.row_height = row_height
+
+        self.order = np.arange(0)   # store row indices in display order, after filtering
+        self.offset = 0             # first displayed position in order
+        self.visible_rows = 25
+
+        self.sort_column = None
+        self.sort_reverse = False
+        self.filter_text = ""
+
+        self.selected = set()       # sample ids
+        self.focused = None
+
+        self.frame = tk.Frame(master)
+
+        self.tree = ttk.Treeview(self.frame, columns=store.columns, show="headings", selectmode="extended")
+        for col in store.columns:
+            self.tree.heading(col, text=col, command=lambda _col=col: self.sort(_col, not self.sort_reverse if self.sort_column == _col else False))
+
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self._on_scrollbar)
+
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        # Event handling
+
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
+        self.tree.bind("<Configure>", self._on_configure)
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1))
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-1))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(1))
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    # Public interface, mirrors the parts of ttk.Treeview the DataAnalyzer uses
+
+    def selection(self):  # selected sample ids in display order
+        ids = self.store.ids[self.order]
+        return [int(i) for i in ids if int(i) in self.selected]
+
+    def focus(self):
+        return self.focused
+
+    def get_children(self):  # every sample id passing the filter, in display order
+        return [int(i) for i in self.store.ids[self.order]]
+
+    def refresh(self):
+        """refresh()
+        rebuilds the display order after rows were added, deleted or renamed, keeping sorting and filter"""
+        self.selected &= set(int(i) for i in self.store.ids)
+        if self.focused not in self.store:
+            self.focused = None
+
+        if self.sort_column:
+            order = self.store.order_by(self.sort_column, self.sort_reverse)
+        else:
+            order = np.arange(len(self.store))
+
+        if self.filter_text:
+            order = order[parse_filter(self.filter_text, self.store)[order]]
+
+        self.order = order
+        self.offset = min(self.offset, max(len(order) - self.visible_rows, 0))
+        self.render()
+
+    def sort(self, column, reverse=False):
+        self.sort_column = column
+        self.sort_reverse = reverse
+        self.refresh()
+
+    def set_filter(self, text):
+        if text.strip():
+            parse_filter(text, self.store)  # raises ValueError before anything changes
+        self.filter_text = text.strip()
+        self.offset = 0
+        self.refresh()
+
+    def scroll(self, rows):
+        self.scroll_to(self.offset + rows)
+
+    def scroll_to(self, offset):
+        offset = int(min(max(offset, 0), max(len(self.order) - self.visible_rows, 0)))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+
+    def render(self):
+        self.tree.delete(*self.tree.get_children())
+
+        visible = self.order[self.offset:self.offset + self.visible_rows]
+        for i in self.store.ids[visible]:
+            self.tree.insert("", "end", iid=str(i), values=self.store.values(int(i)))
+
+        shown = [str(i) for i in self.store.ids[visible] if int(i) in self.selected]
+        self.tree.selection_set(shown)
+        if self.focused is not None and self.tree.exists(str(self.focused)):
+            self.tree.focus(str(self.focused))
+
+        if len(self.order):
+            self.scrollbar.set(self.offset / len(self.order), min((self.offset + self.visible_rows) / len(self.order), 1))
+        else:
+            self.scrollbar.set(0, 1)
+
+    # Event handling
+
+    def _on_select(self, event):
+        visible = set(int(i) for i in self.tree.get_children())
+        self.selected = (self.selected - visible) | set(int(i) for i in self.tree.selection())
+
+        focused = self.tree.focus()
+        if focused:
+            self.focused = int(focused)
+
+    def _on_configure(self, event):
+        rows = max((event.height - self.row_height) // self.row_height, 1)  # minus the heading
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self.refresh()
+
+    def _on_scrollbar(self, *args):
+        if args[0] == "moveto":
+            self.scroll_to(round(float(args[1]) * len(self.order)))
+        elif args[0] == "scroll":
+            step = self.visible_rows if args[2] == "pages" else 1
+            self.scroll(int(args[1]) * step)
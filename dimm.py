@@ -0,0 +1,125 @@
+import numpy as np
+
+import centroids
+import frames
+
+
+ARCSEC_PER_RAD = 180 / np.pi * 3600
+
+# differential tilt coefficients of Sarazin & Roddier (1990), variance = 2 lambda² r0^-5/3 (K_TILT D^-1/3 - k d^-1/3)
+K_TILT = .179
+K_LONGITUDINAL = .0968      # motion along the baseline
+K_TRANSVERSE = .145         # motion across the baseline
+
+
+def centroid_series(samples, centroid="com", vertical_interval=5, detrend=True):
+    """centroid_series(samples, centroid="com", vertical_interval=5, detrend=True)
+    (n, columns) star row of every column of samples from the same frame, cut to the shortest sample so column i is
+    the same moment for all of them. Samples of the same height are centroided as one stack. With detrend the linear
+    drift of every trail (camera rotation, refraction) is removed, it is not seeing"""
+    columns = min(s.data.shape[1] for s in samples)
+    series = np.empty((len(samples), columns))
+
+    by_height = {}
+    for i, sample in enumerate(samples):
+        by_height.setdefault(sample.data.shape[0], []).append(i)
+    for index in by_height.values():
+        stack = np.stack([samples[i].data[:, :columns] for i in index])
+        series[index] = centroids.centroid(stack, centroid, vertical_interval)
+
+    if detrend and columns > 1:
+        t = np.stack((np.ones(columns), np.arange(columns)), axis=-1)
+        series -= (t @ np.linalg.lstsq(t, series.T, rcond=None)[0]).T
+    return series
+
+
+def pixel_scales(samples):
+    """pixel_scales(samples)
+    arcsec per pixel of every sample from its drift speed and the declination in its meta info"""
+    scales = []
+    for sample in samples:
+        declination = sample.meta_info.get("declination")
+        if declination is None or not sample.time_per_pix:
+            raise ValueError(f"{sample.title or 'Sample'} has no declination or drift speed, the pixel scale is unknown")
+        scales.append(frames.arcsec_per_pix(declination, sample.time_per_pix))
+    return np.array(scales, dtype=float)
+
+
+def separations(samples):
+    """separations(samples)
+    (n, n, 2) pixel offsets (dy, dx) between the apertures of every pair of samples, NaN where a sample has no aperture"""
+    positions = np.array([(s.aperture.y, s.aperture.x) if s.aperture is not None else (np.nan, np.nan) for s in samples], dtype=float)
+    return positions[None, :, :] - positions[:, None, :]
+
+
+def differential_variance(series):
+    """differential_variance(series)
+    (n, n) variance of series[i] - series[j] for all pairs at once, var(i) + var(j) - 2 cov(i, j)"""
+    covariance = np.atleast_2d(np.cov(series))
+    variance = np.diag(covariance)
+    return variance[:, None] + variance[None, :] - 2 * covariance
+
+
+def fried_parameter(variance, diameter, wavelength=500e-9, baseline=None, longitudinal=.5):
+    """fried_parameter(variance, diameter, wavelength=500e-9, baseline=None, longitudinal=.5)
+    Param:
+    variance = differential image motion variance in rad² along one axis, any shape
+    diameter = float: telescope aperture in m
+    baseline = float: separation in m of the beams of both stars in the turbulent layer, None if the stars are far
+               enough apart to move independently
+    longitudinal = share of the measured motion along the baseline, cos² of the angle between axis and separation
+
+    r0 in m at wavelength from the DIMM formula"""
+    k = K_TILT * diameter ** (-1 / 3)
+    if baseline:
+        k = k - (longitudinal * K_LONGITUDINAL + (1 - longitudinal) * K_TRANSVERSE) * baseline ** (-1 / 3)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (2 * k * wavelength ** 2 / np.asarray(variance, dtype=float)) ** (3 / 5)
+
+
+def seeing(r0, wavelength=500e-9):  # FWHM of the seeing disk in arcsec
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return .98 * wavelength / np.asarray(r0, dtype=float) * ARCSEC_PER_RAD
+
+
+class DifferentialMotion:
+    def __init__(self, samples, diameter, wavelength=500e-9, baseline=None, centroid="com", vertical_interval=5):
+        """DifferentialMotion(samples, diameter, wavelength=500e-9, baseline=None, centroid="com", vertical_interval=5)
+        Param:
+        samples = list of DataSamples cut from the same frame, at least two
+        diameter = float: telescope aperture in m
+
+        DIMM-style seeing from the centroid wobble of stars in one frame. Telescope shake moves all stars alike and
+        cancels in the differences, so every pair of stars gives its own r0 and seeing estimate"""
+        if len(samples) < 2:
+            raise ValueError("Differential image motion needs at least two stars")
+
+        self.wavelength = wavelength
+        self.series = centroid_series(samples, centroid, vertical_interval)                    # pixels
+        self.scales = pixel_scales(samples)
+        self.variance = differential_variance(self.series * self.scales[:, None])              # arcsec²
+
+        offset = separations(samples)
+        distance = np.hypot(offset[..., 0], offset[..., 1])
+        self.separation = distance * np.mean(self.scales)                                     # arcsec
+        with np.errstate(invalid="ignore", divide="ignore"):
+            longitudinal = np.where(distance > 0, (offset[..., 0] / distance) ** 2, .5)
+        longitudinal = np.nan_to_num(longitudinal, nan=.5)    # unknown direction: mean of both coefficients
+
+        self.r0 = fried_parameter(self.variance / ARCSEC_PER_RAD ** 2, diameter, wavelength, baseline, longitudinal)
+        np.fill_diagonal(self.r0, np.nan)
+        self.seeing = seeing(self.r0, wavelength)
+
+    def pairs(self):
+        """pairs()
+        (i, j) index arrays of every pair of stars, each pair once"""
+        return np.triu_indices(len(self.series), 1)
+
+    def differential(self, i, j):  # motion of star i relative to star j over time in arcsec
+        return self.series[i] * self.scales[i] - self.series[j] * self.scales[j]
+
+    def median_r0(self):
+        return float(np.nanmedian(self.r0[self.pairs()]))
+
+    def median_seeing(self):
+        return float(np.nanmedian(self.seeing[self.pairs()]))
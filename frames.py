@@ -0,0 +1,126 @@
+import numpy as np
+
+
+class Frame:
+    def __init__(self, data, path=None, header=None, hdul=None):
+        """Frame(data, path=None, header=None)
+        Param:
+        data = 2d numpy array: pixel data, not copied (may be a memory map or a view)
+        path = str: file the frame came from
+        header = fits header, used for the sample meta info
+
+        pixel buffer shared by all samples cut from one image. Samples only keep a reference to it and their Aperture,
+        so the buffer lives exactly as long as the last sample using it"""
+        self.data = data
+        self.path = path
+        self.header = header
+        self._hdul = hdul   # keeps the memory map of the fits file open
+
+    @classmethod
+    def open(cls, path, memmap=True):
+        from astropy.io import fits
+
+        hdul = fits.open(path, memmap=memmap)
+        return cls(hdul[0].data, path=path, header=hdul[0].header, hdul=hdul)
+
+    def transformed(self, data):  # same file and header for a flipped or rotated view of the pixels
+        return Frame(data, path=self.path, header=self.header, hdul=self._hdul)
+
+    def close(self):  # only once no sample uses the pixels any more
+        if self._hdul is not None:
+            self._hdul.close()
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def __getitem__(self, item):
+        return self.data[item]
+
+
+class Aperture:
+    FIELDS = ("x", "y", "length", "diameter", "lower_enabled", "lower_offset", "lower_diameter", "upper_enabled", "upper_offset", "upper_diameter")
+
+    def __init__(self, x, y, length=100, diameter=15, lower_enabled=True, lower_offset=10, lower_diameter=10, upper_enabled=True, upper_offset=10,
+                 upper_diameter=10):
+        """Aperture(x, y, length=100, diameter=15, ...)
+        geometry of one measurement in data coordinates: the data aperture starting at (x, y) and the two background
+        apertures, same boxes as App._get_ap_main/_get_ap_lower/_get_ap_upper at zoom 1"""
+        self.x, self.y = int(x), int(y)
+        self.length, self.diameter = int(length), int(diameter)
+        self.lower_enabled, self.lower_offset, self.lower_diameter = bool(lower_enabled), int(lower_offset), int(lower_diameter)
+        self.upper_enabled, self.upper_offset, self.upper_diameter = bool(upper_enabled), int(upper_offset), int(upper_diameter)
+
+    @classmethod
+    def from_tuple(cls, values):  # same order as App.apertures and the aperture files
+        return cls(*values)
+
+    def as_tuple(self):
+        return tuple(getattr(self, f) for f in self.FIELDS)
+
+    def main(self):
+        return (self.x, self.y - int(np.floor(self.diameter / 2)), self.x + self.length, self.y + int(np.ceil(self.diameter / 2)))
+
+    def lower(self):  # below the data aperture, sized by the "upper" settings like App._get_ap_lower
+        y1 = self.y + int(np.ceil(self.diameter / 2)) + self.upper_offset
+        return (self.x, y1, self.x + self.length, y1 + self.upper_diameter)
+
+    def upper(self):  # above the data aperture, sized by the "lower" settings like App._get_ap_upper
+        y2 = self.y - int(np.floor(self.diameter / 2)) - self.lower_offset
+        return (self.x, y2 - self.lower_diameter, self.x + self.length, y2)
+
+    @staticmethod
+    def _view(data, box):
+        x1, y1, x2, y2 = box
+        return data[y1:y2, x1:x2]
+
+    def cut(self, data):
+        """cut(data)
+        views (no copies) of data, lower background and upper background aperture in a frame"""
+        return self._view(data, self.main()), self._view(data, self.lower()), self._view(data, self.upper())
+
+    def is_in(self, shape):
+        height, width = shape
+        return all(x1 >= 0 and y1 >= 0 and x2 < width and y2 < height for x1, y1, x2, y2 in (self.main(), self.lower(), self.upper()))
+
+    def __repr__(self):
+        return f"Aperture{self.as_tuple()}"
+
+
+# flips and rotations of the image menu, by name so a sequence of them can be passed to worker processes
+ORIENTATIONS = {"flipud": np.flipud,
+                "fliplr": np.fliplr,
+                "rot90": np.rot90,
+                "rot270": lambda d: np.rot90(d, 3)}
+
+
+def orient(data, orientation):
+    """orient(data, orientation)
+    applies a sequence of ORIENTATIONS names to the data in order, a view of it like the image menu gives"""
+    for name in orientation:
+        data = ORIENTATIONS[name](data)
+    return data
+
+
+SIDEREAL_SECONDS_PER_ARCSEC = 24 / 360.9856    # seconds a star on the celestial equator needs to drift by one arcsecond
+
+
+def time_per_pix(declination, arcsec_per_pix):
+    """time_per_pix(declination, arcsec_per_pix)
+    drift time per pixel in seconds for a star at the given declination, same as App.open_image"""
+    return SIDEREAL_SECONDS_PER_ARCSEC / np.cos(np.deg2rad(declination)) * arcsec_per_pix
+
+
+def arcsec_per_pix(declination, time_per_pix):  # inverse of time_per_pix
+    return time_per_pix * np.cos(np.deg2rad(declination)) / SIDEREAL_SECONDS_PER_ARCSEC
+
+
+def header_declination(header):
+    """header_declination(header)
+    declination in degrees from the OBJCTDEC "deg min sec" header card, None if there is none"""
+    try:
+        deg, minutes, sec = map(float, header["OBJCTDEC"].split(" "))
+    except (KeyError, TypeError, ValueError):
+        return None
+    sign = -1 if header["OBJCTDEC"].strip().startswith("-") else 1
+    return deg + sign * (minutes / 60 + sec / 3600)
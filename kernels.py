@@ -0,0 +1,273 @@
+from contextlib import contextmanager
+
+import numpy as np
+
+
+# Scanning primitives behind DataSample and the centroids, one implementation per backend:
+# "numpy" - the reference, always available
+# "numba" - the same loops compiled with numba, used automatically when numba is installed
+# Every backend has to give the same results as the reference, see the kernels checks in accuracy.py
+
+def _boxcar_numpy(data, vertical_interval):  # (n, rows, columns) -> (n, columns) window middles
+    n, rows, columns = data.shape
+    cumulative = np.zeros((n, rows + 1, columns))
+    np.cumsum(data, axis=1, dtype=cumulative.dtype, out=cumulative[:, 1:])
+    windows = cumulative[:, vertical_interval:rows] - cumulative[:, :rows - vertical_interval]
+
+    position = np.argmax(windows, axis=1) + vertical_interval // 2
+    position[np.max(windows, axis=1) <= 0] = 0
+    return position
+
+
+def _track_maximum_numpy(data, vertical_interval):  # (columns, rows) -> window middle per column, see track_maximum
+    columns, rows = data.shape
+    if rows >= vertical_interval:
+        windows = np.sum(np.lib.stride_tricks.sliding_window_view(data, vertical_interval, axis=1), axis=2)
+    else:
+        windows = np.zeros((columns, 0), dtype=data.dtype)
+    last = rows - vertical_interval     # windows[:, i] is the sum of rows i ... i + vertical_interval - 1 for i <= last
+
+    position = np.zeros(columns, dtype=np.int64)
+    prev = 0
+    for column in range(columns):
+        if not prev:
+            first, sums = 0, windows[column, :max(last, 0)]
+        else:
+            first = prev - 1 - vertical_interval
+            if first >= 0 and prev <= last:
+                sums = windows[column, first:prev + 1]
+            else:   # python slice semantics of the original scan at the edges
+                sums = np.array([np.sum(data[column, i:i + vertical_interval]) for i in range(first, prev + 1)])
+
+        best = int(np.argmax(sums)) if len(sums) else 0
+        prev = best + first + vertical_interval // 2 if len(sums) and sums[best] > 0 else 0
+        position[column] = prev
+
+    return position
+
+
+def _shift_rows_numpy(data, shifts):  # (columns, rows): row c moved by shifts[c], zero filled
+    columns, rows = data.shape
+    source = np.arange(rows)[None, :] - shifts[:, None]
+    inside = (source >= 0) & (source < rows)
+    shifted = np.take_along_axis(data, np.clip(source, 0, rows - 1), axis=1)
+    return np.where(inside, shifted, 0).astype(data.dtype, copy=False)
+
+
+def _half_maximum_bounds_numpy(profile, peak, half, lower_shift):
+    below = np.flatnonzero(profile[1:peak - lower_shift + 1] < half)
+    lo = below[-1] + 1 + lower_shift if len(below) else peak
+    below = np.flatnonzero(profile[peak + 1:] < half)
+    hi = peak + below[0] if len(below) else peak
+    return lo, hi
+
+
+def _numba_kernels():
+    import numba
+
+    @numba.njit(cache=True)
+    def boxcar(data, vertical_interval):
+        n, rows, columns = data.shape
+        position = np.zeros((n, columns), dtype=np.int64)
+        cumulative = np.zeros(rows + 1)
+        for k in range(n):
+            for c in range(columns):
+                for r in range(rows):
+                    cumulative[r + 1] = cumulative[r] + data[k, r, c]
+                best, best_i = 0., -1
+                for i in range(rows - vertical_interval):
+                    s = cumulative[i + vertical_interval] - cumulative[i]
+                    if best_i < 0 or s > best:
+                        best, best_i = s, i
+                if best_i >= 0 and best > 0:
+                    position[k, c] = best_i + vertical_interval // 2
+        return position
+
+    @numba.njit(cache=True)
+    def window_sum(row, i, vertical_interval):  # sum(row[i:i + vertical_interval]) with python slice semantics
+        n = len(row)
+        start, stop = i, i + vertical_interval
+        if start < 0:
+            start = max(start + n, 0)
+        if stop < 0:
+            stop = max(stop + n, 0)
+        stop = min(stop, n)
+        s = row.dtype.type(0)
+        for r in range(start, stop):
+            s += row[r]
+        return s
+
+    @numba.njit(cache=True)
+    def track_maximum(data, vertical_interval):
+        columns, rows = data.shape
+        position = np.zeros(columns, dtype=np.int64)
+        prev = 0
+        for column in range(columns):
+            first, end = (0, rows - vertical_interval) if prev == 0 else (prev - 1 - vertical_interval, prev + 1)
+            best, maxi = data.dtype.type(0), 0
+            for i in range(first, end):
+                s = window_sum(data[column], i, vertical_interval)
+                if s > best:
+                    best, maxi = s, i + vertical_interval // 2
+            prev = maxi
+            position[column] = maxi
+        return position
+
+    @numba.njit(cache=True)
+    def shift_rows(data, shifts):
+        columns, rows = data.shape
+        shifted = np.zeros_like(data)
+        for c in range(columns):
+            for r in range(rows):
+                source = r - shifts[c]
+                if 0 <= source < rows:
+                    shifted[c, r] = data[c, source]
+        return shifted
+
+    @numba.njit(cache=True)
+    def half_maximum_bounds(profile, peak, half, lower_shift):
+        lo, hi = peak, peak
+        for j in range(peak - lower_shift, 0, -1):
+            if profile[j] < half:
+                lo = j + lower_shift
+                break
+        for i in range(peak, len(profile) - 1):
+            if profile[i + 1] < half:
+                hi = i
+                break
+        return lo, hi
+
+    return {"boxcar": boxcar, "track_maximum": track_maximum, "shift_rows": shift_rows, "half_maximum_bounds": half_maximum_bounds}
+
+
+BACKENDS = {"numpy": lambda: {"boxcar": _boxcar_numpy, "track_maximum": _track_maximum_numpy, "shift_rows": _shift_rows_numpy,
+                              "half_maximum_bounds": _half_maximum_bounds_numpy},
+            "numba": _numba_kernels}
+
+_loaded = {}            # backend name -> kernels, compiled on first use
+_selected = ["auto"]
+
+
+def _load(name):
+    if name not in _loaded:
+        _loaded[name] = BACKENDS[name]()
+    return _loaded[name]
+
+
+def available_backends():
+    """available_backends()
+    names of the backends that can be used here, the reference first"""
+    names = []
+    for name in BACKENDS:
+        try:
+            _load(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def set_backend(name):
+    """set_backend(name)
+    "numpy", "numba" or "auto" (numba if it is installed, numpy otherwise), takes effect for the next kernel call"""
+    if name != "auto" and name not in BACKENDS:
+        raise ValueError(f"Invalid backend: {name}")
+    if name != "auto":
+        _load(name)     # fails here and not in the middle of a measurement if the backend is not installed
+    _selected[0] = name
+
+
+def get_backend():  # name of the backend the kernels currently run on
+    if _selected[0] == "auto":
+        _selected[0] = "numba" if "numba" in available_backends() else "numpy"
+    return _selected[0]
+
+
+@contextmanager
+def using(name):
+    previous = _selected[0]
+    set_backend(name)
+    try:
+        yield
+    finally:
+        _selected[0] = previous
+
+
+def _kernel(name):
+    return _load(get_backend())[name]
+
+
+def boxcar(data, vertical_interval=5):
+    """boxcar(data, vertical_interval=5)
+    (..., rows, columns) -> (..., columns) middle of the first window of vertical_interval rows with the highest sum
+    above 0, 0 if there is none"""
+    data = np.asarray(data)
+    rows, columns = data.shape[-2:]
+    if rows <= vertical_interval:
+        return np.zeros(data.shape[:-2] + (columns,), dtype=np.int64)
+    return _kernel("boxcar")(np.ascontiguousarray(data.reshape(-1, rows, columns)), vertical_interval).reshape(data.shape[:-2] + (columns,))
+
+
+def track_maximum(data, vertical_interval=5):
+    """track_maximum(data, vertical_interval=5)
+    window middle of the brightest vertical_interval rows of every column of (columns, rows) data, like the scan in
+    DataSample.get_realigned_to_maximum: a column only searches near the result of the column before, the first one
+    (and every one after a column without signal) searches all rows"""
+    return _kernel("track_maximum")(np.ascontiguousarray(data), vertical_interval)
+
+
+def shift_rows(data, shifts):
+    """shift_rows(data, shifts)
+    moves row c of (columns, rows) data by the whole number shifts[c], positive towards higher indices, zero filled.
+    Rows without a shift stay where they are"""
+    data = np.ascontiguousarray(data)
+    full = np.zeros(len(data), dtype=np.int64)
+    shifts = np.asarray(shifts, dtype=np.int64)[:len(data)]
+    full[:len(shifts)] = shifts
+    return _kernel("shift_rows")(data, full)
+
+
+def fwhm(profile, lower_shift=0):
+    """fwhm(profile, lower_shift=0)
+    (width, half maximum, lo, hi) of a crosssection, lo and hi relative to the maximum, the way DataSample has always
+    measured it: walk from the maximum to the first pixel below half maximum on both sides and interpolate between
+    the pixel the walk stopped at and the next one. lower_shift 1 tests one pixel further out on the lower side, like
+    get_fwhm"""
+    profile = np.asarray(profile)
+    peak = int(np.argmax(profile))
+    half = profile[peak] / 2
+
+    lo, hi = (int(i) for i in _kernel("half_maximum_bounds")(profile, peak, half, lower_shift))    # plain ints on every backend, they keep float32 profiles float32
+
+    lo = lo + ((half - profile[lo]) / (profile[lo + 1] - profile[lo]) - peak)
+    hi = hi + ((half - profile[hi]) / (profile[hi + 1] - profile[hi]) - peak)
+    return hi - lo, half, lo, hi
+
+
+def fwhm_batch(profiles, lower_shift=0):
+    """fwhm_batch(profiles, lower_shift=0)
+    width of every column of a (rows, n) array of crosssections in one pass, the same number fwhm(profiles[:, i],
+    lower_shift)[0] gives for each column, NaN where fwhm raises because a crossing lies on the last row"""
+    profiles = np.asarray(profiles)
+    rows, n = profiles.shape
+    r = np.arange(rows)[:, None]
+    columns = np.arange(n)
+
+    peak = np.argmax(profiles, axis=0)
+    half = profiles[peak, columns] / 2
+    below = profiles < half
+
+    left = np.max(np.where(below & (r >= 1) & (r <= peak - lower_shift), r, -1), axis=0)    # last row below half before the peak
+    right = np.min(np.where(below & (r > peak), r, rows), axis=0)                           # first row below half after it
+    lo = np.where(left >= 0, left + lower_shift, peak)
+    hi = np.where(right < rows, right - 1, peak)
+    valid = (lo + 1 < rows) & (hi + 1 < rows)
+
+    def crossing(i):  # same operations in the same order and dtype as fwhm
+        i = np.where(valid, i, 0)
+        p0, p1 = profiles[i, columns], profiles[np.minimum(i + 1, rows - 1), columns]
+        ratio = (half - p0) / (p1 - p0)
+        return i.astype(ratio.dtype) + (ratio - peak.astype(ratio.dtype))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(valid, crossing(hi) - crossing(lo), np.nan)
@@ -0,0 +1,71 @@
+import numpy as np
+
+import kernels
+import shiftadd
+
+
+def _peak_ratio(windows):  # share of the window's flux in its brightest row, higher is sharper
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.nan_to_num(np.max(windows, axis=0) / np.sum(windows, axis=0), nan=-np.inf)
+
+
+def _negative_fwhm(windows):
+    return np.nan_to_num(-kernels.fwhm_batch(windows), nan=-np.inf)
+
+
+# window score -> func((rows, windows) crosssections) -> score per window, higher is better
+SCORES = {"peak": _peak_ratio,
+          "fwhm": _negative_fwhm}
+
+
+class LuckyStack:
+    def __init__(self, data, window=10, score="peak", centroid="com", vertical_interval=5, interpolation="fft"):
+        """LuckyStack(data, window=10, score="peak", centroid="com", vertical_interval=5, interpolation="fft")
+        Param:
+        data = 2d array: background subtracted drift data
+        window = int: columns per time window, leftover columns at the end are not used
+        score = str: "peak" (peak / flux ratio) or "fwhm", see SCORES
+
+        lucky imaging along the trail: the data is realigned with shift-and-add, cut into time windows and every window
+        scored in one pass. The windows are summed up in order of their score once, so the crosssection for any
+        fraction of best windows is a single lookup"""
+        if score not in SCORES:
+            raise ValueError(f"Invalid score: {score}")
+
+        realigned = shiftadd.shift_and_add(data, centroid, vertical_interval, 1, interpolation)[0]
+        rows, cols = realigned.shape
+        self.window = max(1, min(int(window), cols))
+        n = cols // self.window
+
+        blocks = realigned[:, :n * self.window].reshape(rows, n, self.window)
+        covered = np.count_nonzero(~np.isnan(blocks), axis=2)
+        with np.errstate(invalid="ignore", divide="ignore"):  # rows shifted in from outside don't count as dark
+            self.windows = np.where(covered > 0, np.nansum(blocks, axis=2) / covered * self.window, 0.)
+
+        self.scores = SCORES[score](self.windows)
+        self.order = np.argsort(-self.scores, kind="stable")
+        self._cumulative = np.cumsum(self.windows[:, self.order], axis=1)
+
+    def __len__(self):
+        return self.windows.shape[1]
+
+    def _count(self, fraction):
+        return int(np.clip(np.ceil(fraction * len(self)), 1, len(self)))
+
+    def selected(self, fraction):  # indices of the windows kept, best first
+        return self.order[:self._count(fraction)]
+
+    def crosssection(self, fraction=.1):
+        """crosssection(fraction=.1)
+        sum of the best fraction of windows, scaled to the length of the whole trail"""
+        k = self._count(fraction)
+        return self._cumulative[:, k - 1] * (len(self) / k)
+
+    def fwhm(self, fraction=.1):
+        return kernels.fwhm(self.crosssection(fraction))
+
+    def fwhm_curve(self):
+        """fwhm_curve()
+        (fractions, FWHM) for keeping the best 1, 2, ... all windows, computed at once"""
+        n = len(self)
+        return np.arange(1, n + 1) / n, kernels.fwhm_batch(self._cumulative)
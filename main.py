@@ -1,17 +1,35 @@
+import sys
+import time
+
+import profiling
+
+STARTED = time.perf_counter()
+if __name__ == "__main__" and "--startup-time" in sys.argv:    # before every other import, so all of them are measured
+    profiling.enable()
+    profiling.trace_imports()
+
 import tkinter as tk
-from tkinter import filedialog, simpledialog
+from tkinter import filedialog, simpledialog, messagebox
 
 import re
 import numpy as np
-from astropy.io import fits
-from PIL import Image, ImageTk
 
 from dataanalyzer import DataAnalyzer
 from datasample import DataSample
+from frames import Frame, Aperture
+from stretch import Stretch
+from performancewindow import PerformanceWindow
+from watcher import DirectoryWatcher, default_config
+import frames
+import planner
+import templates
+import transport
 import util
 
 
 class App:
+    PARALLEL_APERTURES = 32     # from this many apertures on, Auto Measure computes the metrics in worker processes
+
     def __init__(self, **kwargs):
         self.args = kwargs
 
@@ -32,14 +50,35 @@ class App:
         self.root.bind("<Shift_L>", self._shift_down)
         self.root.bind("<KeyRelease-Shift_L>", self._shift_up)
 
+        if self.args.get("startup_time"):
+            self.root.after_idle(self._report_startup)
+
         self.root.mainloop()
 
+        self._release_shared_frame()    # shared memory outlives the process otherwise
+        transport.shutdown()            # worker processes of the parallel aperture measurement
+
+    def _report_startup(self):  # --startup-time: prints how long the main window took and what the imports cost, then quits
+        profiling.record("startup", time.perf_counter() - STARTED)
+        imports = profiling.import_times()
+
+        print(f"main window after {time.perf_counter() - STARTED:.3f} s, {sum(t for _, t in imports):.3f} s of it imports")
+        for name, seconds in imports[:25]:
+            print(f"{seconds * 1000:9.1f} ms  {name}")
+        self.root.destroy()
+
     def _debug(self):
         util.detect_stars(self.working_data, threshold_abs=500)
 
     def _init_vars(self):
         self.working_file = None  # active .fits file
         self.working_data = None  # 2d numpy array of .fits data
+        self.working_frame = None  # Frame shared by all samples cut from working_data
+        self.shared_frame = None  # copy of working_data in shared memory for the worker processes, made on first use
+        self.shared_source = None  # the working_data it is a copy of
+        self.stretch = None  # cached display images of working_data
+        self.orientation = []  # frames.ORIENTATIONS names applied to the opened image, in order
+        self.watcher = None  # DirectoryWatcher of the live acquisition mode
 
         self.declination = 0
         self.time_per_pix = 0
@@ -70,6 +109,8 @@ class App:
         self.back_aperture_enabled_lower = True
         self.back_aperture_enabled_upper = True
 
+        self.performance_window = None  # PerformanceWindow, if open
+
         # Key statuses
         self.shift_pressed = False
 
@@ -120,6 +161,7 @@ class App:
 
         self.filemenu.add_command(label="Open File", command=self.open_image)
         self.filemenu.add_cascade(label="Transform", menu=self.filemenu_transform)
+        self.filemenu.add_command(label="Watch Directory", command=self.toggle_watch)
         self.filemenu.add_command(label="Test Me", command=self._debug)  # debug command, TODO: remove when finalizing
         self.filemenu.add_separator()
         self.filemenu.add_command(label="Exit", command=self.root.quit)  # kills program
@@ -130,6 +172,8 @@ class App:
         self.viewmenu_brightness.add_command(label="Linear", command=self._view_linear)
         self.viewmenu_brightness.add_command(label="Squareroot", command=self._view_sqrt)
         self.viewmenu_brightness.add_command(label="log", command=self._view_log)
+        self.viewmenu_brightness.add_command(label="Percentile", command=self._view_percentile)
+        self.viewmenu_brightness.add_command(label="Asinh", command=self._view_asinh)
 
         self.viewmenu_clear = tk.Menu(self.viewmenu, tearoff=0)
         self.viewmenu_clear.add_command(label="Clear last", command=self.graphics_clear_last)
@@ -139,11 +183,14 @@ class App:
         self.viewmenu.add_cascade(label="Clear Graphics", menu=self.viewmenu_clear)
         self.viewmenu.add_command(label="Label", command=self.graphics_create_label)
         self.viewmenu.add_command(label="Clear labels", command=self.graphics_clear_labels)
+        self.viewmenu.add_command(label="Performance", command=self.show_performance)
+        self.viewmenu.add_command(label="Start Results Service", command=self.toggle_service)
         # -------
         self.measuremenu = tk.Menu(self.menubar, tearoff=0)  # Menu to measure basics
 
         self.measuremenu.add_command(label="Open Apertures", command=self.open_apertures)
         self.measuremenu.add_command(label="Save Apertures", command=self.save_apertures)
+        self.measuremenu.add_command(label="Apply Apertures to Files", command=self.apply_template)
 
         self.measuremenu_aperture_size = tk.Menu(self.measuremenu, tearoff=0)  # set aperture length and diameter using popup prompts
         self.measuremenu_aperture_size.add_command(label="Set Scan Length", command=self.set_scan_length)
@@ -163,6 +210,7 @@ class App:
     # ------------------------------------------------------------------------------------------------------------------------------
     # File operations
 
+    @profiling.timed("App.open_image")
     def open_image(self, path=None, keep_labels=False):
         """open_image(path=None)\n
         Load .fits file using astropy.io\n
@@ -176,45 +224,89 @@ class App:
             while not path:
                 path = filedialog.askopenfilename(parent=self.root, initialdir=initial_dir, title="Select file")
 
+        from astropy.io import fits     # astropy takes longer to import than the main window to appear
+
         self.working_path = path
-        self.working_file = fits.open(path)
-        self.working_data = self.working_file[0].data  # .fits files are a list of data sets, each having a header and data. the first is the one usually containing the image.
+        with profiling.timer("fits.open"):
+            self.working_file = fits.open(path, memmap=True)
+            self.working_data = self.working_file[0].data  # .fits files are a list of data sets, each having a header and data. the first is the one usually containing the image.
         self.image_zoom = 1                            # TODO: if needed, set option to open different dataset
+        self.working_frame = Frame(self.working_data, path=path, header=self.working_file[0].header, hdul=self.working_file)
+        self._release_shared_frame()
+        self.stretch = Stretch(self.working_data)
+        self.orientation = []
 
         if not keep_labels:
             self.graphics_clear_labels()
 
         self.graphics_clear_all()
 
-        try:
-            rdec = self.working_file[0].header["OBJCTDEC"]
-            deg, min, sec = map(float, rdec.split(" "))
-            self.declination = deg + min / 60 + sec / 3600
-        except KeyError:
+        self.declination = frames.header_declination(self.working_file[0].header)    # same parser as the headless paths
+        if self.declination is None:
             self.root.withdraw()
             dec = ""
             while not (m := re.match(r"^(-?[0-9]{2})°(?:([0-5][0-9])'(?:([0-5][0-9](?:[.,][0-9]+)?)(?:''|\"))?)?$", dec)):     # this regex matches every possible variation of declination in
                 dec = simpledialog.askstring(title="", prompt="Declination of Image (XX°XX'XX,XX\")")                           # min/sec form and gives groups of °, ' and "
             self.root.deiconify()
-            self.declination = float(m.group(1)) + (float(m.group(2)) / 60 if m.group(2) else 0) + (float(m.group(3).replace(",", ".")) / 3600 if m.group(3) else 0)
-        finally:
-            print("The declination is: ", self.declination)
-            self.root.withdraw()
+            sign = -1 if m.group(1).startswith("-") else 1     # minutes and seconds count away from the equator
+            self.declination = float(m.group(1)) + sign * ((float(m.group(2)) / 60 if m.group(2) else 0) + (float(m.group(3).replace(",", ".")) / 3600 if m.group(3) else 0))
 
-            arcsec_per_pix = 0
-            while not arcsec_per_pix:
-                try:
-                    arcsec_per_pix = float(simpledialog.askstring(title="", prompt="Arcsec per pixel"))
-                except TypeError:
-                    pass
+        print("The declination is: ", self.declination)
+        self.root.withdraw()
 
-            self.root.deiconify()
-            print(1 / (24 / 360.9856 / np.cos(np.deg2rad(self.declination))))
-            self.time_per_pix = 24 / 360.9856 / np.cos(np.deg2rad(self.declination)) * arcsec_per_pix
-            print(f"Time per pix is {self.time_per_pix}")
+        arcsec_per_pix = 0
+        while not arcsec_per_pix:
+            try:
+                arcsec_per_pix = float(simpledialog.askstring(title="", prompt="Arcsec per pixel"))
+            except TypeError:
+                pass
+
+        self.root.deiconify()
+        print(1 / (24 / 360.9856 / np.cos(np.deg2rad(self.declination))))
+        self.time_per_pix = frames.time_per_pix(self.declination, arcsec_per_pix)
+        print(f"Time per pix is {self.time_per_pix}")
 
         self.display_image()
 
+    def toggle_watch(self):
+        """toggle_watch()\n
+        Starts or stops measuring every new .fits file in a directory with the current aperture settings"""
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+            self.filemenu.entryconfigure("Stop Watching", label="Watch Directory")
+            return
+
+        if not self.time_per_pix:
+            messagebox.showinfo("Watch Directory", "Open one frame first to set declination and pixel scale", parent=self.root)
+            return
+
+        initial_dir = self.args.get("directory", "/")
+        directory = filedialog.askdirectory(parent=self.root, initialdir=initial_dir, title="Select capture directory")
+        if not directory:
+            return
+
+        self.watcher = DirectoryWatcher(directory, default_config(self))
+        self.watcher.start()
+        self.filemenu.entryconfigure("Watch Directory", label="Stop Watching")
+        self._collect_watched()
+
+    def _collect_watched(self):  # takes the measured frames on the Tk thread, all of one poll in one bulk add
+        if self.watcher is None:
+            return
+
+        samples, titles = [], []
+        for path, frame_samples, frame_titles in self.watcher.results():
+            samples.extend(frame_samples)
+            titles.extend(frame_titles)
+
+        if samples:
+            self.analyse_window.add_samples(samples, titles)
+            self.analyse_window.window.deiconify()
+
+        self.label_tool_text.set(f"Watching {self.watcher.directory}: {self.watcher.processed} frames, {self.watcher.backlog} waiting, {len(self.watcher.errors)} failed")
+        self.root.after(500, self._collect_watched)
+
     def open_apertures(self, path=None):
         if not path:  # ask user to open file, unless otherwise specified
             if "directory" in self.args:
@@ -223,20 +315,21 @@ class App:
                 initial_dir = r"/"
             path = filedialog.askopenfilename(parent=self.root, initialdir=initial_dir, title="Select aperture file")
 
-        ap = np.genfromtxt(path, delimiter=",")
+        apertures = templates.from_array(templates.load_template(path))
+        if not apertures:
+            return
 
-        for a in ap:
-            x, y, l, w, lio, lof, lw, uio, uof, uw = list(map(int, a))
-            self.data_aperture_length = l
-            self.data_aperture_diameter = w
-            self.back_aperture_enabled_lower = bool(lio)
-            self.back_aperture_offset_lower = lof
-            self.back_aperture_diameter_lower = lw
-            self.back_aperture_enabled_upper = bool(uio)
-            self.back_aperture_offset_upper = uof
-            self.back_aperture_diameter_upper = uw
+        last = apertures[-1]  # settings of the last aperture stay active, like placing them by hand
+        self.data_aperture_length = last.length
+        self.data_aperture_diameter = last.diameter
+        self.back_aperture_enabled_lower = last.lower_enabled
+        self.back_aperture_offset_lower = last.lower_offset
+        self.back_aperture_diameter_lower = last.lower_diameter
+        self.back_aperture_enabled_upper = last.upper_enabled
+        self.back_aperture_offset_upper = last.upper_offset
+        self.back_aperture_diameter_upper = last.upper_diameter
 
-            self.click_set_aperture(x, y, x, y)
+        self.place_apertures(apertures)
 
     def save_apertures(self, path=None):
         if not path:
@@ -244,9 +337,31 @@ class App:
                 initial_dir = self.args["directory"]
             else:
                 initial_dir = r"/"
-            path = filedialog.asksaveasfilename(parent=self.root, initialdir=initial_dir, title="Save aperture file", defaultextension=".csv")
-
-        np.savetxt(path, *self.apertures, delimiter=",")
+            path = filedialog.asksaveasfilename(parent=self.root, initialdir=initial_dir, title="Save aperture file", defaultextension=".npy",
+                                                filetypes=(("Aperture template", "*.npy"), ("Comma separated", "*.csv")))
+        if path:
+            templates.save_template(path, self.apertures)
+
+    def apply_template(self):
+        """apply_template()\n
+        Measures the current apertures in other frames of the same field, all cutouts of a frame in one pass"""
+        if not self.apertures:
+            messagebox.showinfo("Apply Template", "Place or open apertures first", parent=self.root)
+            return
+
+        initial_dir = self.args.get("directory", "/")
+        paths = filedialog.askopenfilenames(parent=self.root, initialdir=initial_dir, title="Select frames", filetypes=(("FITS", "*.fits *.fit *.fts"),))
+        if not paths:
+            return
+
+        def add(path, samples, titles):
+            self.analyse_window.add_samples(samples, titles)
+
+        errors = templates.apply_template(list(paths), self.apertures, frames.arcsec_per_pix(self.declination, self.time_per_pix), self.declination, callback=add,
+                                          orientation=self.orientation)   # the apertures are in the flipped and rotated image
+        self.analyse_window.window.deiconify()
+        if errors:
+            messagebox.showwarning("Apply Template", "\n".join(f"{p}: {e}" for p, e in errors.items()), parent=self.root)
 
 
 
@@ -254,12 +369,13 @@ class App:
 
     # ------------------------------------------------------------------------------------------------------------------------------
     # Display
+    @profiling.timed("App.display_image")
     def display_image(self, mode=None, zoom=None):
         """display_image(self, file, mode="linear")\n
         Diplays image to main canvas.\n
         Parameters:\n
         file: .fits object to be displayed\n
-        mode: brightness display mode: linear, sqrt, log"""
+        mode: brightness display mode: linear, sqrt, log, percentile, asinh"""
 
         if not mode:
             if not self.image_mode:
@@ -271,14 +387,9 @@ class App:
                 zoom = 1
             zoom = self.image_zoom
 
-        data = self.working_data
-
-        if mode == "sqrt":  # reduce sharpness of brightness curve: squareroot or log10 on array to reduce span of values
-            data = np.sqrt(np.abs(data))
-        elif mode == "log":
-            data = np.log10(np.abs(data))
+        from PIL import Image, ImageTk
 
-        data = np.uint8(data / np.max(data) * 255)  # map values between (0, 255)
+        data = np.ascontiguousarray(self.stretch.image(mode))  # brightness curve mapped to (0, 255), cached per mode
 
         self.img = ImageTk.PhotoImage(Image.fromarray(data, "L").resize((len(data), len(data[0]))))
 
@@ -298,6 +409,33 @@ class App:
             x, y = x * self.image_zoom, y * self.image_zoom
             self.graphics_clearable.append(self.canvas.create_rectangle(*self._get_ap_main(x, y), outline="blue"))
 
+    def show_performance(self):
+        if self.performance_window:
+            self.performance_window.window.lift()
+        else:
+            self.performance_window = PerformanceWindow(self)
+
+    def toggle_service(self):  # local HTTP / websocket endpoint with the metrics, for dashboards in other rooms
+        if self.analyse_window.service is not None:
+            self.analyse_window.service.stop()
+            self.analyse_window.service = None
+            self.viewmenu.entryconfigure("Stop Results Service", label="Start Results Service")
+            return
+
+        from service import ResultsService     # asyncio, only imported when the service is started
+
+        service = ResultsService(port=self.args.get("service_port", 8765))
+        try:
+            service.start()
+        except OSError as e:
+            messagebox.showerror("Results Service", str(e), parent=self.root)
+            return
+
+        self.analyse_window.service = service
+        self.analyse_window.publish()
+        self.viewmenu.entryconfigure("Start Results Service", label="Stop Results Service")
+        self.label_tool_text.set(f"Results at {service.url}/samples and {service.url}/ws")
+
     def graphics_clear_last(self):
         if len(self.graphics_clearable):
             self.canvas.delete(self.graphics_clearable.pop(-1))
@@ -407,6 +545,7 @@ class App:
         lx, ly, ltxt = self.image_label[f"Custom{self.custom_label_count}"]
         self.image_label[title] = self.canvas.create_text(lx * self.image_zoom, ly * self.image_zoom, text=ltxt, fill="red", anchor="nw"), self.image_label[title]
 
+    @profiling.timed("App.click_set_aperture")
     def click_set_aperture(self, x, y, datx, daty):
         if not self.shift_pressed:
             self.operation = "idle"
@@ -421,21 +560,12 @@ class App:
         [self.canvas.delete(g) for g in self.graphics_temp]
         self.graphics_temp = []
 
-        x1, y1, x2, y2 = self._get_ap_main(datx, daty)
-        data = self.working_data[y1:y2, x1:x2]
-
-        x1, y1, x2, y2 = self._get_ap_lower(datx, daty)
-        back1 = self.working_data[y1:y2, x1:x2]
-
-        x1, y1, x2, y2 = self._get_ap_upper(datx, daty)
-        back2 = self.working_data[y1:y2, x1:x2]
-
         meta_info = {"altitude": re.search(r"[\d.]+deg", self.working_path).group(),
                      "declination": self.declination,
                      "exposure": self.working_file[0].header["EXPOSURE"],
                      "time_per_pix": self.time_per_pix}
 
-        s = DataSample(data, self.time_per_pix, back1, back2, meta_info=meta_info)
+        s = DataSample.from_frame(self._get_frame(), Aperture.from_tuple(self.apertures[-1]), self.time_per_pix, meta_info=meta_info)
 
         self.analyse_window.add_sample(s)
         self.analyse_window.window.deiconify()
@@ -469,6 +599,7 @@ class App:
 
     # Advanced Measure
 
+    @profiling.timed("App.auto_measure")
     def auto_measure(self):
         threshold = tk.simpledialog.askfloat("Auto Measure", "Set Threshold for automatic star detection")
         stars, should_flip, should_rotate = util.detect_stars(self.working_data, threshold, min_separation=20)
@@ -480,18 +611,42 @@ class App:
 
         stars, should_flip, should_rotate = util.detect_stars(self.working_data, threshold, min_separation=20)
 
-        boxes = []
+        self.place_apertures(planner.plan_apertures(stars, self.working_data.shape, self._get_aperture_template()))
 
-        for star in stars:
-            y, x = star
-            boxes.append(self._get_ap_main(x, y))
+    @profiling.timed("App.place_apertures")
+    def place_apertures(self, apertures):
+        """place_apertures(apertures)\n
+        Measures many apertures at once: the samples are views of the open frame, added to the analyzer in one bulk add"""
+        if not self.shift_pressed:
+            self.operation = "idle"
+        if not apertures:
+            return
+
+        meta_info = {"altitude": re.search(r"[\d.]+deg", self.working_path).group(),
+                     "declination": self.declination,
+                     "exposure": self.working_file[0].header["EXPOSURE"],
+                     "time_per_pix": self.time_per_pix}
 
-        for star in stars:
-            y, x = star
-            if not self._check_all_intersections(x, y, boxes):
-                offset = self.data_aperture_diameter // 2
-                if self._check_is_in_image(self._get_ap_main(x + offset, y)):
-                    self.click_set_aperture(x + offset, y, x + offset, y)
+        samples = planner.cut_samples(self._get_frame(), apertures, self.time_per_pix, meta_info=meta_info)
+
+        # many apertures: the metrics are computed by worker processes reading the frame from shared memory, the views
+        # cut above are only kept for the analyzer and not measured again here
+        values = None
+        metrics = self.analyse_window.metrics.metrics
+        if len(apertures) >= self.PARALLEL_APERTURES and transport.can_measure(metrics):
+            values = transport.measure_parallel(self._get_shared_frame(), apertures, self.time_per_pix, [m.name for m in metrics],
+                                                meta_info=meta_info)
+        self.analyse_window.add_samples(samples, values=values)
+        self.analyse_window.window.deiconify()
+
+        for aperture, s in zip(apertures, samples):
+            datx, daty = aperture.x, aperture.y
+            self.apertures.append(aperture.as_tuple())
+            self.image_clearable.append((datx, daty))
+            self.graphics_clearable.append(self.canvas.create_rectangle(*self._get_ap_main(datx * self.image_zoom, daty * self.image_zoom), outline="blue"))
+
+            title = s.title
+            self.image_label[title] = self.canvas.create_text(datx * self.image_zoom, daty * self.image_zoom, text=title, fill="red", anchor="nw"), (datx, daty, title)
 
     # ------------------------------------------------------------------------------------------------------------------------------
     # Util functions and workarounds
@@ -508,21 +663,47 @@ class App:
         self.image_mode = "log"
         self.display_image()
 
-    def _transform_m_x(self):
-        self.working_data = np.flipud(self.working_data)
+    def _view_percentile(self):
+        self.image_mode = "percentile"
         self.display_image()
 
-    def _transform_m_y(self):
-        self.working_data = np.fliplr(self.working_data)
+    def _view_asinh(self):
+        self.image_mode = "asinh"
         self.display_image()
 
-    def _transform_r_cclockwise(self):
-        self.working_data = np.rot90(self.working_data)
+    def _transform(self, name):  # flips or rotates the working data, remembered for Apply Apertures to Files
+        self.working_data = self.stretch.transform(frames.ORIENTATIONS[name])
+        self.orientation.append(name)
         self.display_image()
 
+    def _transform_m_x(self):
+        self._transform("flipud")
+
+    def _transform_m_y(self):
+        self._transform("fliplr")
+
+    def _transform_r_cclockwise(self):
+        self._transform("rot90")
+
     def _transform_r_clockwise(self):
-        self.working_data = np.rot90(self.working_data, 3)
-        self.display_image()
+        self._transform("rot270")
+
+    def _get_shared_frame(self):  # SharedFrame of the current working data, placed in shared memory once per image
+        if self.shared_frame is None or self.shared_source is not self.working_data:
+            self._release_shared_frame()
+            self.shared_frame = transport.SharedFrame(self.working_data, path=self.working_path)
+            self.shared_source = self.working_data
+        return self.shared_frame
+
+    def _release_shared_frame(self):
+        if self.shared_frame is not None:
+            self.shared_frame.release()
+            self.shared_frame = self.shared_source = None
+
+    def _get_frame(self):  # Frame of the current working data, a new one after flips and rotations
+        if self.working_frame is None or self.working_frame.data is not self.working_data:
+            self.working_frame = self.working_frame.transformed(self.working_data)
+        return self.working_frame
 
     def _shift_down(self, event):
         self.shift_pressed = True
@@ -551,24 +732,9 @@ class App:
         y1 = y - int((np.floor(self.data_aperture_diameter / 2)) + self.back_aperture_diameter_lower + self.back_aperture_offset_lower) * self.image_zoom
         return (x1, y1, x2, y2)
 
-    @staticmethod
-    def _check_intersection(x, y, box):
-        x1, y1, x2, y2 = box
-        if x1 <= x <= x2:
-            if y1 <= y <= y2:
-                return True
-        return False
-
-    @staticmethod
-    def _check_all_intersections(x, y, boxes):
-        return sum([App._check_intersection(x, y, box) for box in boxes]) > 1
-
-    def _check_is_in_image(self, box):
-        x1, y1, x2, y2 = box
-        if x1 < 0 or len(self.working_data[0]) <= x2 or y1 < 0 or len(self.working_data) <= y2:
-            return False
-        return True
-
+    def _get_aperture_template(self):  # current aperture settings, positioned at the origin
+        return Aperture(0, 0, self.data_aperture_length, self.data_aperture_diameter, self.back_aperture_enabled_lower, self.back_aperture_offset_lower,
+                        self.back_aperture_diameter_lower, self.back_aperture_enabled_upper, self.back_aperture_offset_upper, self.back_aperture_diameter_upper)
 
 if __name__ == "__main__":
-    app = App(directory=r"C:\Users\ole\OneDrive\Desktop\Jufo\Daten")
+    app = App(directory=r"C:\Users\ole\OneDrive\Desktop\Jufo\Daten", startup_time="--startup-time" in sys.argv)
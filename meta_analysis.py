@@ -0,0 +1,200 @@
+import json
+import argparse
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+from datasample import DataSample
+from metrics import MetricsTable, batch_maximum_shift, batch_detrended, parse_altitude, resolve_interval
+
+
+# Airmass models fitted to the seeing over altitude, h in degrees
+AIRMASS_MODELS = {
+    "polynomial": (lambda x, a, b, c: a*x**2 + b*x + c, 3),
+    "exponential": (lambda x, a, b: a * np.exp(-b * x), 2),
+    "secant": (lambda x, a: a / (np.cos(np.pi/2 - (x / 180 * np.pi))), 1),
+}
+
+
+def load_samples(json_path):
+    with open(json_path, "r") as f:
+        json_data = json.load(f)
+
+    return list(json_data), [DataSample.build_from_json(json_data[m]) for m in json_data]
+
+
+def maximum_shift_series(samples, vertical_interval=5):
+    """maximum_shift_series(samples, vertical_interval=5)
+    DataSample.get_maximum_shift for every sample, computed once and batched over samples of equal aperture shape"""
+    series = [None] * len(samples)
+
+    groups = {}
+    for i, s in enumerate(samples):
+        groups.setdefault(s.data.shape, []).append(i)
+
+    for indices in groups.values():
+        shifts = batch_maximum_shift(np.stack([samples[i].data for i in indices]), vertical_interval=vertical_interval)
+        for i, shift in zip(indices, shifts):
+            series[i] = shift
+
+    return series
+
+
+def interval_stddevs(shift, intervals):
+    """interval_stddevs(shift, intervals)
+    np.std(get_slope_adjusted_t_y(interval)) for every interval, all derived from one maximum-shift series
+    through its prefix sums"""
+    length = len(shift)
+    cumulative = np.concatenate(([0], np.cumsum(shift, dtype=np.float64)))
+
+    result = np.full(len(intervals), np.nan)
+    for j, interval in enumerate(intervals):
+        if not 0 < interval < length - 1:
+            continue
+        averaged = (cumulative[interval:length] - cumulative[:length - interval]) / interval
+        result[j] = np.std(batch_detrended(averaged[None, :])[0])
+
+    return result
+
+
+def group_by_altitude(altitudes, values):
+    """group_by_altitude(altitudes, values)
+    averages values (1d, or 2d with one row per altitude entry) over equal altitudes.
+    returns sorted unique altitudes, mean values and the count per altitude"""
+    altitudes = np.asarray(altitudes, dtype=float)
+    values = np.asarray(values, dtype=float)
+
+    unique, inverse, counts = np.unique(altitudes, return_inverse=True, return_counts=True)
+
+    if values.ndim == 1:
+        means = np.bincount(inverse, weights=values, minlength=len(unique)) / counts
+    else:
+        sums = np.zeros((len(unique),) + values.shape[1:])
+        np.add.at(sums, inverse, values)
+        means = sums / counts.reshape((-1,) + (1,) * (values.ndim - 1))
+
+    return unique, means, counts
+
+
+def fit_airmass_models(altitudes, values, models=None):
+    """fit_airmass_models(altitudes, values, models=None)
+    fits every model of AIRMASS_MODELS to the aggregated values, returns dict name -> (parameters, standard error, None),
+    or (None, None, error message) for a model that could not be fitted"""
+    if models is None:
+        models = AIRMASS_MODELS
+
+    fits = {}
+    for name, (function, _) in models.items():
+        try:
+            params, _ = curve_fit(function, altitudes, values)
+        except (RuntimeError, TypeError) as e:   # no convergence or fewer points than parameters
+            fits[name] = (None, None, f"{type(e).__name__}: {e}")
+            continue
+        fits[name] = (params, np.std(values - function(altitudes, *params)), None)
+
+    return fits
+
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# Analyses, return plain dicts that can be written to json
+
+def altitude_stddev(json_path, seconds=range(10)):
+    """altitude_stddev(json_path, seconds=range(10))
+    std of the slope adjusted t-y graph for each moving average interval in seconds, for every sample of a
+    measurement file, grouped by altitude"""
+    titles, samples = load_samples(json_path)
+    series = maximum_shift_series(samples)
+
+    stddevs = np.array([interval_stddevs(shift, [resolve_interval(s, round(t / s.time_per_pix)) for t in seconds])
+                        for s, shift in zip(samples, series)])
+    altitudes = np.array([parse_altitude(s.meta_info.get("altitude")) for s in samples])
+
+    unique, means, counts = group_by_altitude(altitudes, stddevs)
+
+    return {"source": json_path,
+            "seconds": list(seconds),
+            "titles": titles,
+            "altitudes": altitudes.tolist(),
+            "stddevs": stddevs.tolist(),
+            "grouped_altitudes": unique.tolist(),
+            "grouped_stddevs": means.tolist(),
+            "counts": counts.tolist()}
+
+
+def altitude_stddev_from_headers(json_path, column="Y-Variations over 5s", exclude=None):
+    """altitude_stddev_from_headers(json_path, column="Y-Variations over 5s", exclude=None)
+    groups one column of a header file by altitude and fits the airmass models to it.
+    exclude = callable(title, altitude) -> bool, drops single measurements"""
+    headers = MetricsTable.load_headers(json_path)
+
+    titles = headers.column("Title")
+    altitudes = headers.column("Altitude")
+    values = headers.column(column)
+
+    keep = ~np.isnan(altitudes) & ~np.isnan(values)
+    if exclude is not None:
+        keep &= ~np.array([bool(exclude(t, a)) for t, a in zip(titles, altitudes)], dtype=bool)
+
+    unique, means, counts = group_by_altitude(altitudes[keep], values[keep])
+    fits = fit_airmass_models(unique, means)
+
+    return {"source": json_path,
+            "column": column,
+            "altitudes": unique.tolist(),
+            "values": means.tolist(),
+            "counts": counts.tolist(),
+            "fits": {name: {"parameters": params.tolist(), "error": float(error)} if params is not None else {"parameters": None, "error": None, "failed": message}
+                     for name, (params, error, message) in fits.items()}}
+
+
+def write_results(result, path):
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+
+
+def plot_altitude_fits(result, path=None, color="b", ax=None):
+    """plot_altitude_fits(result, path=None, color="b", ax=None)
+    draws the result of altitude_stddev_from_headers. Saves it to path if given, without needing a display"""
+    if ax is None:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        ax = figure.add_subplot(111)
+
+    x_val = np.array(result["altitudes"])
+    y_val = np.array(result["values"])
+
+    if result["fits"].get("secant", {}).get("parameters") is not None:
+        (a_cos,), error_cos = result["fits"]["secant"]["parameters"], result["fits"]["secant"]["error"]
+        plot_x = np.linspace(.5, 89.5, 900)
+        ax.plot(plot_x, AIRMASS_MODELS["secant"][0](plot_x, a_cos), color, label=f"{a_cos:.2f} * sec(90° - h) \nStandard Regression Error={error_cos}", alpha=.5)
+
+    ax.plot(x_val, y_val, color + "x")
+    ax.set_xlim(90, 0)
+    if np.isfinite(y_val).any():     # nothing left to scale to when every row was excluded or failed
+        ax.set_ylim(0, np.nanmax(y_val) * 1.2)
+    ax.set_xlabel("h [°]")
+    ax.legend()
+
+    if path:
+        ax.figure.tight_layout()
+        ax.figure.savefig(path)
+
+    return ax
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Altitude / seeing meta analysis without the GUI")
+    parser.add_argument("mode", choices=("samples", "headers"), help="measurement file (samples) or header file (headers)")
+    parser.add_argument("json_path")
+    parser.add_argument("--out", required=True, help="path of the result .json, a .png is written next to it for headers")
+    args = parser.parse_args()
+
+    if args.mode == "samples":
+        write_results(altitude_stddev(args.json_path), args.out)
+    else:
+        result = altitude_stddev_from_headers(args.json_path)
+        write_results(result, args.out)
+        plot_altitude_fits(result, path=args.out.rsplit(".", 1)[0] + ".png")
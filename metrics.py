@@ -0,0 +1,357 @@
+import json
+
+import numpy as np
+
+import kernels
+import precision
+import scintillation
+
+
+class Metric:
+    def __init__(self, name, func, dtype=np.float64, batch_func=None):
+        """Metric(name, func, dtype=np.float64, batch_func=None)
+        Param:
+        name = str: column title, also used as key in header files
+        func = callable(sample): value for a single DataSample
+        batch_func = callable(samples, data): values for a list of samples of equal aperture shape, data being their
+            background subtracted data stacked into one 3d array (sample, y, x)
+
+        one column of the MetricsTable"""
+        self.name = name
+        self.func = func
+        self.dtype = np.dtype(dtype)
+        self.batch_func = batch_func
+
+    def compute(self, samples, data=None):
+        if self.batch_func is not None and data is not None:
+            return np.asarray(self.batch_func(samples, data), dtype=self.dtype)
+        return np.array([self.func(s) for s in samples], dtype=self.dtype)
+
+
+METRICS = []    # registered metric columns, in display order
+
+
+def register_metric(name, func, dtype=np.float64, batch_func=None):
+    """register_metric(name, func, dtype=np.float64, batch_func=None)
+    adds a metric column to every MetricsTable created afterwards, use MetricsTable.add_metric for existing tables"""
+    metric = Metric(name, func, dtype=dtype, batch_func=batch_func)
+    METRICS.append(metric)
+    return metric
+
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# Batch versions of the DataSample measurements, working on stacked (sample, y, x) arrays
+
+def parse_altitude(altitude):  # meta_info stores altitudes as "45.5deg" strings, header files as numbers
+    try:
+        return float(str(altitude).strip().strip("deg"))
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def batch_maximum_shift(data, vertical_interval=5):
+    """batch_maximum_shift(data, vertical_interval=5)
+    same as DataSample.get_maximum_shift for every sample of the 3d array data at once, returns (sample, x) array"""
+    return data.shape[1] // 2 - kernels.boxcar(data, vertical_interval)
+
+
+def batch_moving_average(values, interval):  # (sample, x) -> (sample, x - interval), like the list comprehensions in DataSample
+    n, length = values.shape
+    if interval <= 0 or interval >= length:
+        return np.full((n, max(length - interval, 0)), np.nan)
+
+    cumulative = np.zeros((n, length + 1))
+    np.cumsum(values, axis=1, out=cumulative[:, 1:])
+    return (cumulative[:, interval:length] - cumulative[:, :length - interval]) / interval
+
+
+def batch_detrended(values):  # subtracts the linear regression of every row, like np.polyfit(x, y, 1) in DataSample
+    length = values.shape[1]
+    x = np.arange(length) - length // 2
+    x_centered = x - x.mean()
+
+    slope = (values - values.mean(axis=1, keepdims=True)) @ x_centered / np.sum(x_centered ** 2)
+    intercept = values.mean(axis=1) - slope * x.mean()
+
+    return values - (slope[:, None] * x + intercept[:, None])
+
+
+def resolve_interval(sample, interval):  # applies the interval fallbacks of DataSample.get_slope_adjusted_t_y
+    if not interval:
+        interval = sample.delta_pix(time=sample.interval_time)
+
+    _, _, interval = sample._adjust_bounds(0, 0, interval)
+
+    if not interval:
+        interval = sample.delta_pix(time=sample.interval_time)
+
+    return interval
+
+
+def _batch_signal(samples, data):
+    return np.sum(data, axis=(1, 2), dtype=precision.accumulate_dtype())
+
+
+def _batch_snr(samples, data):
+    first = samples[0]
+    if any(s.background1.shape != first.background1.shape or s.background2.shape != first.background2.shape for s in samples):
+        return np.array([s.snr for s in samples])
+
+    if first.background1.shape == first.background2.shape:
+        background = np.stack([np.array((s.background1, s.background2)) for s in samples])
+    elif sum(first.background1.shape) > sum(first.background2.shape):
+        background = np.stack([s.background1 for s in samples])
+    else:
+        background = np.stack([s.background2 for s in samples])
+
+    background_dev = np.std(background.reshape(len(samples), -1), axis=1)
+
+    signal = np.sum(data, axis=(1, 2), dtype=precision.accumulate_dtype())
+    time_per_pix = np.array([s.time_per_pix for s in samples])
+    readout_dev = np.array([s.readout_dev for s in samples])
+
+    time = time_per_pix * data.shape[2]
+    pixel_count = data.shape[1] * data.shape[2]
+
+    return signal / np.sqrt(signal + time * pixel_count * (background_dev + readout_dev ** 2))
+
+
+def _normalized_stddev(sample):
+    line = sample.get_flattened_line()
+    return np.std(line / np.mean(line))
+
+
+def _batch_normalized_stddev(samples, data):
+    lines = np.sum(data, axis=1, dtype=precision.accumulate_dtype())
+    return np.std(lines / np.mean(lines, axis=1, keepdims=True), axis=1)
+
+
+def _y_variation(sample, seconds=5):
+    return np.std(sample.get_slope_adjusted_t_y(interval=round(seconds / sample.time_per_pix)))
+
+
+def _batch_y_variation(samples, data, seconds=5):
+    shifts = batch_maximum_shift(data)
+    intervals = np.array([resolve_interval(s, round(seconds / s.time_per_pix)) for s in samples])
+
+    result = np.empty(len(samples))
+    for interval in np.unique(intervals):
+        group = intervals == interval
+        averaged = batch_moving_average(shifts[group], interval)
+        if averaged.shape[1] < 2:
+            result[group] = np.nan
+            continue
+        result[group] = np.std(batch_detrended(averaged), axis=1)
+
+    return result
+
+
+def _batch_lines(data):  # get_flattened_line of every sample of the stack
+    return np.sum(data, axis=1, dtype=precision.accumulate_dtype())
+
+
+def _batch_scintillation_index(samples, data):
+    return scintillation.scintillation_index(_batch_lines(data))
+
+
+def _batch_correlation_time(samples, data):
+    return scintillation.autocorrelation_time(_batch_lines(data), np.array([s.time_per_pix for s in samples], dtype=float))
+
+
+def _batch_structure_function(samples, data, seconds=1):
+    return scintillation.structure_function_at(_batch_lines(data), seconds, np.array([s.time_per_pix for s in samples], dtype=float))
+
+
+register_metric("Altitude", lambda s: parse_altitude(s.meta_info.get("altitude")))
+register_metric("Brightness", lambda s: s.signal, batch_func=_batch_signal)
+register_metric("SNR", lambda s: s.snr, batch_func=_batch_snr)
+register_metric("Normalized StdDev", _normalized_stddev, batch_func=_batch_normalized_stddev)
+register_metric("Y-Variations over 5s", _y_variation, batch_func=_batch_y_variation)
+register_metric("Scintillation Index", lambda s: scintillation.scintillation_index(s.get_flattened_line()), batch_func=_batch_scintillation_index)
+register_metric("Correlation Time [s]", lambda s: scintillation.autocorrelation_time(s.get_flattened_line(), s.time_per_pix),
+                batch_func=_batch_correlation_time)
+register_metric("Structure Function 1s", lambda s: scintillation.structure_function_at(s.get_flattened_line(), 1, s.time_per_pix),
+                batch_func=_batch_structure_function)
+
+
+# ------------------------------------------------------------------------------------------------------------------------------
+
+class MetricsTable:
+    def __init__(self, metrics=None, capacity=64):
+        """MetricsTable(metrics=None)
+        columnar store of the metrics of all samples of a session, one row per sample. Rows are identified by a stable
+        integer id, columns are the title plus one typed column per registered Metric"""
+        self.metrics = list(METRICS if metrics is None else metrics)
+
+        self._rows = np.zeros(capacity, dtype=self._dtype())
+        self._index = {}    # sample id -> row
+        self.size = 0
+        self.next_id = 0
+
+    def _dtype(self):
+        return np.dtype([("id", np.int64), ("Title", object)] + [(m.name, m.dtype) for m in self.metrics])
+
+    @property
+    def columns(self):
+        return ("Title",) + tuple(m.name for m in self.metrics)
+
+    @property
+    def rows(self):
+        return self._rows[:self.size]
+
+    @property
+    def ids(self):
+        return self._rows["id"][:self.size]
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, sample_id):
+        return sample_id in self._index
+
+    def column(self, name):
+        return self._rows[name][:self.size]
+
+    def index_of(self, sample_id):
+        return self._index[sample_id]
+
+    def row(self, sample_id):
+        return self._rows[self._index[sample_id]]
+
+    def values(self, sample_id):  # python values of a row, in column order
+        row = self.row(sample_id)
+        return tuple(row[c].item() if isinstance(row[c], np.generic) else row[c] for c in self.columns)
+
+    # Computation
+
+    def compute(self, samples, metrics=None):
+        """compute(samples, metrics=None)
+        computes every metric for a list of DataSamples, batched over all samples of equal aperture shape.
+        returns dict column name -> array in the order of samples"""
+        if metrics is None:
+            metrics = self.metrics
+
+        results = {m.name: np.empty(len(samples), dtype=m.dtype) for m in metrics}
+
+        groups = {}
+        for i, s in enumerate(samples):
+            groups.setdefault(np.shape(s.data_raw), []).append(i)
+
+        for indices in groups.values():
+            group = [samples[i] for i in indices]
+            data = np.stack([s.data for s in group])
+
+            for m in metrics:
+                results[m.name][indices] = m.compute(group, data)
+
+        return results
+
+    def add_samples(self, samples, titles):
+        """add_samples(samples, titles)
+        computes and appends the metrics of all samples, returns the ids of the new rows"""
+        return self.add_rows(titles, self.compute(samples))
+
+    def add_rows(self, titles, values):  # appends precomputed metrics, values being dict column name -> array
+        n = len(titles)
+        self._reserve(self.size + n)
+
+        ids = np.arange(self.next_id, self.next_id + n)
+        block = self._rows[self.size:self.size + n]
+
+        block["id"] = ids
+        block["Title"] = list(titles)
+        for m in self.metrics:
+            block[m.name] = values[m.name]
+
+        for i, sample_id in enumerate(ids):
+            self._index[int(sample_id)] = self.size + i
+
+        self.size += n
+        self.next_id += n
+
+        return [int(i) for i in ids]
+
+    def add_metric(self, metric, samples):
+        """add_metric(metric, samples)
+        adds a new column to an existing table, samples being dict sample id -> DataSample or a SampleCollection for all rows"""
+        rows = self._rows
+        self.metrics.append(metric)
+        self._rows = np.zeros(len(rows), dtype=self._dtype())
+        for name in rows.dtype.names:
+            self._rows[name] = rows[name]
+
+        if not self.size:
+            return
+        if hasattr(samples, "compute"):     # SampleCollection: straight from its contiguous storage
+            self._rows[metric.name][:self.size] = samples.compute([metric], [int(i) for i in self.ids])[metric.name]
+        else:
+            ordered = [samples[int(i)] for i in self.ids]
+            self._rows[metric.name][:self.size] = self.compute(ordered, metrics=[metric])[metric.name]
+
+    def _reserve(self, size):
+        if size <= len(self._rows):
+            return
+        rows = np.zeros(max(size, 2 * len(self._rows)), dtype=self._rows.dtype)
+        rows[:self.size] = self._rows[:self.size]
+        self._rows = rows
+
+    # Editing
+
+    def set_title(self, sample_id, title):
+        self._rows["Title"][self._index[sample_id]] = title
+
+    def delete(self, sample_ids):
+        remove = np.isin(self.ids, list(sample_ids))
+        keep = self.rows[~remove].copy()
+
+        self._rows[:len(keep)] = keep
+        self._rows[len(keep):self.size] = np.zeros(self.size - len(keep), dtype=self._rows.dtype)
+        self.size = len(keep)
+        self._index = {int(sample_id): i for i, sample_id in enumerate(self.ids)}
+
+    def clear(self):
+        self.delete(list(self._index))
+
+    # Sorting and export
+
+    def order_by(self, column, reverse=False):
+        """order_by(column, reverse=False)
+        returns the row indices sorted by a column. Numeric columns sort with NaNs last, the title column as strings"""
+        values = self.column(column)
+
+        if values.dtype == object:
+            order = np.array(sorted(range(self.size), key=lambda i: str(values[i]), reverse=reverse), dtype=int)
+            return order
+
+        order = np.argsort(-values if reverse else values, kind="stable")
+        nan = np.isnan(values[order]) if values.dtype.kind == "f" else np.zeros(len(order), dtype=bool)
+        return np.concatenate((order[~nan], order[nan]))
+
+    def get_headers(self, sample_ids=None):  # title -> row values, the format of the "Save only Headers" files
+        if sample_ids is None:
+            sample_ids = self.ids
+        return {self.row(int(i))["Title"]: list(self.values(int(i))) for i in sample_ids}
+
+    def save_headers(self, path, sample_ids=None):
+        with open(path, "w") as f:
+            json.dump(self.get_headers(sample_ids), f)
+
+    @classmethod
+    def load_headers(cls, path):
+        """load_headers(path)
+        reads a header file written by save_headers (or by older versions, which stored every cell as displayed)"""
+        with open(path, "r") as f:
+            headers = json.load(f)
+
+        table = cls()
+        titles = list(headers)
+        values = {m.name: np.full(len(titles), np.nan) if m.dtype.kind == "f" else np.zeros(len(titles), dtype=m.dtype)
+                  for m in table.metrics}
+
+        for i, title in enumerate(titles):
+            row = headers[title]
+            for m, value in zip(table.metrics, row[1:]):
+                values[m.name][i] = parse_altitude(value) if m.name == "Altitude" else float(value)
+
+        table.add_rows(titles, values)
+        return table
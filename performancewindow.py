@@ -0,0 +1,84 @@
+import tkinter as tk
+from tkinter import ttk, filedialog
+
+import profiling
+
+
+class PerformanceWindow:
+    def __init__(self, parent_app, refresh_ms=1000):
+        """PerformanceWindow(parent_app)
+        lists the calls recorded by profiling: count, total / mean / min / max time and array elements"""
+        self.parent_app = parent_app
+        self.refresh_ms = refresh_ms
+
+        self.window = tk.Toplevel()
+        self.window.title("Performance")
+        self.window.geometry("900x400")
+
+        self.enabled = tk.BooleanVar(value=profiling.ENABLED)
+
+        self.top_frame = tk.Frame(master=self.window)
+        self.top_frame.pack(expand=False, fill=tk.X)
+
+        tk.Checkbutton(self.top_frame, variable=self.enabled, text="Record", command=self._toggle).pack(side=tk.LEFT)
+        tk.Button(self.top_frame, text="Reset", command=self._reset).pack(side=tk.LEFT)
+        tk.Button(self.top_frame, text="Dump to JSON", command=self._dump).pack(side=tk.LEFT)
+
+        self.columns = ("Function", "Calls", "Total [ms]", "Mean [ms]", "Min [ms]", "Max [ms]", "Elements / Call")
+        self.sort_column = "Total [ms]"
+
+        self.sheet = ttk.Treeview(self.window, columns=self.columns, show="headings")
+        for col in self.columns:
+            self.sheet.heading(col, text=col, command=lambda _col=col: self._sort(_col))
+        self.sheet.pack(fill="both", expand=True, side=tk.TOP)
+
+        self.window.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self._after = None
+        self.refresh()
+
+    def refresh(self):
+        stats = profiling.snapshot()
+
+        rows = []
+        for name, s in stats.items():
+            rows.append((name, s["count"], s["total_s"] * 1e3, s["mean_s"] * 1e3, s["min_s"] * 1e3, s["max_s"] * 1e3,
+                         s["elements"] // s["count"] if s["count"] else 0))
+
+        key = self.columns.index(self.sort_column)
+        rows.sort(key=lambda r: r[key], reverse=key != 0)
+
+        self.sheet.delete(*self.sheet.get_children())
+        for r in rows:
+            self.sheet.insert("", "end", values=(r[0], r[1], *(f"{v:.3f}" for v in r[2:6]), r[6]))
+
+        self._after = self.window.after(self.refresh_ms, self.refresh)
+
+    def _sort(self, col):
+        self.sort_column = col
+        self._refresh_now()
+
+    def _toggle(self):
+        profiling.enable(self.enabled.get())
+
+    def _reset(self):
+        profiling.reset()
+        self._refresh_now()
+
+    def _refresh_now(self):
+        if self._after:
+            self.window.after_cancel(self._after)
+        self.refresh()
+
+    def _dump(self):
+        initial_dir = "/"
+        if "directory" in self.parent_app.args:
+            initial_dir = self.parent_app.args["directory"]
+        file = filedialog.asksaveasfilename(defaultextension=".json", initialdir=initial_dir, parent=self.window)
+        if file:
+            profiling.dump(file)
+
+    def on_closing(self):
+        if self._after:
+            self.window.after_cancel(self._after)
+        self.parent_app.performance_window = None
+        self.window.destroy()
@@ -0,0 +1,85 @@
+import numpy as np
+
+from datasample import DataSample
+from frames import Frame, Aperture
+
+
+def main_boxes(x, y, length, diameter):
+    """main_boxes(x, y, length, diameter)
+    (n, 4) array of data aperture boxes (x1, y1, x2, y2) at the points x, y, same as Aperture.main for every point"""
+    x, y = np.asarray(x, dtype=np.int64), np.asarray(y, dtype=np.int64)
+    return np.stack((x, y - int(np.floor(diameter / 2)), x + length, y + int(np.ceil(diameter / 2))), axis=-1)
+
+
+class GridIndex:
+    def __init__(self, boxes):
+        """GridIndex(boxes)
+        Param:
+        boxes = (n, 4) array of (x1, y1, x2, y2), all of the same size
+
+        uniform grid over the box corners with one box size per cell, so a point can only lie in boxes registered in
+        its own cell or the cells left of and above it"""
+        self.boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        self.cell = (max(int(np.max(self.boxes[:, 2] - self.boxes[:, 0], initial=0)), 1),
+                     max(int(np.max(self.boxes[:, 3] - self.boxes[:, 1], initial=0)), 1))
+
+        self.cells = {}     # (cell x, cell y) -> array of box indices
+        keys = self.boxes[:, :2] // self.cell
+        order = np.lexsort((keys[:, 1], keys[:, 0]))
+        if len(order):
+            sorted_keys = keys[order]
+            starts = np.flatnonzero(np.any(np.diff(sorted_keys, axis=0), axis=1)) + 1
+            for key, members in zip(sorted_keys[np.r_[0, starts]], np.split(order, starts)):
+                self.cells[tuple(key)] = members
+
+    def count_containing(self, points):
+        """count_containing(points)
+        number of boxes containing each (x, y) point, borders included"""
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        counts = np.zeros(len(points), dtype=np.int64)
+
+        cx, cy = points[:, 0] // self.cell[0], points[:, 1] // self.cell[1]
+        for i, (x, y) in enumerate(points):
+            for key in ((cx[i], cy[i]), (cx[i] - 1, cy[i]), (cx[i], cy[i] - 1), (cx[i] - 1, cy[i] - 1)):
+                members = self.cells.get(key)
+                if members is None:
+                    continue
+                b = self.boxes[members]
+                counts[i] += np.count_nonzero((b[:, 0] <= x) & (x <= b[:, 2]) & (b[:, 1] <= y) & (y <= b[:, 3]))
+
+        return counts
+
+
+def plan_apertures(stars, shape, template):
+    """plan_apertures(stars, shape, template)
+    Param:
+    stars = (y, x) points of detected stars
+    shape = (height, width) of the image
+    template = Aperture: geometry to use, its position is ignored
+
+    apertures for Auto Measure: one per star that no other star's aperture box overlaps, shifted right by half the
+    diameter and with its data aperture inside the image"""
+    stars = np.asarray(stars, dtype=np.int64).reshape(-1, 2)
+    if not len(stars):
+        return []
+
+    y, x = stars[:, 0], stars[:, 1]
+    free = GridIndex(main_boxes(x, y, template.length, template.diameter)).count_containing(np.stack((x, y), axis=-1)) <= 1
+
+    x = x + template.diameter // 2
+    height, width = shape
+    x1, y1, x2, y2 = main_boxes(x, y, template.length, template.diameter).T
+    inside = (x1 >= 0) & (x2 < width) & (y1 >= 0) & (y2 < height)
+
+    geometry = template.as_tuple()[2:]
+    return [Aperture(xi, yi, *geometry) for xi, yi in zip(x[free & inside], y[free & inside])]
+
+
+def cut_samples(frame, apertures, time_per_pix, meta_info={}, readout_noise=12.7865):
+    """cut_samples(frame, apertures, time_per_pix, meta_info={}, readout_noise=12.7865)
+    DataSamples of all apertures, cut like DataSample.from_frame: their raw arrays are slice views of the pixels of
+    frame (a Frame or a 2d array), nothing is copied. Each sample gets its own copy of meta_info"""
+    if not isinstance(frame, Frame):
+        frame = Frame(frame)
+
+    return [DataSample.from_frame(frame, aperture, time_per_pix, meta_info=dict(meta_info), readout_noise=readout_noise) for aperture in apertures]
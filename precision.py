@@ -0,0 +1,48 @@
+import numpy as np
+
+
+# dtypes used by DataSample and the batch metrics:
+# compute - background subtracted data and everything derived element-wise from it
+# accumulate - sums, means and standard deviations over many pixels
+POLICIES = {"single": {"compute": np.float32, "accumulate": np.float64},
+            "double": {"compute": np.float64, "accumulate": np.float64}}
+
+policy = dict(POLICIES["single"])
+
+
+def set_precision(name):
+    """set_precision(name)
+    "single" keeps pixel data in float32, which is exact for 16 bit frames with a median background, "double" restores
+    the old float64 pipeline"""
+    if name not in POLICIES:
+        raise ValueError(f"Invalid precision: {name}")
+    policy.update(POLICIES[name])
+
+
+def compute_dtype():
+    return policy["compute"]
+
+
+def accumulate_dtype():
+    return policy["accumulate"]
+
+
+def compact_raw(data):
+    """compact_raw(data)
+    raw pixel data without implicit upcasts: integer arrays are kept as they are (no copy for views), float arrays that
+    only hold whole numbers, like the ones in sessions saved by older versions, go back to uint16 or int32"""
+    data = np.asarray(data)
+
+    if data.dtype.kind != "f" or not data.size:
+        return data
+
+    if not np.all(np.isfinite(data)) or not np.all(data == np.round(data)):
+        return data
+
+    lo, hi = np.min(data), np.max(data)
+    for dtype in (np.uint16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return data.astype(dtype)
+
+    return data
@@ -0,0 +1,171 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+
+ENABLED = bool(os.environ.get("DRIFTSCANNER_PROFILE"))    # checked on every instrumented call, keep it a plain global
+
+_stats = {}
+_lock = threading.Lock()
+
+
+class Stat:
+    __slots__ = ("count", "total", "min", "max", "last", "elements", "max_elements")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.min = float("inf")
+        self.max = 0.
+        self.last = 0.
+        self.elements = 0       # array elements passed in and out, summed over all calls
+        self.max_elements = 0
+
+    def as_dict(self):
+        return {"count": self.count,
+                "total_s": self.total,
+                "mean_s": self.total / self.count if self.count else 0.,
+                "min_s": self.min if self.count else 0.,
+                "max_s": self.max,
+                "last_s": self.last,
+                "elements": self.elements,
+                "max_elements": self.max_elements}
+
+
+def enable(on=True):
+    global ENABLED
+    ENABLED = on
+
+
+def disable():
+    enable(False)
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def record(name, seconds, elements=0):
+    with _lock:
+        stat = _stats.get(name)
+        if stat is None:
+            stat = _stats[name] = Stat()
+        stat.count += 1
+        stat.total += seconds
+        stat.last = seconds
+        stat.min = min(stat.min, seconds)
+        stat.max = max(stat.max, seconds)
+        stat.elements += elements
+        stat.max_elements = max(stat.max_elements, elements)
+
+
+def array_elements(*values):  # number of array elements among values, without importing numpy
+    total = 0
+    for v in values:
+        size = getattr(v, "size", None)
+        if isinstance(size, int) and hasattr(v, "shape"):
+            total += size
+        elif isinstance(v, (tuple, list)) and len(v) < 16:
+            total += array_elements(*v)
+    return total
+
+
+def timed(name=None):
+    """timed(name=None)
+    decorator recording calls, time and array sizes of a function under name (default: its qualified name).
+    Costs one global lookup per call while profiling is disabled"""
+    def decorator(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            t = time.perf_counter()
+            result = func(*args, **kwargs)
+            record(label, time.perf_counter() - t, array_elements(*args, result))
+            return result
+
+        return wrapper
+    return decorator
+
+
+class timer:
+    def __init__(self, name, elements=0):
+        """timer(name, elements=0)
+        context manager recording the time of a block, for calls that can't be decorated, e.g. fits.open"""
+        self.name = name
+        self.elements = elements
+        self.start = None
+
+    def __enter__(self):
+        if ENABLED:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            record(self.name, time.perf_counter() - self.start, self.elements)
+        return False
+
+
+def instrument_class(cls, prefixes=("get_",)):
+    """instrument_class(cls, prefixes=("get_",))
+    wraps every method of cls starting with one of prefixes with timed()"""
+    for attr, member in list(vars(cls).items()):
+        if callable(member) and attr.startswith(prefixes):
+            setattr(cls, attr, timed(f"{cls.__name__}.{attr}")(member))
+    return cls
+
+
+_importing = threading.local()     # time spent in nested imports of the imports in progress, per thread
+
+
+def trace_imports():
+    """trace_imports()
+    records every module imported from now on as "import <module>", with the time of its own body only, the modules
+    it imports are recorded under their own names. Call it before the imports to measure, see main.py --startup-time"""
+    import builtins
+
+    original = builtins.__import__
+    if getattr(original, "traced", False):
+        return
+
+    def traced_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return original(name, globals, locals, fromlist, level)
+
+        stack = _importing.__dict__.setdefault("stack", [])
+        stack.append(0.)
+        t = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            seconds = time.perf_counter() - t
+            nested = stack.pop()
+            if stack:
+                stack[-1] += seconds
+            record("import " + name, seconds - nested)
+
+    traced_import.traced = True
+    builtins.__import__ = traced_import
+
+
+def import_times():  # [(module, seconds)] of the imports recorded by trace_imports, slowest first
+    with _lock:
+        times = [(name[len("import "):], stat.total) for name, stat in _stats.items() if name.startswith("import ")]
+    return sorted(times, key=lambda t: t[1], reverse=True)
+
+
+def snapshot():
+    with _lock:
+        return {name: stat.as_dict() for name, stat in _stats.items()}
+
+
+def dump(path):
+    with open(path, "w") as f:
+        json.dump({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "stats": snapshot()}, f, indent=2)
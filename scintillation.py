@@ -0,0 +1,83 @@
+import numpy as np
+
+
+# Intensity statistics of flux time series (get_flattened_line). All functions take (..., time) arrays, so one line or
+# the lines of all samples of equal length stacked into one 2d array, and work along the last axis.
+
+def scintillation_index(lines):
+    """scintillation_index(lines)
+    variance of the intensity normalized by its mean squared, sigma_I² / <I>²"""
+    lines = np.asarray(lines, dtype=float)
+    mean = np.mean(lines, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.var(lines, axis=-1) / mean ** 2
+
+
+def _lagged_products(lines):  # sum over t of x(t) x(t + lag) for every lag, through one zero padded FFT
+    n = lines.shape[-1]
+    size = 1 << (2 * n - 1).bit_length()     # power of two, long enough that no lag wraps around
+    spectrum = np.fft.rfft(lines, n=size, axis=-1)
+    return np.fft.irfft(spectrum * np.conj(spectrum), n=size, axis=-1)[..., :n]
+
+
+def autocorrelation(lines):
+    """autocorrelation(lines)
+    normalized autocorrelation of the intensity fluctuations for lags 0 ... length - 1, 1 at lag 0"""
+    lines = np.asarray(lines, dtype=float)
+    fluctuation = lines - np.mean(lines, axis=-1, keepdims=True)
+    products = _lagged_products(fluctuation)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return products / products[..., :1]
+
+
+def structure_function(lines, max_lag=None):
+    """structure_function(lines, max_lag=None)
+    temporal structure function of the normalized intensity, <(I(t + lag) - I(t))²> / <I>² for lags 0 ... max_lag
+    (default half the length). The squares come from cumulative sums and the cross term from the FFT autocorrelation,
+    so it is O(n log n) instead of one pass per lag"""
+    lines = np.asarray(lines, dtype=float)
+    n = lines.shape[-1]
+    max_lag = n // 2 if max_lag is None else min(int(max_lag), n - 1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        normalized = lines / np.mean(lines, axis=-1, keepdims=True)
+    squares = np.cumsum(normalized ** 2, axis=-1)
+    total = squares[..., -1:]
+    lags = np.arange(max_lag + 1)
+
+    head = squares[..., n - 1 - lags]                                       # x(0)² ... x(n - 1 - lag)²
+    tail = total - np.concatenate((np.zeros(lines.shape[:-1] + (1,)), squares[..., :max_lag]), axis=-1)   # x(lag)² ... x(n - 1)²
+    cross = _lagged_products(normalized)[..., :max_lag + 1]
+
+    return (head + tail - 2 * cross) / (n - lags)
+
+
+def autocorrelation_time(lines, time_per_pix=1.):
+    """autocorrelation_time(lines, time_per_pix=1.)
+    lag where the autocorrelation first drops below 1/e, interpolated between the pixels and converted to seconds with
+    time_per_pix (scalar or one per line). NaN where it never does"""
+    acf = autocorrelation(lines)
+    below = acf < 1 / np.e
+    below[..., 0] = False
+
+    found = np.any(below, axis=-1)
+    lag = np.argmax(below, axis=-1)
+    before = np.take_along_axis(acf, np.maximum(lag - 1, 0)[..., None], axis=-1)[..., 0]
+    after = np.take_along_axis(acf, lag[..., None], axis=-1)[..., 0]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        crossing = lag - 1 + (before - 1 / np.e) / (before - after)
+
+    return np.where(found, crossing, np.nan) * np.asarray(time_per_pix, dtype=float)
+
+
+def structure_function_at(lines, seconds, time_per_pix):
+    """structure_function_at(lines, seconds, time_per_pix)
+    structure function at the lag closest to the given time, NaN if the lines are shorter than that"""
+    lines = np.asarray(lines, dtype=float)
+    lag = np.broadcast_to(np.round(seconds / np.asarray(time_per_pix, dtype=float)).astype(np.int64), lines.shape[:-1])
+    valid = (lag >= 0) & (lag < lines.shape[-1])
+    if not np.any(valid):
+        return np.full(lines.shape[:-1], np.nan)
+
+    values = structure_function(lines, np.max(lag[valid]))
+    return np.where(valid, np.take_along_axis(values, np.where(valid, lag, 0)[..., None], axis=-1)[..., 0], np.nan)
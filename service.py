@@ -0,0 +1,235 @@
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import struct
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_LIMIT = 1000            # rows per page
+MAX_WRITE_BUFFER = 1 << 20  # websocket readers that fall this far behind are dropped
+
+
+def _json_value(value):  # NaN and inf are not valid JSON
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+class Snapshot:
+    def __init__(self):
+        """Snapshot()
+        published rows, each encoded to JSON once when it is published. Readers only slice and join the encoded rows,
+        so any number of requests is served without touching the measurements again"""
+        self.columns = ()
+        self.version = 0
+        self._order = []        # sample ids in publishing order
+        self._rows = {}         # sample id -> encoded row
+        self._lock = threading.Lock()
+
+    def update(self, columns, rows):  # rows: dict sample id -> dict column -> value, returns the encoded rows
+        encoded = []
+        with self._lock:
+            self.columns = tuple(columns)
+            for sample_id, row in rows.items():
+                text = json.dumps({"id": sample_id, **{k: _json_value(v) for k, v in row.items()}})
+                if sample_id not in self._rows:
+                    self._order.append(sample_id)
+                self._rows[sample_id] = text
+                encoded.append(text)
+            self.version += 1
+        return encoded
+
+    def remove(self, sample_ids):
+        with self._lock:
+            sample_ids = set(sample_ids) & set(self._rows)
+            for sample_id in sample_ids:
+                del self._rows[sample_id]
+            self._order = [i for i in self._order if i not in sample_ids]
+            self.version += 1
+        return sorted(sample_ids)
+
+    def page(self, offset=0, limit=100):
+        with self._lock:
+            ids = self._order[offset:offset + limit]
+            rows = ",".join(self._rows[i] for i in ids)
+            return (f'{{"version":{self.version},"total":{len(self._order)},"offset":{offset},"limit":{limit},'
+                    f'"columns":{json.dumps(self.columns)},"rows":[{rows}]}}')
+
+
+class ResultsService:
+    def __init__(self, host="127.0.0.1", port=8765):
+        """ResultsService(host="127.0.0.1", port=8765)
+        local HTTP and WebSocket endpoint for the measured metrics, running its own asyncio loop in a background thread.
+            GET /samples?offset=0&limit=100   page of the metrics table
+            GET /columns                      column names
+            GET /ws                           websocket, one message {"event": "samples"|"removed", ...} per update
+        publish() and remove() may be called from any thread, usually the Tk loop"""
+        self.host = host
+        self.port = port
+        self.snapshot = Snapshot()
+
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._clients = set()   # websocket StreamWriters
+        self._started = threading.Event()
+
+    # Publishing, called from other threads
+
+    def publish(self, columns, rows):
+        """publish(columns, rows)
+        adds or replaces rows (dict sample id -> dict column -> value) and pushes them to every websocket reader"""
+        encoded = self.snapshot.update(columns, rows)
+        self._broadcast(f'{{"event":"samples","rows":[{",".join(encoded)}]}}')
+
+    def remove(self, sample_ids):
+        removed = self.snapshot.remove(sample_ids)
+        if removed:
+            self._broadcast(json.dumps({"event": "removed", "ids": removed}))
+
+    def _broadcast(self, message):
+        if self._loop is not None and self._clients:
+            self._loop.call_soon_threadsafe(self._send_all, _ws_frame(message.encode()))
+
+    # Server thread
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._started.wait()
+        if self._server is None:
+            raise OSError(f"Could not listen on {self.host}:{self.port}")
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        except OSError:
+            self._started.set()
+            loop.close()
+            return
+
+        self._loop = loop
+        self._started.set()
+        try:
+            loop.run_forever()
+        finally:
+            self._server.close()
+            for writer in self._clients:
+                writer.close()
+            self._clients.clear()
+            loop.run_until_complete(self._server.wait_closed())
+            loop.close()
+            self._server = None
+
+    def _send_all(self, frame):
+        for writer in list(self._clients):
+            if writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:  # reader stopped reading, don't buffer for it
+                self._clients.discard(writer)
+                writer.close()
+                continue
+            writer.write(frame)
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+
+        lines = request.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            await self._respond(writer, 400, "Bad Request", '{"error":"bad request"}')
+            return
+        headers = {k.strip().lower(): v.strip() for k, _, v in (l.partition(":") for l in lines[1:] if l)}
+        url = urlsplit(target)
+
+        if method != "GET":
+            await self._respond(writer, 405, "Method Not Allowed", '{"error":"only GET"}')
+        elif url.path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+            await self._websocket(reader, writer, headers)
+        elif url.path == "/samples":
+            query = parse_qs(url.query)
+            try:
+                offset = max(int(query.get("offset", ["0"])[0]), 0)
+                limit = min(max(int(query.get("limit", ["100"])[0]), 0), MAX_LIMIT)
+            except ValueError:
+                await self._respond(writer, 400, "Bad Request", '{"error":"offset and limit must be integers"}')
+                return
+            await self._respond(writer, 200, "OK", self.snapshot.page(offset, limit))
+        elif url.path == "/columns":
+            await self._respond(writer, 200, "OK", json.dumps(self.snapshot.columns))
+        else:
+            await self._respond(writer, 404, "Not Found", '{"error":"not found"}')
+
+    @staticmethod
+    async def _respond(writer, status, reason, body):
+        body = body.encode()
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                     f"Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n".encode() + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def _websocket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write(f"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                     f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode())
+        self._clients.add(writer)
+
+        try:    # updates are pushed by _send_all, only watch for pings and the close frame here
+            while True:
+                opcode, payload = await _ws_read(reader)
+                if opcode == 0x8:
+                    writer.write(_ws_frame(payload[:2], opcode=0x8))
+                    break
+                if opcode == 0x9:
+                    writer.write(_ws_frame(payload, opcode=0xA))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+
+def _ws_frame(payload, opcode=0x1):  # single unmasked server frame
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return header + payload
+
+
+async def _ws_read(reader):  # one client frame, clients always mask
+    first, second = await reader.readexactly(2)
+    n = second & 0x7F
+    if n == 126:
+        n, = struct.unpack("!H", await reader.readexactly(2))
+    elif n == 127:
+        n, = struct.unpack("!Q", await reader.readexactly(8))
+    mask = await reader.readexactly(4) if second & 0x80 else bytes(4)
+    payload = await reader.readexactly(n)
+    return first & 0x0F, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
@@ -0,0 +1,67 @@
+import numpy as np
+
+import centroids
+
+
+INTERPOLATIONS = ("fft", "linear")    # fft keeps the profile sharp, linear interpolation widens it slightly
+
+
+def column_positions(data, centroid="com", vertical_interval=5, bin_size=1):
+    """column_positions(data, centroid="com", vertical_interval=5, bin_size=1)
+    subpixel star row of every column of 2d data, centroid being one of centroids.CENTROIDS. With bin_size > 1 the centroid is measured once per bin of
+    bin_size columns (summed, for faint stars) and used for all columns of the bin"""
+    rows, cols = data.shape
+
+    if bin_size <= 1:
+        return np.asarray(centroids.centroid(data, centroid, vertical_interval), dtype=float)
+
+    bins = -(-cols // bin_size)
+    padded = np.zeros((rows, bins * bin_size), dtype=data.dtype)
+    padded[:, :cols] = data
+    binned = padded.reshape(rows, bins, bin_size).sum(axis=2)
+    return np.repeat(np.asarray(centroids.centroid(binned, centroid, vertical_interval), dtype=float), bin_size)[:cols]
+
+
+def shift_columns(data, shifts, interpolation="fft"):
+    """shift_columns(data, shifts, interpolation="fft")
+    moves every column of 2d data down by its (fractional) shift in one vectorized operation, shifted[y] = data[y - shift].
+    Rows that would have to come from outside the data are NaN instead of zero, so they don't pull sums down.
+    interpolation "fft" applies a phase ramp to the zero padded columns, "linear" mixes the two neighbouring rows"""
+    data = np.asarray(data, dtype=float)
+    rows, cols = data.shape
+    shifts = np.broadcast_to(np.asarray(shifts, dtype=float), (cols,))
+
+    source = np.arange(rows)[:, None] - shifts[None, :]
+    covered = (source >= 0) & (source <= rows - 1)
+
+    if interpolation == "linear":
+        lower = np.clip(np.floor(source).astype(np.int64), 0, rows - 1)
+        upper = np.minimum(lower + 1, rows - 1)
+        fraction = np.clip(source - lower, 0, 1)
+        shifted = (1 - fraction) * np.take_along_axis(data, lower, axis=0) + fraction * np.take_along_axis(data, upper, axis=0)
+    elif interpolation == "fft":
+        pad = int(np.ceil(np.max(np.abs(shifts), initial=0))) + 1     # zeros on both ends so nothing wraps around
+        n = rows + 2 * pad
+        spectrum = np.fft.rfft(np.pad(data, ((pad, pad), (0, 0))), axis=0)
+        ramp = np.exp(-2j * np.pi * np.fft.rfftfreq(n)[:, None] * shifts[None, :])
+        shifted = np.fft.irfft(spectrum * ramp, n=n, axis=0)[pad:pad + rows]
+    else:
+        raise ValueError(f"Invalid interpolation: {interpolation}")
+
+    return np.where(covered, shifted, np.nan)
+
+
+def shift_and_add(data, centroid="com", vertical_interval=5, bin_size=1, interpolation="fft"):
+    """shift_and_add(data, centroid="com", vertical_interval=5, bin_size=1, interpolation="fft")
+    realigns every column of 2d drift data so its centroid sits on the middle row.
+    returns (realigned data with NaN where no data was shifted in, crosssection, centroid positions)"""
+    positions = column_positions(data, centroid=centroid, vertical_interval=vertical_interval, bin_size=bin_size)
+    realigned = shift_columns(data, len(data) // 2 - positions, interpolation=interpolation)
+
+    # mean over the covered columns, scaled to a sum over all columns like get_realigned_crosssection
+    covered = np.count_nonzero(~np.isnan(realigned), axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        crosssection = np.where(covered > 0, np.nansum(realigned, axis=1) / covered * realigned.shape[1], 0.)
+
+    return realigned, crosssection, positions
+
@@ -0,0 +1,126 @@
+import numpy as np
+
+import profiling
+
+
+MAX_LUT_SIZE = 2 ** 20     # larger integer ranges (and float frames) are stretched pixel by pixel
+
+
+def _linear(values, counts):
+    return values / np.max(values)
+
+
+def _sqrt(values, counts):
+    values = np.sqrt(np.abs(values))
+    return values / np.max(values)
+
+
+def _log(values, counts):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = np.log10(np.abs(values))
+    return values / np.max(values[np.isfinite(values)])
+
+
+def _percentiles(values, counts, low=.5, high=99.5):
+    """values at the low and high percentile, from the histogram counts over values if there is one"""
+    if counts is None:
+        return np.percentile(values, (low, high))
+    cumulative = np.cumsum(counts) / np.sum(counts)
+    i = np.searchsorted(cumulative, (low / 100, high / 100))
+    return values[np.minimum(i, len(values) - 1)]
+
+
+def _percentile(values, counts):
+    lo, hi = _percentiles(values, counts)
+    return (values - lo) / max(hi - lo, 1e-12)
+
+
+def _asinh(values, counts, softening=.1):
+    lo, hi = _percentiles(values, counts, low=1, high=99.9)
+    values = np.clip((values - lo) / max(hi - lo, 1e-12), 0, None)
+    return np.arcsinh(values / softening) / np.arcsinh(1 / softening)
+
+
+# brightness curve -> func(values, counts) mapping values to [0, 1] (clipped afterwards), counts being the histogram over
+# values for lookup tables in HISTOGRAM_MODES and None otherwise
+MODES = {"linear": _linear,
+         "sqrt": _sqrt,
+         "log": _log,
+         "percentile": _percentile,
+         "asinh": _asinh}
+
+HISTOGRAM_MODES = {"percentile", "asinh"}   # the others only need the value range, no pass over the frame
+
+
+def _to_uint8(scaled):
+    scaled = np.nan_to_num(scaled, nan=0, posinf=1, neginf=0)
+    return np.uint8(np.clip(scaled, 0, 1) * 255)
+
+
+class Stretch:
+    def __init__(self, data):
+        """Stretch(data)
+        Param:
+        data = 2d numpy array: image pixels, usually the uint16 frame
+
+        maps an image to uint8 for display. For integer data every mode is a lookup table over the value range of the
+        frame, built once from its histogram, and every stretched image is cached, so switching modes back and forth
+        and flipping or rotating (see transform) don't touch the pixel values again"""
+        self.data = data
+        self._offset = None
+        self._values = None
+        self._counts = None
+        self._luts = {}     # mode -> uint8 lookup table
+        self._images = {}   # mode -> stretched uint8 image in the current orientation
+
+        if data.dtype.kind in "ui" and data.size:
+            lo, hi = int(np.min(data)), int(np.max(data))
+            if data.dtype.kind == "u":
+                lo = 0      # index the table with the pixels themselves, no offset copy of the frame
+            if hi - lo < MAX_LUT_SIZE:
+                self._offset = lo
+                self._values = np.arange(lo, hi + 1, dtype=np.float64)
+
+    def _histogram(self):
+        if self._counts is None:
+            with profiling.timer("Stretch.histogram", elements=self.data.size):
+                self._counts = np.bincount(self._indices().ravel(), minlength=len(self._values))
+        return self._counts
+
+    def _indices(self):
+        if self._offset == 0 and self.data.dtype.kind == "u":
+            return self.data
+        return self.data.astype(np.int64) - self._offset
+
+    def lut(self, mode):
+        """lut(mode)
+        uint8 lookup table of a mode indexed by pixel value - offset, None if the data can't use one"""
+        if self._values is None:
+            return None
+        if mode not in self._luts:
+            counts = self._histogram() if mode in HISTOGRAM_MODES else None
+            self._luts[mode] = _to_uint8(MODES[mode](self._values, counts))
+        return self._luts[mode]
+
+    def image(self, mode="log"):
+        """image(mode="log")
+        uint8 image of the data in the given brightness mode"""
+        if mode not in MODES:
+            raise ValueError(f"Invalid stretch mode: {mode}")
+
+        if mode not in self._images:
+            with profiling.timer("Stretch.image", elements=self.data.size):
+                lut = self.lut(mode)
+                if lut is not None:
+                    self._images[mode] = lut[self._indices()]
+                else:
+                    self._images[mode] = _to_uint8(MODES[mode](self.data.astype(np.float64), None))
+
+        return self._images[mode]
+
+    def transform(self, func):
+        """transform(func)
+        applies a flip or rotation like np.flipud to the data and to every cached image, lookup tables stay valid"""
+        self.data = func(self.data)
+        self._images = {mode: func(image) for mode, image in self._images.items()}
+        return self.data
@@ -0,0 +1,106 @@
+import numpy as np
+
+from datasample import DataSample
+
+
+def gaussian_profile(y, center, fwhm):
+    sigma = fwhm / (2 * np.sqrt(2 * np.log(2)))
+    return np.exp(-(y - center) ** 2 / (2 * sigma ** 2))
+
+
+def moffat_profile(y, center, fwhm, beta=4.765):
+    alpha = fwhm / (2 * np.sqrt(2 ** (1 / beta) - 1))
+    return (1 + ((y - center) / alpha) ** 2) ** -beta
+
+
+def _ar1(rng, length, std, correlation):  # stationary AR(1) series, used for the seeing wobble and the scintillation
+    noise = rng.normal(0, std * np.sqrt(1 - correlation ** 2), length)
+    series = np.empty(length)
+    series[0] = rng.normal(0, std)
+    for i in range(1, length):
+        series[i] = correlation * series[i - 1] + noise[i]
+    return series
+
+
+class SyntheticTrail:
+    def __init__(self, length=100, diameter=15, background_rows=10, psf="gaussian", fwhm=3.5, beta=4.765, flux=5e4,
+                 wobble=.5, wobble_correlation=.8, scintillation=.05, scintillation_correlation=.9, slope=0.,
+                 background=100., readout_noise=12.7865, time_per_pix=.066, dtype=np.uint16, seed=None):
+        """SyntheticTrail(length=100, diameter=15, ...)
+        Param:
+        length, diameter = int: size of the data aperture in pixels (x along the drift, y across)
+        psf = "gaussian" or "moffat", fwhm = float: seeing in pixels, beta = float: moffat exponent
+        flux = float: mean ADUs per column above background
+        wobble = float: std of the centroid motion in pixels, wobble_correlation = AR(1) correlation between columns
+        scintillation = float: relative std of the flux, scintillation_correlation = same for the flux
+        slope = float: drift misalignment in pixels per column
+        background, readout_noise = float: sky level and gaussian readout noise in ADUs
+
+        drift trail with known ground truth, as data aperture plus two background apertures"""
+        rng = np.random.default_rng(seed)
+        self.time_per_pix = time_per_pix
+        self.readout_noise = readout_noise
+
+        x = np.arange(length)
+        middle = diameter // 2
+
+        self.true_wobble = _ar1(rng, length, wobble, wobble_correlation) if wobble else np.zeros(length)
+        self.true_centroid = middle + slope * (x - length // 2) + self.true_wobble
+        self.true_flux = flux * np.exp(_ar1(rng, length, scintillation, scintillation_correlation)) if scintillation else np.full(length, float(flux))
+        self.true_fwhm = fwhm
+
+        y = np.arange(diameter)[:, None]
+        if psf == "moffat":
+            profile = moffat_profile(y, self.true_centroid, fwhm, beta)
+        elif psf == "gaussian":
+            profile = gaussian_profile(y, self.true_centroid, fwhm)
+        else:
+            raise ValueError(f"Invalid PSF: {psf}")
+        profile /= np.sum(profile, axis=0)
+
+        self.expected = profile * self.true_flux + background   # noise free data aperture
+        self.data = self._observe(rng, self.expected, dtype)
+        self.background1 = self._observe(rng, np.full((background_rows, length), float(background)), dtype)
+        self.background2 = self._observe(rng, np.full((background_rows, length), float(background)), dtype)
+
+    def _observe(self, rng, expected, dtype):  # photon noise plus readout noise, clipped to the sensor range
+        counts = rng.poisson(np.maximum(expected, 0)) + rng.normal(0, self.readout_noise, expected.shape)
+        if np.issubdtype(dtype, np.integer):
+            info = np.iinfo(dtype)
+            counts = np.clip(np.round(counts), info.min, info.max)
+        return counts.astype(dtype)
+
+    def sample(self, meta_info=None, title=""):
+        if meta_info is None:
+            meta_info = {"altitude": "45deg", "declination": 0., "exposure": 30., "time_per_pix": self.time_per_pix}
+        return DataSample(self.data, self.time_per_pix, self.background1, self.background2, meta_info=meta_info,
+                          title=title, readout_noise=self.readout_noise)
+
+
+def make_frame(shape=(1024, 1024), stars=40, length=100, fwhm=3.5, flux_range=(2e4, 2e5), background=100.,
+               readout_noise=12.7865, dtype=np.uint16, seed=None, **trail_args):
+    """make_frame(shape=(1024, 1024), stars=40, ...)
+    full frame with horizontal drift trails starting at random positions, for detect_stars and whole-frame paths.
+    returns the frame and the (y, x) start of every trail"""
+    rng = np.random.default_rng(seed)
+    height, width = shape
+    diameter = int(4 * fwhm) | 1
+
+    expected = np.full(shape, float(background))
+    positions = []
+
+    for _ in range(stars):
+        y = int(rng.integers(diameter, height - diameter))
+        x = int(rng.integers(0, width - length))
+        trail = SyntheticTrail(length=length, diameter=diameter, fwhm=fwhm, flux=rng.uniform(*flux_range), background=0,
+                               seed=int(rng.integers(2**31)), **trail_args)
+        top = y - diameter // 2
+        expected[top:top + diameter, x:x + length] += trail.expected
+        positions.append((y, x))
+
+    counts = rng.poisson(np.maximum(expected, 0)) + rng.normal(0, readout_noise, shape)
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        counts = np.clip(np.round(counts), info.min, info.max)
+
+    return counts.astype(dtype), positions
@@ -0,0 +1,142 @@
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from frames import Frame, Aperture, ORIENTATIONS, header_declination, orient, time_per_pix
+import planner
+
+
+# one aperture per record, same fields and order as Aperture.FIELDS and App.apertures
+APERTURE_DTYPE = np.dtype([("x", np.int32), ("y", np.int32), ("length", np.int32), ("diameter", np.int32),
+                           ("lower_enabled", np.bool_), ("lower_offset", np.int32), ("lower_diameter", np.int32),
+                           ("upper_enabled", np.bool_), ("upper_offset", np.int32), ("upper_diameter", np.int32)])
+
+
+def to_array(apertures):
+    """to_array(apertures)
+    structured APERTURE_DTYPE array of Apertures or aperture tuples"""
+    return np.array([a.as_tuple() if isinstance(a, Aperture) else tuple(a) for a in apertures], dtype=APERTURE_DTYPE)
+
+
+def from_array(records):
+    return [Aperture(*(r[f].item() for f in Aperture.FIELDS)) for r in np.atleast_1d(records)]
+
+
+def save_template(path, apertures):
+    """save_template(path, apertures)
+    writes an aperture set: .npy files keep the typed records, anything else is the old comma separated text format"""
+    records = to_array(apertures)
+    if path.lower().endswith(".npy"):
+        np.save(path, records, allow_pickle=False)
+    else:
+        np.savetxt(path, np.array(records.tolist(), dtype=np.int64).reshape(-1, len(Aperture.FIELDS)), delimiter=",", fmt="%d")
+
+
+def load_template(path):
+    """load_template(path)
+    structured APERTURE_DTYPE array from a .npy template or an old csv aperture file"""
+    if path.lower().endswith(".npy"):
+        records = np.load(path, allow_pickle=False)
+        if records.dtype != APERTURE_DTYPE:
+            raise ValueError(f"{path} is not an aperture template")
+        return records
+
+    rows = np.atleast_2d(np.genfromtxt(path, delimiter=","))
+    if rows.size == 0:
+        return np.zeros(0, dtype=APERTURE_DTYPE)
+    return np.array([tuple(map(int, r)) for r in rows], dtype=APERTURE_DTYPE)
+
+
+def measure_frame(path, apertures, arcsec_per_pix, declination=None, readout_noise=12.7865, orientation=()):
+    """measure_frame(path, apertures, arcsec_per_pix, declination=None, readout_noise=12.7865, orientation=())
+    applies a template to one FITS file, all cutouts gathered at once. The frame is flipped and rotated by orientation
+    (see frames.orient) first, the apertures are in the coordinates of the oriented image. The declination is read from
+    the header unless given. returns (samples, titles)"""
+    frame = Frame.open(path, memmap=False)
+    frame = frame.transformed(orient(frame.data, orientation))
+
+    if declination is None:
+        declination = header_declination(frame.header)
+        if declination is None:
+            raise ValueError(f"{path} has no OBJCTDEC, pass the declination")
+    tpp = time_per_pix(declination, arcsec_per_pix)
+
+    altitude = re.search(r"[\d.]+deg", path)
+    meta_info = {"altitude": altitude.group() if altitude else None,
+                 "declination": declination,
+                 "exposure": frame.header.get("EXPOSURE"),
+                 "time_per_pix": tpp,
+                 "file": path}
+
+    samples = planner.cut_samples(frame, apertures, tpp, meta_info=meta_info, readout_noise=readout_noise)
+    frame.close()
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    return samples, [f"{name} #{i + 1}" for i in range(len(samples))]
+
+
+def apply_template(paths, apertures, arcsec_per_pix, declination=None, workers=None, callback=None, orientation=()):
+    """apply_template(paths, apertures, arcsec_per_pix, declination=None, workers=None, callback=None, orientation=())
+    measures the same apertures in many frames without the GUI, one frame per worker process, every frame oriented
+    like the one the apertures were placed in.
+    callback(path, samples, titles) is called for every frame as soon as it is done, in order of the paths.
+    returns dict path -> error message of the frames that failed"""
+    apertures = [a if isinstance(a, Aperture) else Aperture.from_tuple(a) for a in apertures]
+    orientation = tuple(orientation)
+    errors = {}
+
+    if workers is None:
+        workers = min(len(paths), os.cpu_count() or 1)
+
+    def collect(path, compute):
+        try:
+            samples, titles = compute()
+        except Exception as e:     # one broken frame should not stop the other ones
+            errors[path] = f"{type(e).__name__}: {e}"
+            return
+        if callback:
+            callback(path, samples, titles)
+
+    if workers <= 1:
+        for path in paths:
+            collect(path, lambda: measure_frame(path, apertures, arcsec_per_pix, declination, orientation=orientation))
+        return errors
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(path, pool.submit(measure_frame, path, apertures, arcsec_per_pix, declination, orientation=orientation)) for path in paths]
+        for path, future in futures:
+            collect(path, future.result)
+
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure an aperture template in many FITS files and write one session json")
+    parser.add_argument("template", help=".npy template or csv aperture file")
+    parser.add_argument("frames", nargs="+", help="FITS files")
+    parser.add_argument("--arcsec-per-pix", type=float, required=True)
+    parser.add_argument("--declination", type=float, default=None, help="degrees, read from OBJCTDEC if not given")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--orientation", nargs="*", choices=sorted(ORIENTATIONS), default=[],
+                        help="flips and rotations, in order, of the image the apertures were placed in")
+    parser.add_argument("--out", required=True, help="session json, same format as Save in the Measurements window")
+    args = parser.parse_args()
+
+    session = {}
+
+    def add(path, samples, titles):
+        for sample, title in zip(samples, titles):
+            session[title] = sample.get_json()
+        print(f"{path}: {len(samples)} samples")
+
+    failed = apply_template(args.frames, from_array(load_template(args.template)), args.arcsec_per_pix, args.declination,
+                            workers=args.workers, callback=add, orientation=args.orientation)
+    for path, error in failed.items():
+        print(f"{path} failed: {error}")
+
+    with open(args.out, "w") as f:
+        json.dump(session, f)
@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from frames import Frame, Aperture, header_declination, time_per_pix
+import planner
+
+
+# one row per star and frame it was measured in
+TRACK_DTYPE = np.dtype([("star", np.int64), ("frame", np.int64), ("time", np.float64), ("y", np.float64), ("x", np.float64),
+                        ("flux", np.float64), ("fwhm", np.float64), ("wobble", np.float64)])
+
+
+def estimate_offset(reference, positions, bin_size=4):
+    """estimate_offset(reference, positions, bin_size=4)
+    global (dy, dx) shift from the reference to the new (y, x) star positions: the FFT cross-correlation of both
+    point sets binned into bin_size pixel cells, refined with the median residual of the matched nearest neighbours"""
+    reference, positions = np.asarray(reference, float).reshape(-1, 2), np.asarray(positions, float).reshape(-1, 2)
+    if not len(reference) or not len(positions):
+        return np.zeros(2)
+
+    lo = np.minimum(reference.min(axis=0), positions.min(axis=0))
+    hi = np.maximum(reference.max(axis=0), positions.max(axis=0))
+    shape = (np.ceil((hi - lo + 1) / bin_size).astype(int) * 2)     # padded, the correlation must not wrap around
+
+    def binned(points):
+        cells = ((points - lo) // bin_size).astype(int)
+        grid = np.zeros(shape)
+        np.add.at(grid, (cells[:, 0], cells[:, 1]), 1)
+        return grid
+
+    correlation = np.fft.irfft2(np.fft.rfft2(binned(positions)) * np.conj(np.fft.rfft2(binned(reference))), s=shape)
+    peak = np.array(np.unravel_index(np.argmax(correlation), shape))
+    peak = np.where(peak > shape // 2, peak - shape, peak)      # negative shifts wrap to the end
+    offset = peak * float(bin_size)
+
+    distance, nearest = cKDTree(positions).query(reference + offset, distance_upper_bound=2 * bin_size)
+    found = np.isfinite(distance)
+    if np.any(found):
+        offset += np.median(positions[nearest[found]] - (reference[found] + offset), axis=0)
+
+    return offset
+
+
+def match(predicted, positions, max_distance=5.):
+    """match(predicted, positions, max_distance=5.)
+    pairs (i, j) of predicted and detected positions that are each other's nearest neighbour within max_distance,
+    O(n log n) with one KD tree per side"""
+    predicted, positions = np.asarray(predicted, float).reshape(-1, 2), np.asarray(positions, float).reshape(-1, 2)
+    if not len(predicted) or not len(positions):
+        return np.zeros((0, 2), dtype=np.int64)
+
+    distance, j = cKDTree(positions).query(predicted, distance_upper_bound=max_distance)
+    _, back = cKDTree(predicted).query(positions, distance_upper_bound=max_distance)
+
+    i = np.flatnonzero(np.isfinite(distance))
+    mutual = back[j[i]] == i
+    return np.stack((i[mutual], j[i][mutual]), axis=-1)
+
+
+class StarTracker:
+    def __init__(self, max_distance=5., max_missing=3, bin_size=4):
+        """StarTracker(max_distance=5., max_missing=3, bin_size=4)
+        Param:
+        max_distance = float: pixels a star may be off its predicted position and still count as the same star
+        max_missing = int: frames a star may go undetected (clouds, saturation) before it is dropped from matching
+
+        gives the stars of a frame sequence persistent ids and collects their measurements per frame"""
+        self.max_distance = max_distance
+        self.max_missing = max_missing
+        self.bin_size = bin_size
+
+        self.frames = 0
+        self.next_id = 0
+        self.offsets = []   # (dy, dx) of every frame relative to the one before
+
+        self._ids = np.zeros(0, dtype=np.int64)         # stars still tracked
+        self._positions = np.zeros((0, 2))              # their last position, moved along with the frame offsets
+        self._missing = np.zeros(0, dtype=np.int64)     # frames since they were last seen
+        self._detections = np.zeros((0, 2))             # all detections of the previous frame, for the offset
+
+        self._rows = []
+
+    def add_frame(self, positions, values=None, time=None):
+        """add_frame(positions, values=None, time=None)
+        Param:
+        positions = (n, 2) array of (y, x) star positions in this frame
+        values = dict "flux"/"fwhm"/"wobble" -> n values measured at these positions, NaN if missing
+        time = float: time of the frame, the frame number if None
+
+        matches the stars to the tracked ones and returns the star id of every position"""
+        positions = np.asarray(positions, float).reshape(-1, 2)
+        values = values or {}
+
+        offset = estimate_offset(self._detections, positions, self.bin_size) if self.frames else np.zeros(2)
+        self.offsets.append(offset)
+
+        ids = np.full(len(positions), -1, dtype=np.int64)
+        pairs = match(self._positions + offset, positions, self.max_distance)
+        ids[pairs[:, 1]] = self._ids[pairs[:, 0]]
+
+        seen = np.zeros(len(self._ids), dtype=bool)
+        seen[pairs[:, 0]] = True
+        self._positions = self._positions + offset
+        self._positions[pairs[:, 0]] = positions[pairs[:, 1]]
+        self._missing = np.where(seen, 0, self._missing + 1)
+
+        new = ids < 0
+        ids[new] = np.arange(self.next_id, self.next_id + np.count_nonzero(new))
+        self.next_id += np.count_nonzero(new)
+
+        keep = self._missing <= self.max_missing
+        self._ids = np.concatenate((self._ids[keep], ids[new]))
+        self._positions = np.concatenate((self._positions[keep], positions[new]))
+        self._missing = np.concatenate((self._missing[keep], np.zeros(np.count_nonzero(new), dtype=np.int64)))
+        self._detections = positions
+
+        rows = np.zeros(len(positions), dtype=TRACK_DTYPE)
+        rows["star"], rows["frame"] = ids, self.frames
+        rows["time"] = self.frames if time is None else time
+        rows["y"], rows["x"] = positions[:, 0], positions[:, 1]
+        for name in ("flux", "fwhm", "wobble"):
+            rows[name] = values.get(name, np.full(len(positions), np.nan))
+        self._rows.append(rows)
+
+        self.frames += 1
+        return ids
+
+    def table(self):  # every measurement as one TRACK_DTYPE array, sorted by star and frame
+        rows = np.concatenate(self._rows) if self._rows else np.zeros(0, dtype=TRACK_DTYPE)
+        return rows[np.lexsort((rows["frame"], rows["star"]))]
+
+    def series(self, min_frames=2):
+        """series(min_frames=2)
+        dict star id -> TRACK_DTYPE rows of that star over the sequence, for stars seen in at least min_frames frames"""
+        rows = self.table()
+        stars, starts, counts = np.unique(rows["star"], return_index=True, return_counts=True)
+        return {int(s): rows[i:i + n] for s, i, n in zip(stars, starts, counts) if n >= min_frames}
+
+
+def _fwhm(sample):  # NaN when the half maximum is not inside the aperture, e.g. the star peaks on an edge row
+    try:
+        return sample.get_fwhm()[0]
+    except (ValueError, IndexError):
+        return np.nan
+
+
+def measure_stars(samples):
+    """measure_stars(samples)
+    flux, FWHM and centroid wobble (standard deviation of the maximum shift) of samples, in the form add_frame takes"""
+    return {"flux": np.array([s.get_luminosity()[0] for s in samples], dtype=float),
+            "fwhm": np.array([_fwhm(s) for s in samples], dtype=float),
+            "wobble": np.array([np.std(s.get_maximum_shift()) for s in samples], dtype=float)}
+
+
+def track_files(paths, template, arcsec_per_pix, declination=None, threshold=None, max_distance=5.):
+    """track_files(paths, template, arcsec_per_pix, declination=None, threshold=None, max_distance=5.)
+    detects and measures the stars of every frame with the aperture geometry of template and tracks them through
+    the sequence. Frames with vertical or mirrored trails are turned like in Auto Measure first. returns the StarTracker"""
+    from watcher import oriented_stars
+
+    tracker = StarTracker(max_distance=max_distance)
+
+    for path in paths:
+        frame = Frame.open(path, memmap=False)
+        dec = declination if declination is not None else header_declination(frame.header)
+        if dec is None:
+            raise ValueError(f"{path} has no OBJCTDEC, pass the declination")
+
+        data, stars = oriented_stars(frame.data, threshold, min_separation=20)
+        apertures = planner.plan_apertures(stars, data.shape, template)
+        samples = planner.cut_samples(frame.transformed(data), apertures, time_per_pix(dec, arcsec_per_pix))
+        frame.close()
+
+        positions = [(a.y, a.x - template.diameter // 2) for a in apertures]   # the star, not the aperture start
+        tracker.add_frame(positions, measure_stars(samples), time=frame.header.get("JD", None))
+
+    return tracker
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Track the stars of a frame sequence and write per-star time series")
+    parser.add_argument("frames", nargs="+", help="FITS files, in time order")
+    parser.add_argument("--arcsec-per-pix", type=float, required=True)
+    parser.add_argument("--declination", type=float, default=None, help="degrees, read from OBJCTDEC if not given")
+    parser.add_argument("--length", type=int, default=100)
+    parser.add_argument("--diameter", type=int, default=15)
+    parser.add_argument("--max-distance", type=float, default=5.)
+    parser.add_argument("--out", required=True, help="json with one time series per star")
+    args = parser.parse_args()
+
+    tracker = track_files(args.frames, Aperture(0, 0, args.length, args.diameter), args.arcsec_per_pix, args.declination,
+                          max_distance=args.max_distance)
+
+    with open(args.out, "w") as f:
+        json.dump({str(star): {name: rows[name].tolist() for name in TRACK_DTYPE.names if name != "star"}
+                   for star, rows in tracker.series().items()}, f)
+    print(f"{len(tracker.series())} stars tracked through {tracker.frames} frames, written to {os.path.abspath(args.out)}")
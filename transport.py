@@ -0,0 +1,181 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from frames import Frame, Aperture
+
+
+class FrameHandle:
+    def __init__(self, name, shape, dtype, path=None):
+        """FrameHandle(name, shape, dtype, path=None)
+        what a worker gets instead of the pixels: the name of the shared memory block and how to read it. Pickles to
+        a few bytes whatever the size of the frame"""
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+        self.path = path
+
+    def __repr__(self):
+        return f"FrameHandle({self.name!r}, {self.shape}, {self.dtype!r})"
+
+
+class SharedFrame:
+    def __init__(self, data, path=None):
+        """SharedFrame(data, path=None)
+        copies frame pixels once into a multiprocessing shared memory block that any number of worker processes can
+        map without copying.
+
+        The block is reference counted: the creator holds one reference, every task submitted with submit() one more
+        until it is finished. It is unlinked as soon as the last one is released, never while a worker might still
+        read it"""
+        data = np.asarray(data)
+        self._shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        self.data = np.ndarray(data.shape, dtype=data.dtype, buffer=self._shm.buf)
+        self.data[...] = data
+        self.data.flags.writeable = False
+
+        self.handle = FrameHandle(self._shm.name, data.shape, data.dtype, path)
+        self._refs = 1
+        self._lock = threading.Lock()   # futures release their reference from the executor's thread
+
+    @property
+    def closed(self):
+        return self._shm is None
+
+    def acquire(self):
+        with self._lock:
+            if self._shm is None:
+                raise ValueError("SharedFrame is already released")
+            self._refs += 1
+        return self.handle
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            if self._refs or self._shm is None:
+                return
+            shm, self._shm = self._shm, None
+
+        self.data = None
+        shm.unlink()    # the name goes now, the memory once no process maps it any more
+        _close(shm)
+
+    def submit(self, pool, func, *args, **kwargs):
+        """submit(pool, func, *args, **kwargs)
+        pool.submit(func, handle, *args, **kwargs) holding a reference until the task is done"""
+        handle = self.acquire()
+        try:
+            future = pool.submit(func, handle, *args, **kwargs)
+        except BaseException:
+            self.release()
+            raise
+        future.add_done_callback(lambda f: self.release())
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+_lingering = []     # blocks that could not be closed yet because views of them were still alive
+
+
+def _close(shm=None):  # closes shm and every lingering block whose views are gone by now
+    if shm is not None:
+        _lingering.append(shm)
+    for block in list(_lingering):
+        try:
+            block.close()
+        except BufferError:
+            continue
+        _lingering.remove(block)
+
+
+@contextmanager
+def attach(handle):
+    """attach(handle)
+    worker side: a read only Frame on the shared pixels of handle, valid inside the with block. Nothing is copied,
+    samples cut from it are views of the block"""
+    _close()
+
+    shm = shared_memory.SharedMemory(name=handle.name)
+    data = np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=shm.buf)
+    data.flags.writeable = False
+    try:
+        yield Frame(data, path=handle.path)
+    finally:
+        del data
+        _close(shm)     # stays open until the next attach if the task result still references the block
+
+
+def measure_apertures(handle, apertures, time_per_pix, metric_names, meta_info={}, readout_noise=12.7865):
+    """measure_apertures(handle, apertures, time_per_pix, metric_names, meta_info={}, readout_noise=12.7865)
+    worker: cuts the samples of apertures straight out of the shared frame and computes the named registered
+    metrics for them. returns dict metric name -> array, the samples themselves never leave the worker"""
+    import metrics
+    import planner
+
+    registered = {m.name: m for m in metrics.METRICS}
+    table = metrics.MetricsTable([registered[name] for name in metric_names])
+
+    with attach(handle) as frame:
+        samples = planner.cut_samples(frame, apertures, time_per_pix, meta_info=meta_info, readout_noise=readout_noise)
+        values = table.compute(samples)
+        del samples
+    return values
+
+
+def can_measure(metric_list):  # True if workers can rebuild every metric from the registry by its name
+    import metrics
+
+    registered = {m.name: m for m in metrics.METRICS}
+    return all(registered.get(m.name) is m for m in metric_list)
+
+
+_pool = None        # worker processes of measure_parallel, started on first use and kept for the next calls
+_pool_workers = 0
+
+
+def _get_pool(workers):
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        shutdown()
+        _pool = ProcessPoolExecutor(max_workers=workers)
+        _pool_workers = workers
+    return _pool
+
+
+def shutdown():  # stops the worker processes of measure_parallel, the next call starts new ones
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def measure_parallel(shared, apertures, time_per_pix, metric_names, meta_info={}, readout_noise=12.7865, workers=None):
+    """measure_parallel(shared, apertures, time_per_pix, metric_names, meta_info={}, readout_noise=12.7865, workers=None)
+    metrics of many apertures of one SharedFrame, the apertures split evenly over the worker processes. Each worker
+    only receives the frame handle and its aperture geometry. The workers are kept between calls, see shutdown().
+    returns dict metric name -> array in aperture order"""
+    apertures = [a if isinstance(a, Aperture) else Aperture.from_tuple(a) for a in apertures]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pool = _get_pool(max(1, workers))
+
+    chunks = [c for c in np.array_split(np.arange(len(apertures)), max(1, min(workers, len(apertures)))) if len(c)]
+    try:
+        futures = [shared.submit(pool, measure_apertures, [apertures[i] for i in chunk], time_per_pix, list(metric_names), meta_info,
+                                 readout_noise) for chunk in chunks]
+        parts = [f.result() for f in futures]
+    except BrokenProcessPool:   # a worker died, start new ones next time
+        shutdown()
+        raise
+
+    return {name: np.concatenate([p[name] for p in parts]) for name in metric_names}
@@ -1,17 +1,20 @@
 import numpy as np
-from astropy.io import fits
 from os import listdir
-from skimage.feature import peak_local_max
-import matplotlib.pyplot as plt
 
+import profiling
 
+
+@profiling.timed("util.detect_stars")
 def detect_stars(data_image, threshold_abs=None, min_separation=20, scan_length=100, scan_diameter=15):
     """Takes and image and finds local maxima, returns points and checks if drift line needs to be flipped for analyzer to work.
     reduces or increases threshold, if it finds less than 10 or more than 100 local maxima"""
+    from skimage.feature import peak_local_max     # slow to import, only needed once stars are detected
+
     if not threshold_abs:
         threshold_abs = np.max(data_image) / 20
 
-    xy = peak_local_max(data_image, min_distance=min_separation, threshold_abs=threshold_abs)
+    with profiling.timer("peak_local_max", elements=data_image.size):
+        xy = peak_local_max(data_image, min_distance=min_separation, threshold_abs=threshold_abs)
     y, x = [i[0] for i in xy], [i[1] for i in xy]
 
     points = list(zip(y, x))
@@ -62,9 +65,17 @@ def detect_stars(data_image, threshold_abs=None, min_separation=20, scan_length=
 
     return points, should_flip, should_rotate_cw
 
+def _difference(a, b):  # a - b without overflow: int64 for integer frames, float for BSCALE/BZERO scaled ones
+    dtype = np.int64 if np.issubdtype(a.dtype, np.integer) and np.issubdtype(b.dtype, np.integer) else np.float64
+    return np.subtract(a, b, dtype=dtype)
+
+
+@profiling.timed("util.get_readout_noise")
 def get_readout_noise(directory_of_bias, quick=False):
     """returns the average standard deviation for the difference of two bias images. matches every possible combination of two files, so it's
     lengthy and scales with O(n^2), so use with care with larger number of files. pass quick=True to only do one pair"""
+    from astropy.io import fits
+
     files = [directory_of_bias + file for file in listdir(directory_of_bias) if (file.lower().endswith(".fit") or file.lower().endswith("fits")) and not file.startswith("Master")]
 
     stdevs = []
@@ -79,13 +90,16 @@ def get_readout_noise(directory_of_bias, quick=False):
 
             f2 = fits.open(file2)
 
-            stdevs.append(np.std(np.array(f1[0].data, dtype=int) - np.array(f2[0].data, dtype=int)))
+            stdevs.append(np.std(_difference(f1[0].data, f2[0].data)))
 
             if quick:
                 return stdevs[0]
     return np.median(stdevs)
 
+@profiling.timed("util.get_dark_noise")
 def get_dark_noise(directory_of_dark, quick=False):
+    from astropy.io import fits
+
     files = [directory_of_dark + file for file in listdir(directory_of_dark) if (file.lower().endswith(".fit") or file.lower().endswith("fits")) and not file.startswith("Master")]
 
     stdevs = []
@@ -94,7 +108,7 @@ def get_dark_noise(directory_of_dark, quick=False):
         f = fits.open(file)
         print(f"Calculating Stddev of file {i}. {i/len(files) * 100}% done")
 
-        stdevs.append(np.std(np.array(f[0].data, dtype=int)))
+        stdevs.append(np.std(f[0].data))
 
         if quick:
             break
@@ -0,0 +1,206 @@
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from frames import Frame, Aperture
+import planner
+import profiling
+
+
+EXTENSIONS = (".fits", ".fit", ".fts")
+
+
+def default_config(app):
+    """default_config(app)
+    measurement settings of the main window, used for every frame the watcher picks up"""
+    return {"threshold": None,
+            "min_separation": 20,
+            "length": app.data_aperture_length,
+            "diameter": app.data_aperture_diameter,
+            "lower_offset": app.back_aperture_offset_lower,
+            "lower_diameter": app.back_aperture_diameter_lower,
+            "upper_offset": app.back_aperture_offset_upper,
+            "upper_diameter": app.back_aperture_diameter_upper,
+            "declination": app.declination,
+            "time_per_pix": app.time_per_pix}
+
+
+def oriented_stars(data, threshold, min_separation=20):
+    """oriented_stars(data, threshold, min_separation=20)
+    detects the stars and flips and rotates the data so the trails run along x, like App.auto_measure.
+    returns (transformed data, stars in it)"""
+    import util
+
+    stars, should_flip, should_rotate = util.detect_stars(data, threshold, min_separation=min_separation)
+
+    if should_flip:
+        data = np.fliplr(data)
+    if should_rotate:
+        data = np.rot90(data, 3)
+    if should_flip or should_rotate:
+        stars, _, _ = util.detect_stars(data, threshold, min_separation=min_separation)
+    return data, stars
+
+
+def auto_apertures(data, config):
+    """auto_apertures(data, config)
+    headless version of App.auto_measure: orients the data (see oriented_stars) and places one aperture per star that
+    is neither overlapping another one nor leaving the image.
+    returns (transformed data, list of Aperture)"""
+    data, stars = oriented_stars(data, config["threshold"], min_separation=config["min_separation"])
+
+    template = Aperture(0, 0, config["length"], config["diameter"], True, config["lower_offset"], config["lower_diameter"], True,
+                        config["upper_offset"], config["upper_diameter"])
+    apertures = planner.plan_apertures(stars, data.shape, template)
+
+    return data, apertures
+
+
+def measure_file(path, config):
+    """measure_file(path, config)
+    worker: opens one frame, places the apertures and cuts the samples.
+    returns (samples, titles)"""
+    frame = Frame.open(path, memmap=False)
+    data, apertures = auto_apertures(frame.data, config)
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    altitude = re.search(r"[\d.]+deg", path)
+    meta_info = {"altitude": altitude.group() if altitude else None,
+                 "declination": config["declination"],
+                 "exposure": frame.header.get("EXPOSURE") if frame.header is not None else None,
+                 "time_per_pix": config["time_per_pix"],
+                 "file": path}
+
+    samples = planner.cut_samples(frame.transformed(data), apertures, config["time_per_pix"], meta_info=meta_info)
+    titles = [f"{name} #{i + 1}" for i in range(len(samples))]
+
+    frame.close()
+    return samples, titles
+
+
+class DirectoryWatcher:
+    def __init__(self, directory, config, interval=1., settle=1., max_pending=4, max_results=16, workers=None, include_existing=False):
+        """DirectoryWatcher(directory, config, interval=1., settle=1., max_pending=4, max_results=16, workers=None)
+        Param:
+        directory = str: capture directory, polled every interval seconds
+        config = dict: measurement settings, see default_config
+        settle = float: seconds a file's size and modification time must stay the same before it counts as written
+        max_pending = int: frames being measured at the same time, further ready files wait as paths only
+        max_results = int: measured frames waiting to be taken by results(); when full the watcher stops submitting
+        workers = int: worker processes, None for one per cpu up to max_pending
+
+        measures new FITS files in the background as soon as the camera has finished writing them"""
+        self.directory = directory
+        self.config = config
+        self.interval = interval
+        self.settle = settle
+        self.max_pending = max_pending
+        self.workers = workers or min(max_pending, os.cpu_count() or 1)
+
+        self._seen = {}         # path -> (size, mtime, time the pair was first seen)
+        self._done = set()      # paths queued, submitted or finished, never measured twice
+        self._ready = []        # written files waiting for a free slot
+        self._pending = {}      # future -> (path, time it was ready)
+        self._results = queue.Queue(maxsize=max_results)
+        self.errors = {}        # path -> error message
+        self.processed = 0
+
+        if not include_existing:
+            self._done.update(self._scan())
+
+        self._pool = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _scan(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return [os.path.join(self.directory, n) for n in sorted(names) if n.lower().endswith(EXTENSIONS)]
+
+    def _written(self, path, now):  # True once size and mtime stayed the same for settle seconds
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._seen.pop(path, None)
+            return False
+
+        key = (stat.st_size, stat.st_mtime)
+        size, mtime, since = self._seen.get(path, (None, None, now))
+        if (size, mtime) != key:
+            self._seen[path] = (*key, now)
+            return False
+        return stat.st_size > 0 and now - since >= self.settle
+
+    def poll(self):
+        """poll()
+        one scan of the directory: collects finished measurements, queues newly written files and submits as many as
+        the pending limit and the result queue allow"""
+        now = time.monotonic()
+
+        for future in [f for f in self._pending if f.done()]:
+            if self._results.full():
+                break   # backpressure: nobody takes the results, keep them in the pool
+            path, ready = self._pending.pop(future)
+            try:
+                samples, titles = future.result()
+            except Exception as e:     # a broken frame should not stop the night
+                self.errors[path] = f"{type(e).__name__}: {e}"
+                continue
+            self.processed += 1
+            if profiling.ENABLED:
+                profiling.record("DirectoryWatcher.latency", time.monotonic() - ready, elements=len(samples))
+            self._results.put((path, samples, titles))
+
+        for path in self._scan():
+            if path not in self._done and self._written(path, now):
+                self._seen.pop(path, None)
+                self._done.add(path)
+                self._ready.append((path, now))
+
+        while self._ready and len(self._pending) < self.max_pending and not self._results.full():
+            path, ready = self._ready.pop(0)
+            self._pending[self._get_pool().submit(measure_file, path, self.config)] = (path, ready)
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def results(self):
+        """results()
+        all measured frames available right now as (path, samples, titles), never blocks"""
+        while True:
+            try:
+                yield self._results.get_nowait()
+            except queue.Empty:
+                return
+
+    @property
+    def backlog(self):  # files written but not measured yet
+        return len(self._ready) + len(self._pending)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll()
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None